@@ -0,0 +1,217 @@
+"""Generators for synthetic data and rules files used by the benchmarks.
+
+Data files use the column layout of Sonobat or Kaleidoscope output, with
+random (but reproducible) values.  Rules files mix numeric, set, not, and blank
+criteria against the same columns, so that rules match a realistic share of
+rows.
+
+Usage:
+    python -m benchmarks.generate data <filename> --rows 100000
+    python -m benchmarks.generate rules <filename> --rules 100
+"""
+
+import os
+import csv
+import random
+import datetime
+
+import click
+from openpyxl import Workbook
+
+
+SPECIES = [
+    'ANPA', 'COTO', 'EPFU', 'LABL', 'LACI', 'LANO', 'MYCA', 'MYEV', 'MYLU', 'MYTH',
+    'MYVO', 'MYYU', 'PAHE', 'TABR',
+]
+
+# Maximum number of data rows in an XLSX worksheet (excluding the header)
+XLSX_MAX_ROWS = 1048575
+
+
+# Columns of each layout, as (name, kind, options):
+# - filename: pass filename, options is a format string
+# - species: species code, options is the probability of being blank
+# - int / float: number, options is (min, max)
+# - flag: 1 or blank, options is the probability of being 1
+# - text: constant value not used by rules
+LAYOUTS = {
+    'sonobat': [
+        ('Filename', 'filename', 'SITE01_{0:%Y%m%d}_{0:%H%M%S}_{1:03d}.wav'),
+        ('#Maj', 'int', (0, 15)),
+        ('#Accp', 'int', (0, 15)),
+        ('1st', 'species', 0.05),
+        ('2nd', 'species', 0.25),
+        ('3rd', 'species', 0.5),
+        ('~Spp', 'species', 0.9),
+        ('Fc mean', 'float', (10, 60)),
+        ('Dur mean', 'float', (1, 20)),
+        ('HiF', 'flag', 0.3),
+        ('LoF', 'flag', 0.3),
+        ('Path', 'text', 'D:\\SITE01\\Data'),
+    ],
+    'kaleidoscope': [
+        ('IN FILE', 'filename', 'S4U01234_{0:%Y%m%d}_{0:%H%M%S}.wav'),
+        ('AUTO ID*', 'species', 0.1),
+        ('MATCHING', 'int', (0, 40)),
+        ('MATCH RATIO', 'float', (0, 1)),
+        ('MARGIN', 'float', (0, 1)),
+        ('ALTERNATE 1', 'species', 0.4),
+        ('ALTERNATE 2', 'species', 0.7),
+        ('N', 'int', (1, 60)),
+        ('Fc', 'float', (10, 60)),
+        ('Dur', 'float', (1, 20)),
+        ('FOLDER', 'text', 'SITE01'),
+    ],
+}
+
+# Result columns of generated rules
+RESULT_COLS = ['Rule', 'Species', 'Inspect']
+
+
+def _value(rand, kind, options, start):
+    if kind == 'filename':
+        timestamp = start + datetime.timedelta(seconds=rand.randrange(30 * 24 * 3600))
+        return options.format(timestamp, rand.randrange(1000))
+    if kind == 'species':
+        return '' if rand.random() < options else rand.choice(SPECIES)
+    if kind == 'int':
+        return rand.randint(*options)
+    if kind == 'float':
+        return round(rand.uniform(*options), 2)
+    if kind == 'flag':
+        return 1 if rand.random() < options else ''
+    return options
+
+
+def generate_rows(num_rows, layout='sonobat', seed=0):
+    """Generate num_rows lists of values in the order of LAYOUTS[layout]."""
+
+    rand = random.Random(seed)
+    columns = LAYOUTS[layout]
+    start = datetime.datetime(2019, 6, 1)
+    for _ in range(num_rows):
+        yield [_value(rand, kind, options, start) for _, kind, options in columns]
+
+
+def _criterion(rand, kind, options):
+    if kind == 'species':
+        choice = rand.random()
+        if choice < 0.1:
+            return 'Blank'
+        if choice < 0.2:
+            return 'not {0}'.format(rand.choice(SPECIES))
+        values = rand.sample(SPECIES, rand.randint(1, 3))
+        if choice < 0.3:
+            values.append('Blank')
+        if len(values) == 1:
+            return values[0]
+        return '{0}, or {1}'.format(', '.join(values[:-1]), values[-1])
+
+    if kind == 'flag':
+        return 'Blank' if rand.random() < 0.5 else '1'
+
+    # ranges cover up to a third of possible values
+    low, high = options
+    a = rand.uniform(low, high)
+    b = min(a + rand.uniform(0, (high - low) / 3), high)
+    if kind == 'int':
+        a, b = int(a), int(b)
+    else:
+        a, b = round(a, 2), round(b, 2)
+
+    choice = rand.random()
+    if choice < 0.2:
+        return '>={0}'.format(a)
+    if choice < 0.4:
+        return '<{0}'.format(b)
+    return '{0}-{1}'.format(a, b)
+
+
+def generate_rules(num_rules, layout='sonobat', seed=0):
+    """Return (header, rows) of num_rules random rules against LAYOUTS[layout].
+
+    Each rule has 3-7 criteria; other criteria columns are left blank (any).
+    """
+
+    rand = random.Random(seed)
+    columns = [c for c in LAYOUTS[layout] if c[1] not in ('filename', 'text')]
+    header = RESULT_COLS + [name for name, _, _ in columns]
+
+    rows = []
+    for i in range(num_rules):
+        row = [i + 1, rand.choice(SPECIES), rand.choice(['Yes', 'No'])]
+        chosen = set(rand.sample(range(len(columns)), rand.randint(3, 7)))
+        for j, (_, kind, options) in enumerate(columns):
+            row.append(_criterion(rand, kind, options) if j in chosen else '')
+        rows.append(row)
+
+    return header, rows
+
+
+def write_file(filename, header, rows):
+    """Write header and rows to a CSV or XLSX file, based on its extension."""
+
+    if os.path.splitext(filename)[1].lower() == '.xlsx':
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append([None if value == '' else value for value in row])
+        workbook.save(filename)
+
+    else:
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+def write_data(filename, num_rows, layout='sonobat', seed=0):
+    if filename.lower().endswith('.xlsx') and num_rows > XLSX_MAX_ROWS:
+        raise ValueError('XLSX files are limited to {0} rows'.format(XLSX_MAX_ROWS))
+
+    header = [name for name, _, _ in LAYOUTS[layout]]
+    write_file(filename, header, generate_rows(num_rows, layout=layout, seed=seed))
+
+
+def write_rules(filename, num_rules, layout='sonobat', seed=0):
+    write_file(filename, *generate_rules(num_rules, layout=layout, seed=seed))
+
+
+LAYOUT_OPTION = click.option('--layout', type=click.Choice(sorted(LAYOUTS)), default='sonobat',
+                             show_default=True)
+SEED_OPTION = click.option('--seed', type=int, default=0, show_default=True)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('filename', type=click.Path(dir_okay=False))
+@click.option('--rows', type=click.IntRange(min=1), default=100000, show_default=True)
+@LAYOUT_OPTION
+@SEED_OPTION
+def data(filename, rows, layout, seed):
+    """Write a synthetic data file (CSV or XLSX)."""
+
+    try:
+        write_data(filename, rows, layout=layout, seed=seed)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@click.argument('filename', type=click.Path(dir_okay=False))
+@click.option('--rules', type=click.IntRange(min=1), default=100, show_default=True)
+@LAYOUT_OPTION
+@SEED_OPTION
+def rules(filename, rules, layout, seed):
+    """Write a synthetic rules file (CSV or XLSX)."""
+
+    write_rules(filename, rules, layout=layout, seed=seed)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,223 @@
+"""Benchmarks of parsing rules, testing rows, reading data, and applying rules.
+
+Each benchmark runs in a fresh process so that its peak memory is measured
+independently of the others.  Results are reported as rows per second and peak
+memory (MB) of the benchmark process and of the largest of its child processes
+(e.g., the reader and writer processes of the apply pipeline), and compared
+against a stored baseline.  Synthetic data and rules
+files are generated on first use and reused by later runs.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --rows 1000000 --rules 1000 --format xlsx
+    python -m benchmarks.run --save-baseline
+"""
+
+import os
+import io
+import json
+import time
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from benchmarks.generate import LAYOUTS, write_data, write_rules
+from echoclean.progress import peak_memory
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+BENCHMARKS = ('parse', 'test', 'read', 'apply')
+ENGINES = ('linear', 'indexed', 'vectorized')
+
+
+def _open_data(data):
+    from echoclean.cli import _open_reader
+    return _open_reader(data, 'data', prompt=False, read_only=True)
+
+
+def _read_rules(rules):
+    from echoclean.cli import _read_rules
+    return _read_rules(rules, prompt=False)
+
+
+def bench_parse(rules, data, engine):
+    fieldnames = _open_data(data).fieldnames
+
+    start = time.perf_counter()
+    parsed = _read_rules(rules)
+    parsed.ruleset(parsed.split_columns(fieldnames)[1], indexed=engine == 'indexed')
+    return len(parsed.rows), time.perf_counter() - start
+
+
+def bench_test(rules, data, engine):
+    reader = _open_data(data)
+    parsed = _read_rules(rules)
+    ruleset = parsed.ruleset(parsed.split_columns(reader.fieldnames)[1],
+                             indexed=engine == 'indexed')
+    rows = list(reader)
+
+    start = time.perf_counter()
+    if engine == 'vectorized':
+        from echoclean.vectorized import classify_rows
+        for _ in classify_rows(ruleset, rows):
+            pass
+    else:
+        test = ruleset.test
+        for row in rows:
+            test(row)
+    return len(rows), time.perf_counter() - start
+
+
+def bench_read(rules, data, engine):
+    start = time.perf_counter()
+    count = 0
+    for _ in _open_data(data):
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def bench_apply(rules, data, engine):
+    """Apply rules with the pipeline (as on computers with more than one CPU),
+    whose reader and writer processes are measured as child processes."""
+
+    from echoclean.cli import cli
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, 'out' + os.path.splitext(data)[1])
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli.main(['apply', rules, data, output, '--engine', engine, '--no-cache',
+                      '--pipeline'], standalone_mode=False)
+        elapsed = time.perf_counter() - start
+
+    return sum(1 for _ in _open_data(data)), elapsed
+
+
+def _run(name, rules, data, engine):
+    rows, seconds = globals()['bench_' + name](rules, data, engine)
+    peak, children_peak = peak_memory()
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'peak_mb': peak,
+        'children_peak_mb': children_peak or None,
+    }
+
+
+def run_benchmark(name, rules, data, engine):
+    """Run benchmark in a new process and return its result."""
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run, name, rules, data, engine).result()
+
+
+def compare(result, baseline, tolerance):
+    """Return list of regressions of result relative to baseline."""
+
+    regressions = []
+    if baseline.get('rows_per_sec') and result['rows_per_sec'] is not None:
+        if result['rows_per_sec'] < baseline['rows_per_sec'] * (1 - tolerance):
+            regressions.append('rows/sec')
+    for key, name in (('peak_mb', 'memory'), ('children_peak_mb', 'child memory')):
+        if baseline.get(key) and result.get(key) is not None:
+            if result[key] > baseline[key] * (1 + tolerance):
+                regressions.append(name)
+    return regressions
+
+
+@click.command()
+@click.option('--rows', type=click.IntRange(min=1), default=100000, show_default=True,
+              help='Number of rows of synthetic data')
+@click.option('--rules', 'num_rules', type=click.IntRange(min=1), default=100, show_default=True,
+              help='Number of synthetic rules')
+@click.option('--format', type=click.Choice(['csv', 'xlsx']), default='csv', show_default=True,
+              help='Format of synthetic data and rules files')
+@click.option('--layout', type=click.Choice(sorted(LAYOUTS)), default='sonobat', show_default=True)
+@click.option('-b', '--benchmark', 'benchmarks', type=click.Choice(BENCHMARKS), multiple=True,
+              help='Benchmark to run (can be repeated).  Defaults to all.')
+@click.option('-e', '--engine', 'engines', type=click.Choice(ENGINES), multiple=True,
+              help='Engine to benchmark (can be repeated).  Defaults to linear and indexed.')
+@click.option('--data-dir', type=click.Path(file_okay=False), default=DEFAULT_DATA_DIR,
+              help='Directory for generated data and rules files')
+@click.option('--baseline', type=click.Path(dir_okay=False), default=DEFAULT_BASELINE,
+              show_default=True, help='Baseline results to compare against')
+@click.option('--save-baseline', is_flag=True, default=False,
+              help='Save these results as the new baseline')
+@click.option('--tolerance', type=float, default=0.2, show_default=True,
+              help='Fraction by which rows/sec may drop or peak memory may grow '
+                   'before it is reported as a regression')
+def main(rows, num_rules, format, layout, benchmarks, engines, data_dir, baseline, save_baseline,
+         tolerance):
+    """Run benchmarks against synthetic data."""
+
+    benchmarks = benchmarks or BENCHMARKS
+    engines = engines or ('linear', 'indexed')
+
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    data = os.path.join(data_dir, '{0}_{1}.{2}'.format(layout, rows, format))
+    rules = os.path.join(data_dir, '{0}_rules_{1}.{2}'.format(layout, num_rules, format))
+    try:
+        if not os.path.exists(data):
+            click.echo('Generating {0}'.format(data))
+            write_data(data, rows, layout=layout)
+        if not os.path.exists(rules):
+            click.echo('Generating {0}'.format(rules))
+            write_rules(rules, num_rules, layout=layout)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    config = {'rows': rows, 'rules': num_rules, 'format': format, 'layout': layout}
+
+    stored = {}
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            stored = json.load(f)
+        if stored.get('config') != config:
+            click.echo('Baseline was recorded with {0}; not comparing'.format(stored.get('config')))
+            stored = {}
+
+    results = {}
+    regressed = False
+    click.echo('\n{0:<20} {1:>12} {2:>14} {3:>10} {4:>10} {5:>10}'.format(
+        'benchmark', 'seconds', 'rows/sec', 'peak MB', 'child MB', 'vs. base'))
+    for name in benchmarks:
+        # reading data does not depend on the engine
+        for engine in (engines if name != 'read' else ('linear', )):
+            key = name if name == 'read' else '{0}[{1}]'.format(name, engine)
+            result = results[key] = run_benchmark(name, rules, data, engine)
+
+            relative = ''
+            base = stored.get('results', {}).get(key)
+            if base:
+                if base.get('rows_per_sec') and result['rows_per_sec']:
+                    relative = '{0:.2f}x'.format(result['rows_per_sec'] / base['rows_per_sec'])
+                regressions = compare(result, base, tolerance)
+                if regressions:
+                    regressed = True
+                    relative += ' REGRESSED ({0})'.format(', '.join(regressions))
+
+            click.echo('{0:<20} {1:>12.3f} {2:>14,.0f} {3:>10} {4:>10} {5:>10}'.format(
+                key, result['seconds'], result['rows_per_sec'] or 0,
+                result['peak_mb'] if result['peak_mb'] is not None else '-',
+                result['children_peak_mb'] or '-', relative))
+
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2, sort_keys=True)
+        click.echo('\nSaved baseline to {0}'.format(baseline))
+
+    elif regressed:
+        raise click.ClickException('Performance regressed relative to baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""Reading and writing Parquet and Arrow IPC (Feather) files using pyarrow.
+
+pyarrow is optional and is imported with this module, so only import it when
+one of these files is read or written.
+
+Input files are memory-mapped and read one record batch at a time, and each
+column of a batch is converted to Python values at once, so values keep their
+types (numbers are not parsed from text as for CSV files).
+
+When both the data and the output are Parquet or Arrow files, only the columns
+tested by rules (or used for nights) are converted to Python values; the other
+columns are copied to the output as the arrays read (see ArrowReader.iter_chunks
+and ArrowWriter.write_columns).
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from echoclean.writers import table_filename
+
+
+# Number of rows per record batch read from Parquet files and written to
+# Parquet and Arrow files
+BATCH_SIZE = 10000
+
+
+class ArrowReader(object):
+    """Read rows from a Parquet or Arrow IPC file (file or stream format).
+    format is 'parquet' or 'arrow', and defaults to parquet for files with a
+    .parquet extension, otherwise arrow.
+
+    Iterating over the reader generates each row as a dict; iter_values()
+    generates each row as a list of values in the order of fieldnames.
+    """
+
+    def __init__(self, filename, format=None):
+        self.filename = filename
+        if format is None:
+            format = 'parquet' if os.path.splitext(filename)[1].lower() == '.parquet' else 'arrow'
+        self.format = format
+        self._source = None
+
+        self.num_rows = None  # unknown for the stream format
+
+        if self.format == 'parquet':
+            self._file = pq.ParquetFile(filename, memory_map=True)
+            self.schema = self._file.schema_arrow
+            self.num_rows = self._file.metadata.num_rows
+
+        else:
+            self._source = pa.memory_map(filename)
+            try:
+                self._file = pa.ipc.open_file(self._source)
+            except pa.ArrowInvalid:
+                self._source.seek(0)
+                self._file = pa.ipc.open_stream(self._source)
+            else:
+                self.num_rows = sum(self._file.get_batch(i).num_rows
+                                    for i in range(self._file.num_record_batches))
+            self.schema = self._file.schema
+
+        self.fieldnames = list(self.schema.names)
+        self._batches = self._iter_batches()
+
+    def _iter_batches(self):
+        if self.format == 'parquet':
+            for batch in self._file.iter_batches(batch_size=BATCH_SIZE):
+                yield batch
+
+        elif isinstance(self._file, pa.ipc.RecordBatchFileReader):
+            for i in range(self._file.num_record_batches):
+                yield self._file.get_batch(i)
+
+        else:
+            for batch in self._file:
+                yield batch
+
+    def iter_values(self):
+        """Generate remaining rows as lists of values in the order of
+        fieldnames, without creating a dict for each row."""
+
+        for batch in self._batches:
+            columns = [column.to_pylist() for column in batch.columns]
+            for row in zip(*columns):
+                yield list(row)
+
+    def __iter__(self):
+        fieldnames = self.fieldnames
+        return (dict(zip(fieldnames, values)) for values in self.iter_values())
+
+    def iter_tables(self, size):
+        """Generate remaining rows as Tables of size rows (fewer for the last),
+        made of slices of the record batches read, without copying them."""
+
+        batches = []
+        count = 0
+        for batch in self._batches:
+            batches.append(batch)
+            count += batch.num_rows
+            while count >= size:
+                table = pa.Table.from_batches(batches, self.schema)
+                yield table.slice(0, size)
+                rest = table.slice(size)
+                batches = rest.to_batches()
+                count = rest.num_rows
+
+        if count:
+            yield pa.Table.from_batches(batches, self.schema)
+
+    def iter_chunks(self, fieldnames, size):
+        """Generate (table, chunk) for remaining rows in Tables of size rows
+        (see iter_tables), where chunk has the values of only the columns
+        fieldnames of each row of table, as a tuple."""
+
+        columns = [self.fieldnames.index(key) for key in fieldnames]
+        for table in self.iter_tables(size):
+            values = [table.column(i).to_pylist() for i in columns]
+            yield table, list(zip(*values)) if values else [()] * table.num_rows
+
+    def close(self):
+        if self.format == 'parquet':
+            self._file.close()
+        else:
+            self._source.close()
+
+
+def _to_array(values):
+    """Convert values to an Arrow array of the type inferred from values.  Blank
+    strings are converted to nulls in columns that are otherwise not strings
+    (e.g., results of rows that did not match a rule), and values of columns
+    that have mixed types are converted to strings."""
+
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+
+    try:
+        return pa.array([None if v == '' else v for v in values])
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def _widen(type, other):
+    """Return type to which values of both type and other can be converted:
+    float for integers and floats, otherwise string."""
+
+    if type == other or pa.types.is_null(other):
+        return type
+    if pa.types.is_null(type):
+        return other
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in (type, other)):
+        return pa.float64()
+    return pa.string()
+
+
+def _to_table(header, rows, schema=None):
+    """Convert rows to an Arrow table, with the types of schema if provided.
+    Columns whose values do not fit the type in schema are widened (see
+    _widen), so the schema of the table may differ from schema."""
+
+    columns = list(zip(*rows)) if rows else [[] for _ in header]
+    arrays = []
+    for i, values in enumerate(columns):
+        values = list(values)
+        type = schema.field(i).type if schema is not None else None
+        if type is not None and not pa.types.is_string(type):
+            values = [None if v == '' else v for v in values]
+
+        array = _to_array(values)
+        if type is not None:
+            array = array.cast(_widen(type, array.type))
+        if pa.types.is_null(array.type):
+            array = array.cast(pa.string())
+        arrays.append(array)
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(
+        [pa.field(name, array.type) for name, array in zip(header, arrays)]))
+
+
+class ArrowWriter(object):
+    """Write results to a Parquet or Arrow IPC file in record batches of
+    batch_size rows, and each summary table to a sidecar file named after the
+    table, e.g., <output>_classification_summary.parquet.
+
+    The type of each column is determined from the first batch of rows.  If a
+    later batch has values that cannot be converted to that type (e.g., 1.5 or
+    'n/a' in a column of integers), the type is widened to float or string, and
+    the rows already written are written again with the new types.
+
+    Rows are written either with write_row(), or with write_columns(), which
+    writes the original data columns as the arrays read by ArrowReader.
+    """
+
+    def __init__(self, filename, format='parquet', batch_size=BATCH_SIZE):
+        self.filename = filename
+        self.format = format
+        self.batch_size = batch_size
+        self._columns = None
+        self._rows = []
+        self._writer = None
+        self._schema = None
+
+    def _open(self, schema):
+        if self.format == 'parquet':
+            return pq.ParquetWriter(self.filename, schema)
+        return pa.ipc.new_file(self.filename, schema)
+
+    def _flush(self):
+        self._write(_to_table(self._columns, self._rows, self._schema))
+        self._rows = []
+
+    def _write(self, table):
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._open(self._schema)
+        elif table.schema != self._schema:
+            self._rewrite(table.schema)
+        self._writer.write_table(table)
+
+    def _rewrite(self, schema):
+        """Write the rows already written again, with the types of schema."""
+
+        self._writer.close()
+        previous = self.filename + '.tmp'
+        os.replace(self.filename, previous)
+
+        self._schema = schema
+        self._writer = self._open(schema)
+        reader = ArrowReader(previous, format=self.format)
+        for batch in reader._iter_batches():
+            self._writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        reader.close()
+        os.remove(previous)
+
+    def write_header(self, columns):
+        self._columns = list(columns)
+
+    def write_row(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def write_columns(self, rows, table):
+        """Write rows of values of the first columns of the header, followed by
+        the remaining columns from table (e.g., from ArrowReader.iter_chunks)."""
+
+        num_cols = len(self._columns) - table.num_columns
+        schema = None
+        if self._schema is not None:
+            schema = pa.schema([self._schema.field(i) for i in range(num_cols)])
+        output = _to_table(self._columns[:num_cols], rows, schema)
+
+        self._write(pa.Table.from_arrays(
+            output.columns + table.columns,
+            schema=pa.schema(list(output.schema) + list(table.schema))))
+
+    def write_table(self, title, header, rows):
+        filename = table_filename(self.filename, title)
+        table = _to_table(header, [list(row) for row in rows])
+        if self.format == 'parquet':
+            pq.write_table(table, filename)
+        else:
+            with pa.ipc.new_file(filename, table.schema) as writer:
+                writer.write_table(table)
+
+    def close(self):
+        if self._rows or self._writer is None:
+            self._flush()
+        self._writer.close()
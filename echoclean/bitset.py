@@ -0,0 +1,171 @@
+from bisect import bisect_left
+
+
+# Maximum number of distinct values of a column whose masks are cached
+CACHE_SIZE = 10000
+
+
+class RuleIndex(object):
+    """Bitset index over the rules of a Ruleset.
+
+    For each criteria column, the rules satisfied by a given value are stored
+    as a bitmask (bit i is set if rule i accepts that value).  A row is matched
+    by ANDing the masks of its values; the lowest set bit is the first rule that
+    matches, which is the same rule that a linear first-match scan would find.
+    """
+
+    def __init__(self, rules, keys):
+        self.num_rules = len(rules)
+        self.all_mask = (1 << self.num_rules) - 1
+        self.columns = [ColumnIndex(key, rules, position) for position, key in enumerate(keys)]
+
+    def match(self, row, start=0):
+        """Return index of first rule that matches the normalized row (values
+        in the order of keys), or None.  Rules before start are skipped.
+
+        Raises Unindexable if a value cannot be indexed (e.g., a non-numeric
+        value tested against a numeric criterion); caller should fall back to a
+        linear scan, which raises ValueError if a rule tests such a value.  The
+        values of every column are checked, even once no rules remain, so that
+        the result is the same as a linear scan.
+        """
+
+        mask = self.all_mask >> start << start
+        columns = self.columns
+        for i, column in enumerate(columns):
+            mask &= column.mask(row[column.position])
+            if not mask:
+                for rest in columns[i + 1:]:
+                    rest.check(row[rest.position])
+                return None
+
+        return (mask & -mask).bit_length() - 1
+
+
+class Unindexable(Exception):
+    pass
+
+
+class ColumnIndex(object):
+    """Bitmasks of rules satisfied by values of a single column.
+
+    Masks of up to cache_size values tested by non-numeric criteria are cached;
+    the oldest are discarded once it is full.
+    """
+
+    def __init__(self, key, rules, position, cache_size=CACHE_SIZE):
+        self.key = key
+        self.position = position
+        self.cache_size = cache_size
+
+        # rules that do not test this column, or allow any value
+        self.any_mask = 0
+        numeric = []  # (bit, criterion)
+        other = []  # (bit, criterion)
+
+        for i, rule in enumerate(rules):
+            bit = 1 << i
+            criterion = rule.criteria.get(key)
+            if criterion is None or criterion.is_any:
+                self.any_mask |= bit
+            elif criterion.is_number:
+                numeric.append((bit, criterion))
+            else:
+                other.append((bit, criterion))
+
+        self._other = other
+        self._cache = {}
+
+        self.blank_mask = self.any_mask
+        for bit, criterion in numeric + other:
+            if criterion.test(None):
+                self.blank_mask |= bit
+
+        # Numeric criteria only change outcome at their breakpoints, so the
+        # number line is divided into regions: (-inf, b0), b0, (b0, b1), b1, ...
+        # The mask for each region is calculated from a representative value.
+        self.breakpoints = sorted(set(v for _, c in numeric for v in c.values))
+        self.region_masks = []
+        if numeric:
+            points = self.breakpoints
+            for i in range(len(points) + 1):
+                if i == 0:
+                    below = points[0] - 1
+                elif i == len(points):
+                    below = points[-1] + 1
+                else:
+                    below = (points[i - 1] + points[i]) / 2.0
+
+                self.region_masks.append(self._numeric_mask(numeric, below))
+                if i < len(points):
+                    self.region_masks.append(self._numeric_mask(numeric, points[i]))
+
+        self._has_numeric = bool(numeric)
+
+    @staticmethod
+    def _numeric_mask(numeric, value):
+        mask = 0
+        for bit, criterion in numeric:
+            if criterion.test(value):
+                mask |= bit
+        return mask
+
+    @staticmethod
+    def _number(value):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise Unindexable()
+
+        if number != number:  # NaN never satisfies a comparison
+            raise Unindexable()
+
+        return number
+
+    def check(self, value):
+        """Raise Unindexable if the mask of value cannot be found."""
+
+        if value is None:
+            return
+
+        if self._has_numeric:
+            self._number(value)
+
+        if self._other:
+            try:
+                hash(value)
+            except TypeError:
+                raise Unindexable()
+
+    def mask(self, value):
+        if value is None:  # rows are normalized so that blank values are None
+            return self.blank_mask
+
+        mask = self.any_mask
+
+        if self._has_numeric:
+            number = self._number(value)
+            points = self.breakpoints
+            i = bisect_left(points, number)
+            if i < len(points) and points[i] == number:
+                mask |= self.region_masks[2 * i + 1]
+            else:
+                mask |= self.region_masks[2 * i]
+
+        if self._other:
+            try:
+                other_mask = self._cache[value]
+            except KeyError:
+                other_mask = 0
+                for bit, criterion in self._other:
+                    if criterion.test(value):
+                        other_mask |= bit
+                if len(self._cache) >= self.cache_size:
+                    del self._cache[next(iter(self._cache))]
+                self._cache[value] = other_mask
+            except TypeError:  # unhashable
+                raise Unindexable()
+
+            mask |= other_mask
+
+        return mask
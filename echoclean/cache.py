@@ -0,0 +1,81 @@
+"""On-disk cache of parsed rules.
+
+Rules are cached by a hash of the contents of the rules file (and the chosen
+sheet for XLSX files), so that repeated runs against the same rules do not need
+to read the rules file with openpyxl or parse each criterion again.
+
+The cache directory defaults to ~/.cache/echoclean, and can be changed using the
+ECHOCLEAN_CACHE_DIR environment variable.
+"""
+
+import os
+import glob
+import hashlib
+import logging
+
+from echoclean.storage import load_pickle, save_pickle
+
+
+logger = logging.getLogger('echoclean')
+
+
+# Increment when the structure of cached objects changes so that old entries
+# are no longer used.
+CACHE_VERSION = 4
+
+
+def default_cache_dir():
+    if os.environ.get('ECHOCLEAN_CACHE_DIR'):
+        return os.environ['ECHOCLEAN_CACHE_DIR']
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'echoclean')
+
+
+def file_hash(filename):
+    """Return hex digest of the contents of filename."""
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RulesCache(object):
+    """Pickled values stored in a directory, one file per key."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+
+    def _path(self, key):
+        name = '-'.join(str(part) for part in key)
+        return os.path.join(self.directory, 'v{0}-{1}.pickle'.format(CACHE_VERSION, name))
+
+    def get(self, *key):
+        """Return value stored for key, or None if not found or unreadable."""
+
+        return load_pickle(self._path(key), description='cached rules')
+
+    def set(self, value, *key):
+        """Store value for key.  Errors writing to the cache are logged but
+        otherwise ignored."""
+
+        path = self._path(key)
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            save_pickle(value, path)
+
+        except Exception as e:
+            logger.warning('Could not write cached rules to {0}: {1}'.format(path, e))
+
+    def clear(self):
+        """Remove all entries from the cache.  Returns the number removed."""
+
+        count = 0
+        for path in glob.glob(os.path.join(self.directory, '*.pickle')):
+            os.remove(path)
+            count += 1
+        return count
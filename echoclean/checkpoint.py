@@ -0,0 +1,88 @@
+"""Checkpoints of a classification run, so that a run over a large data file
+that stops before it finishes can be resumed instead of started again.
+
+Every so many rows, the rows written so far are flushed to disk, and the
+number of rows classified, the position in the output file after them, and the
+Summary of those rows are saved to a sidecar file next to the output,
+<output>.checkpoint.  A resumed run discards anything written to the output
+after that position, skips the rows already classified, and continues with the
+saved Summary, so the output is the same as that of an uninterrupted run.
+"""
+
+import os
+import logging
+
+from echoclean.storage import load_pickle, save_pickle
+
+
+logger = logging.getLogger('echoclean')
+
+
+# Increment when the structure of saved checkpoints changes
+CHECKPOINT_VERSION = 3
+
+# Default number of rows between checkpoints
+CHECKPOINT_ROWS = 1000000
+
+
+def checkpoint_filename(output):
+    return output + '.checkpoint'
+
+
+class Checkpoint(object):
+    """Progress of a run, saved to filename every `every` rows, along with
+    what is needed to check that a resumed run would produce the same output:
+    the data file, the rules, and options (e.g., output format, night
+    settings, and the sheet of an XLSX data file) that change the output."""
+
+    def __init__(self, filename, data_hash, fieldnames, fingerprints, options,
+                 every=CHECKPOINT_ROWS):
+        self.filename = filename
+        self.data_hash = data_hash
+        self.fieldnames = list(fieldnames)
+        self.fingerprints = list(fingerprints)
+        self.options = options
+        self.every = every
+
+        self.rows = 0  # number of rows classified and written
+        self.position = None  # position in the output file after those rows
+        self.trace_position = None  # position in the trace file, if rows are explained
+        self.summary = None  # Summary of those rows
+
+    def is_compatible(self, other):
+        """Return True if other was saved by a run on the same data, rules, and
+        options, and so can be resumed."""
+
+        return (self.data_hash == other.data_hash and self.fieldnames == other.fieldnames and
+                self.fingerprints == other.fingerprints and self.options == other.options)
+
+    def resume(self, other):
+        """Continue from the progress saved in other."""
+
+        self.rows = other.rows
+        self.position = other.position
+        self.trace_position = other.trace_position
+        self.summary = other.summary
+
+    def save(self, summary, position, trace_position=None):
+        """Save progress after summary.total rows, which end at position in the
+        output file, and at trace_position in the trace file if rows are
+        explained."""
+
+        self.rows = summary.total
+        self.position = position
+        self.trace_position = trace_position
+        self.summary = summary
+
+        save_pickle(self, self.filename, CHECKPOINT_VERSION)
+        logger.info('checkpoint saved after {0} rows'.format(self.rows))
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Return Checkpoint saved in filename, or None if not found or unreadable."""
+
+        return load_pickle(filename, CHECKPOINT_VERSION, 'checkpoint')
@@ -0,0 +1,279 @@
+"""Classification of chunks of data rows into output rows and summary counts.
+
+Rows are classified in chunks so that chunks can be sent to worker processes
+and the results merged back in the original order of the input.
+"""
+
+import time
+import logging
+from collections import deque
+from itertools import islice
+
+from echoclean.incremental import StateMismatch
+from echoclean.profiling import RuleProfile
+from echoclean.ruleset import MatchMemo
+from echoclean.summary import Summary
+
+
+logger = logging.getLogger('echoclean')
+
+
+CHUNK_SIZE = 10000
+
+
+class ChunkClassifier(object):
+    """Classify chunks of rows, where each row is a list of values in the same
+    order as fieldnames.
+
+    Returns the output rows (result columns, night if a NightParser is
+    provided, followed by the original values), a Summary of the chunk, and the
+    index of the rule matched by each row (-1 if none).  If profile is True, the
+    summary includes a RuleProfile of the chunk.
+
+    If first_changed is provided, each chunk is accompanied by the rule index
+    matched by each row in a previous run of rules that were the same as these
+    up to first_changed (see echoclean.incremental).  Rows that matched one of
+    those rules keep the same match; other rows are only tested against rules
+    from first_changed onward.
+
+    If memo_size is greater than 0, the rule matched by up to that many recent
+    combinations of criteria values is reused for rows with the same values
+    (see echoclean.ruleset.MatchMemo), and the summary includes the number of
+    memo hits and misses.
+
+    The summary of each chunk includes the time spent matching rules, parsing
+    nights, and building output rows (Summary.seconds).
+
+    If values is False, output rows do not include the original values (e.g.,
+    when they are written from the columns read, see echoclean.arrow), and rows
+    only need the values of the criteria columns and night column.
+    """
+
+    def __init__(self, ruleset, fieldnames, empty_row, engine='linear', nights=None,
+                 profile=False, first_changed=None, memo_size=0, values=True):
+        self.ruleset = ruleset
+        self.fieldnames = list(fieldnames)
+        self.empty_row = list(empty_row)
+        self.engine = engine
+        self.nights = nights
+        self.profile = profile
+        self.first_changed = first_changed
+        self.memo_size = memo_size
+        self.values = values
+
+    def _match(self, chunk, previous=None):
+        """Return list of the index of the first rule that matches each row of
+        chunk, or -1 if none match."""
+
+        start = 0
+        if previous is not None:
+            if len(previous) != len(chunk):
+                raise StateMismatch('{0} rows were matched in the previous run, but the chunk '
+                                    'has {1} rows'.format(len(previous), len(chunk)))
+            start = self.first_changed
+            matches = list(previous)
+            indexes = [i for i, match in enumerate(previous) if match < 0 or match >= start]
+        else:
+            matches = [-1] * len(chunk)
+            indexes = range(len(chunk))
+
+        rows = chunk if previous is None else [chunk[i] for i in indexes]
+
+        if self.engine == 'vectorized':
+            # rows cannot match rules before start, so test them against all rules
+            from echoclean.vectorized import classify_columns
+            columns = {key: [row[i] for row in rows] for key, i in zip(
+                self.ruleset.criteria_cols, self.ruleset.plan.keys(self.fieldnames))}
+            found = classify_columns(self.ruleset, columns, num_rows=len(rows)).tolist()
+
+        else:
+            found = self.ruleset.match_many(rows, start, fieldnames=self.fieldnames)
+
+        for i, index in zip(indexes, found):
+            matches[i] = index
+
+        return matches
+
+    def __call__(self, chunk, previous=None):
+        summary = Summary(self.ruleset.result_cols)
+        if self.profile:
+            summary.profile = self.ruleset.profile = RuleProfile(len(self.ruleset.rules))
+
+        # memo is kept across chunks classified in the same process
+        memo = None
+        if self.memo_size and self.engine != 'vectorized':
+            memo = self.ruleset.memo
+            if memo is None or memo.maxsize != self.memo_size:
+                memo = self.ruleset.memo = MatchMemo(self.ruleset, self.memo_size)
+            hits, misses = memo.hits, memo.misses
+        else:
+            self.ruleset.memo = None
+
+        start = time.perf_counter()
+        matches = self._match(chunk, previous)
+        summary.seconds['match rules'] = time.perf_counter() - start
+
+        if memo is not None:
+            summary.memo_hits = memo.hits - hits
+            summary.memo_misses = memo.misses - misses
+
+        nights = None
+        if self.nights is not None:
+            start = time.perf_counter()
+            column = self.fieldnames.index(self.nights.column)
+            nights = self.nights.parse_many([values[column] for values in chunk])
+            summary.seconds['parse nights'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+
+        rules = self.ruleset.rules
+        output_rows = []
+        for i, (values, index) in enumerate(zip(chunk, matches)):
+            result = None
+            if index >= 0:
+                result = rules[index].result or None
+
+            if result:
+                output_row = result
+            else:
+                output_row = list(self.empty_row)
+
+            night = None
+            if nights is not None:
+                night = nights[i] or ''
+                output_row.append(night)
+
+            summary.add(result, night)
+
+            if self.values:
+                output_row.extend(values)
+            output_rows.append(output_row)
+
+        self.ruleset.profile = None
+        summary.seconds['build output rows'] = time.perf_counter() - start
+
+        return output_rows, summary, matches
+
+
+def iter_values(rows, fieldnames):
+    """Generate each of rows (dicts or a data reader) as a list of values in the
+    order of fieldnames.
+
+    Readers that can generate their rows as lists of values in the order of
+    their own fieldnames (iter_values()) are read without creating a dict for
+    each row.
+    """
+
+    fieldnames = list(fieldnames)
+    if (hasattr(rows, 'iter_values') and list(rows.fieldnames) == fieldnames and
+            len(set(fieldnames)) == len(fieldnames)):
+        return rows.iter_values()
+
+    return ([row[k] for k in fieldnames] for row in rows)
+
+
+def iter_chunks(rows, fieldnames, chunk_size=CHUNK_SIZE):
+    """Generate lists of up to chunk_size rows, with each row converted to a
+    list of values in the order of fieldnames (see iter_values)."""
+
+    values = iter_values(rows, fieldnames)
+    while True:
+        chunk = list(islice(values, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def classify_iter(ruleset, rows, chunk_size=CHUNK_SIZE, summary=None, nights=None,
+                  fieldnames=None):
+    """Classify an iterable of rows in chunks of up to chunk_size rows, for use
+    of echoclean as a library.  Rows are dicts, or if fieldnames are provided,
+    sequences of values in the order of fieldnames.
+
+    Yields (rows, matches, results) for each chunk, where matches and results
+    are the same as returned by Ruleset.test_many.  If summary is provided, it
+    is updated with the results of each chunk, along with the night of each
+    row if a NightParser is provided.
+    """
+
+    night_key = None
+    if nights is not None:
+        night_key = nights.column if fieldnames is None else list(fieldnames).index(nights.column)
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        matches, results = ruleset.test_many(chunk, fieldnames=fieldnames)
+        if summary is not None:
+            chunk_nights = None
+            if nights is not None:
+                chunk_nights = nights.parse_many([row[night_key] for row in chunk])
+            summary.add_many(results, chunk_nights)
+
+        yield chunk, matches, results
+
+
+# Classifier used by each worker process, set once when the worker starts
+_classifier = None
+
+
+def _init_worker(classifier):
+    global _classifier
+    _classifier = classifier
+
+
+def _classify_chunk(*args):
+    return _classifier(*args)
+
+
+def _with_previous(chunks, previous):
+    """Generate (chunk, previous matches) pairs, raising StateMismatch if there
+    are more or fewer previous matches than rows."""
+
+    previous = iter(previous)
+    for chunk in chunks:
+        matches = next(previous, [])
+        if len(matches) != len(chunk):
+            raise StateMismatch('Data does not have the same number of rows as the previous run')
+        yield chunk, matches
+
+    if next(previous, None) is not None:
+        raise StateMismatch('Data does not have the same number of rows as the previous run')
+
+
+def classify_chunks(classifier, chunks, jobs=1, previous=None):
+    """Classify chunks, using jobs worker processes if jobs > 1.
+
+    Yields (output_rows, summary, matches) for each chunk in the same order as
+    chunks.  previous are the corresponding chunks of rule indexes matched in a
+    previous run, if the classifier is incremental; StateMismatch is raised if
+    they do not have the same number of rows as chunks.
+
+    The classifier (and its ruleset) is sent to each worker once; at most
+    2 * jobs chunks are in flight at any time so that memory remains bounded.
+    """
+
+    if previous is None:
+        args = ((chunk, ) for chunk in chunks)
+    else:
+        args = _with_previous(chunks, previous)
+
+    if jobs <= 1:
+        for chunk_args in args:
+            yield classifier(*chunk_args)
+        return
+
+    from multiprocessing import Pool  # slow to import, so only imported if used
+
+    with Pool(jobs, initializer=_init_worker, initargs=(classifier, )) as pool:
+        pending = deque()
+        for chunk_args in args:
+            pending.append(pool.apply_async(_classify_chunk, chunk_args))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
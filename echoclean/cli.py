@@ -1,20 +1,43 @@
 import os
+import re
 import sys
+import glob
 import logging
 import time
-import datetime
-import re
+from array import array
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import chain
 import click
-from collections import Counter
-from csv import DictReader as CSV_DictReader
-
-from openpyxl import Workbook
 
-from echoclean.xlsx_dictreader import DictReader as XLSX_DictReader
-from echoclean.ruleset import Ruleset
+# Modules that are slow to import (openpyxl, multiprocessing, numpy) are
+# imported where they are needed, so that starting echoclean for CSV files or
+# --help is fast
+from echoclean.csv_dictreader import DictReader as CSV_DictReader
+from echoclean.ruleset import MEMO_SIZE, ParsedRules
+from echoclean.cache import RulesCache, file_hash
+from echoclean.night import FORMATS as FILENAME_FORMATS, NightParser
+from echoclean.classify import CHUNK_SIZE, ChunkClassifier, classify_chunks, iter_chunks
+from echoclean.incremental import RunState, StateMismatch, state_filename
+from echoclean.checkpoint import CHECKPOINT_ROWS, Checkpoint, checkpoint_filename
+from echoclean.pipeline import PipelineError, PipelineReader, PipelineWriter
+from echoclean.summary import Summary
+from echoclean.trace import RowSelector, Tracer
+from echoclean.progress import PhaseTimer, Progress, estimate_rows, format_report, write_report
+from echoclean.writers import (ARROW_FORMATS, FORMATS, RESUMABLE_FORMATS, RULE_COLUMN,
+                               get_writer, output_filename)
 
 logger = logging.getLogger('echoclean')
 
+# Extensions of data files read using pyarrow
+ARROW_EXTENSIONS = ('.parquet', '.arrow', '.feather', '.ipc')
+
+# Names (without extension) of files written by batch: outputs (<data>_out)
+# and their summary tables (<data>_out_<table>), which glob patterns for data
+# files may match on later runs
+BATCH_OUTPUT_RE = re.compile(r'_out(_[a-z0-9_]+)?$')
+BATCH_SUMMARY = 'batch_summary'
+
 
 def configure_logging(verbose):
     if verbose == 2:
@@ -26,27 +49,325 @@ def configure_logging(verbose):
     logging.basicConfig(stream=sys.stderr, level=level)
 
 
-# For parsing sonobat .wav filename into a timestamp
-FILENAME_RE = re.compile(
-    '(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_(?P<hour>\d{2})'
-    '(?P<minute>\d{2})(?P<second>\d{2})_(?P<ms>\d{3})'
-)
+def _open_reader(filename, param, prompt=True, index=None, read_only=False):
+    """Open a DictReader for an XLSX, CSV, or tab-delimited TXT file, or an
+    ArrowReader for a Parquet or Arrow IPC file.
+
+    For XLSX files, index is the sheet to read.  If it is not provided and the
+    file has multiple sheets, the user is prompted to choose one if prompt is
+    True, otherwise the active sheet is used.  If read_only is True, rows are
+    streamed from the file rather than loading the whole workbook.
+    """
+
+    ext = os.path.splitext(filename)[1]
+    if ext == '.xlsx':
+        from echoclean.xlsx_dictreader import DictReader as XLSX_DictReader
+        return XLSX_DictReader.from_file(filename, index=index, prompt=prompt,
+                                         read_only=read_only)
+
+    if ext in ('.txt', '.csv'):
+        f = open(filename)
+        if ext == '.csv':
+            delim = ','
+        else:  # may be tab or comma delimited
+            delim = '\t' if '\t' in f.read(1000) else ','
+            f.seek(0)
+        return CSV_DictReader(f, delimiter=delim)
+
+    if ext in ARROW_EXTENSIONS:
+        _check_pyarrow()
+        from echoclean.arrow import ArrowReader
+        return ArrowReader(filename)
 
+    raise click.BadParameter('{0} file must be an XLSX, TXT, CSV, Parquet, or Arrow file'.format(param),
+                             param=param, param_hint=param)
 
-def _extract_sonobat_night(pass_filename):
+
+def _read_rules(filename, cache=None, prompt=True):
+    """Read rules from filename into ParsedRules (see _load_rules), recording
+    the file and the hash of its contents."""
+
+    digest = file_hash(filename)
+    rules = _load_rules(filename, digest, cache=cache, prompt=prompt)
+    rules.filename = os.path.abspath(filename)
+    rules.digest = digest
+    return rules
+
+
+def _load_rules(filename, digest, cache=None, prompt=True):
+    """Read rules from filename, whose contents have hash digest, into
+    ParsedRules.
+
+    If cache is provided, rules are loaded from the cache if the contents of
+    the file (and the chosen sheet of an XLSX file) have been read before, and
+    are otherwise added to the cache.
     """
-    Extract night from sonobat filename.
-    Consider anything prior to noon as part of the previous night.
+
+    if cache is None:
+        reader = _open_reader(filename, 'rules', prompt=prompt)
+        return ParsedRules(reader.fieldnames, reader)
+
+    index = None
+    if os.path.splitext(filename)[1] == '.xlsx':
+        sheets = cache.get(digest, 'sheets')
+        if sheets is not None:
+            sheet_list, num_sheets, index = sheets
+            if prompt and num_sheets > 1:
+                from echoclean.xlsx_dictreader import choose_sheet
+                index = choose_sheet(sheet_list, index)
+
+            rules = cache.get(digest, index)
+            if rules is not None:
+                if num_sheets > 1:
+                    print('{0}: using worksheet {1}'.format(
+                        os.path.split(filename)[1], dict(sheet_list)[index]))
+                logger.debug('Loaded cached rules for {0}'.format(filename))
+                return rules
+
+        reader = _open_reader(filename, 'rules', prompt=prompt, index=index)
+        index = reader.sheet_index
+        cache.set((reader.sheets, reader.num_sheets, reader.active_index), digest, 'sheets')
+
+    else:
+        rules = cache.get(digest, index)
+        if rules is not None:
+            logger.debug('Loaded cached rules for {0}'.format(filename))
+            return rules
+
+        reader = _open_reader(filename, 'rules', prompt=prompt)
+
+    rules = ParsedRules(reader.fieldnames, reader)
+    rules.cache_key = (digest, index)
+    cache.set(rules, *rules.cache_key)
+    return rules
+
+
+def _get_ruleset(rules, result_cols, engine, cache=None):
+    """Return ruleset compiled from rules, and update the cache if it was not
+    already compiled."""
+
+    compiled = len(rules.rulesets)
+    ruleset = rules.ruleset(result_cols, indexed=engine == 'indexed')
+    if cache is not None and len(rules.rulesets) > compiled:
+        cache.set(rules, *rules.cache_key)
+    return ruleset
+
+
+# Number of rows used to measure how often each criterion rejects a row
+OPTIMIZE_SAMPLE = 250
+
+
+def _skip_rows(chunks, count):
+    """Generate chunks of rows, without the first count rows."""
+
+    for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+        if count:
+            chunk = chunk[count:]
+            count = 0
+        yield chunk
+
+
+def _table_chunks(pairs, tables):
+    """Generate the chunks of (table, chunk) pairs, appending each table to
+    tables, so that it can be written with the results of its chunk."""
+
+    for table, chunk in pairs:
+        tables.append(table)
+        yield chunk
+
+
+def _classify(ruleset, data_reader, writer, engine='linear', jobs=1, nights=None,
+              profile=False, optimize=False, previous=None, matches=None, memo_size=0,
+              tracer=None, checkpoint=None, rule_col=None, timer=None, progress=None):
+    """Classify each row from data_reader and write the results followed by
+    summary tables to writer.  Returns the Summary.
+
+    data_reader and writer may be a PipelineReader and PipelineWriter to read
+    and write in separate processes.
+
+    If nights is provided, it is used to add the night of each pass based on
+    its filename.  If profile is True, each rule is profiled and a Rule Profile
+    table is written after the summary tables.  If optimize is True, the criteria
+    of each rule are reordered based on a sample of rows from the first chunk.
+
+    If previous is provided, it is the RunState of a previous run on the same
+    data, and only rows that may match a changed rule are tested again.  If
+    matches is provided, the index of the rule matched by each row is appended
+    to it.  memo_size is the number of recent combinations of criteria values
+    whose matched rule is reused (0 to always test the rules).  If tracer is
+    provided, it is used to explain how its selected rows were classified.
+
+    If checkpoint is provided, progress is saved to it every checkpoint.every
+    rows, which requires a writer with a checkpoint() method.  If it has
+    progress from an earlier run, the rows already classified are skipped, and
+    writer must resume writing after them.
+
+    If rule_col is provided, the number of the rule matched by each row (1 is
+    the first rule; blank if none) is added to the output in a column of that
+    name, after the result columns and night.
+
+    If timer (a PhaseTimer) is provided, the time spent in each phase is added
+    to it.  If progress is provided, it is updated as rows are classified.
+
+    If data_reader is an ArrowReader and writer an ArrowWriter, only the columns
+    tested by rules (and the night column) are converted to Python values, and
+    the other columns are written as read (unless rows are explained by tracer).
     """
-    match = FILENAME_RE.search(pass_filename)
-    if match:
-        values = [int(v) for v in match.groups()]
-        values[-1] = values[-1] * 1000  # convert ms to microseconds
-        d = datetime.datetime(*values)
-        if d.hour < 12:
-            d = d - datetime.timedelta(days=1)
-        return d.strftime('%m/%d/%Y')
-    return None
+
+    timer = timer or PhaseTimer()
+    result_cols = ruleset.result_cols
+
+    output_cols = list(result_cols)
+    if nights is not None:
+        output_cols += ['night']
+    if rule_col is not None:
+        output_cols += [rule_col]
+
+    resume_rows = 0
+    if checkpoint is not None and checkpoint.summary is not None:
+        resume_rows = checkpoint.rows
+    else:
+        writer.write_header(output_cols + data_reader.fieldnames)
+
+    empty_row = [''] * len(result_cols)
+
+    inspect_idx = result_cols.index('Inspect')
+    if inspect_idx >= 0:
+        empty_row[inspect_idx] = 'Yes'
+
+    summary = checkpoint.summary if resume_rows else Summary(result_cols)
+
+    first_changed = previous_chunks = None
+    if previous is not None:
+        first_changed = previous.first_changed(ruleset.fingerprints)
+        previous_chunks = previous.chunks(CHUNK_SIZE)
+
+    # Parquet or Arrow data written to Parquet or Arrow output: only the values
+    # of criteria and night columns are converted, and the tables read are
+    # written with the results (see echoclean.arrow)
+    columnar = (tracer is None and not resume_rows and hasattr(data_reader, 'iter_chunks') and
+                hasattr(writer, 'write_columns'))
+
+    fieldnames = data_reader.fieldnames
+    if columnar:
+        night_col = nights.column if nights is not None else None
+        fieldnames = [key for key in fieldnames
+                      if key in ruleset.criteria_cols or key == night_col]
+
+    classifier = ChunkClassifier(ruleset, fieldnames, empty_row, engine=engine,
+                                 nights=nights, profile=profile, first_changed=first_changed,
+                                 memo_size=memo_size, values=not columnar)
+    tables = deque()
+    if columnar:
+        chunks = _table_chunks(data_reader.iter_chunks(fieldnames, CHUNK_SIZE), tables)
+    elif isinstance(data_reader, PipelineReader):
+        chunks = data_reader.chunks()
+    else:
+        chunks = iter_chunks(data_reader, fieldnames, CHUNK_SIZE)
+
+    if resume_rows:
+        chunks = _skip_rows(chunks, resume_rows)
+
+    chunks = timer.iter('read data', chunks)
+
+    if optimize:
+        first = next(chunks, [])
+        with timer.phase('optimize rules'):
+            ruleset.optimize([dict(zip(fieldnames, values)) for values in first[:OPTIMIZE_SAMPLE]])
+        chunks = chain([first], chunks)
+
+    for output_rows, chunk_summary, chunk_matches in classify_chunks(
+            classifier, chunks, jobs=jobs, previous=previous_chunks):
+        # time spent classifying, in this or worker processes
+        for phase, seconds in chunk_summary.seconds.items():
+            timer.add(phase, seconds)
+
+        with timer.phase('write rows'):
+            if rule_col is not None:
+                position = len(output_cols) - 1
+                for output_row, index in zip(output_rows, chunk_matches):
+                    output_row.insert(position, index + 1 if index >= 0 else None)
+
+            if columnar:
+                writer.write_columns(output_rows, tables.popleft())
+            else:
+                for output_row in output_rows:
+                    writer.write_row(output_row)
+
+        if tracer is not None:
+            with timer.phase('explain rows'):
+                # output rows end with the original values
+                tracer.trace(summary.total, [row[len(output_cols):] for row in output_rows])
+
+        if matches is not None:
+            matches.extend(chunk_matches)
+
+        summary.merge(chunk_summary)
+        logger.info('classified {0} rows'.format(summary.total))
+
+        if checkpoint is not None and summary.total >= checkpoint.rows + checkpoint.every:
+            with timer.phase('save checkpoints'):
+                checkpoint.save(summary, writer.checkpoint(),
+                                tracer.checkpoint() if tracer is not None else None)
+
+        if progress is not None:
+            progress.update(summary.total)
+
+    if progress is not None:
+        progress.finish(summary.total)
+
+    with timer.phase('write summaries and save output'):
+        for title, header, rows in summary.tables():
+            writer.write_table(title, header, rows)
+
+        if summary.profile is not None:
+            writer.write_table(*summary.profile.table())
+
+        writer.close()
+
+    return summary
+
+
+def _sqlite_columns(format, result_cols):
+    """Return the column added for the matched rule, and the columns indexed, in
+    output of format (only for SQLite output)."""
+
+    if format != 'sqlite':
+        return None, None
+    return RULE_COLUMN, list(result_cols) + ['night', RULE_COLUMN]
+
+
+def _run_info(rules, data):
+    """Return the data and rules files of a run (recorded in SQLite output)."""
+
+    return OrderedDict([('data', os.path.abspath(data)), ('rules', rules.filename),
+                        ('rules_hash', rules.digest)])
+
+
+def _cpu_count():
+    """Return number of CPUs available to this process."""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _check_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise click.UsageError('pyarrow must be installed to read or write Parquet or Arrow files')
+
+
+def _check_engine(engine):
+    if engine == 'vectorized':
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise click.UsageError('numpy must be installed to use the vectorized engine')
 
 
 @click.group()
@@ -54,178 +375,541 @@ def cli():
     pass
 
 
+ENGINE_OPTION = click.option(
+    '--engine', type=click.Choice(['linear', 'indexed', 'vectorized']),
+    default='linear', show_default=True,
+    help='Rule matching engine: test rules in order, use a bitset index '
+         '(faster for large rulesets), or classify columns of rows at '
+         'once using numpy (fastest for large datasets)')
+
+FORMAT_OPTION = click.option(
+    '-f', '--format', type=click.Choice(sorted(FORMATS)), default=None,
+    help='Output format.  Defaults to the format of the OUTPUT extension, '
+         'or xlsx.  For csv, tsv, parquet, and arrow, summary tables are written to '
+         'separate files alongside OUTPUT.  parquet and arrow require pyarrow.  '
+         'sqlite adds the results to the tables of an existing database.')
+
+FILENAME_FORMAT_OPTION = click.option(
+    '--filename-format', type=click.Choice(sorted(FILENAME_FORMATS)), default=None,
+    help='Format of pass filenames used to determine the night of each pass.  '
+         'Defaults to sonobat if DATA has a Filename column, or kaleidoscope if it '
+         'has an IN FILE column.')
+
+NIGHT_CUTOFF_OPTION = click.option(
+    '--night-cutoff', type=click.IntRange(0, 23), default=12, show_default=True,
+    help='Hour of day (0-23) before which passes are assigned to the previous night')
+
+OPTIMIZE_OPTION = click.option(
+    '--optimize', is_flag=True, default=False,
+    help='Reorder the criteria within each rule so that those that reject the most '
+         'rows (in a sample of DATA) are tested first.  Results are unchanged.')
+
+MEMO_OPTION = click.option(
+    '--memo-size', type=click.IntRange(min=0), default=MEMO_SIZE, show_default=True,
+    help='Number of recent combinations of criteria values for which the matching '
+         'rule is remembered, so that rows with the same values are not tested '
+         'again.  Use 0 to test every row.')
+
+CACHE_OPTION = click.option(
+    '--cache/--no-cache', 'use_cache', default=True, show_default=True,
+    help='Use cached rules if the rules file has been read before.  The cache '
+         'directory can be set using the ECHOCLEAN_CACHE_DIR environment variable.')
+
+
 @cli.command(short_help='Apply the rules to the input data.')
 @click.argument('rules', type=click.Path(exists=True))
 @click.argument('data', type=click.Path(exists=True))
 @click.argument('output', type=click.Path(dir_okay=False, writable=True, exists=False), required=False)
 @click.option('-v', '--verbose', count=True, help='Verbose output')
-def apply(rules, data, output, verbose):
+@ENGINE_OPTION
+@FORMAT_OPTION
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of worker processes used to classify rows')
+@CACHE_OPTION
+@FILENAME_FORMAT_OPTION
+@NIGHT_CUTOFF_OPTION
+@OPTIMIZE_OPTION
+@MEMO_OPTION
+@click.option('--profile', is_flag=True, default=False,
+              help='Count the rows tested, matched, and rejected by each rule, '
+                   'the criteria that rejected them, and the time spent in each '
+                   'rule, and write these to a Rule Profile table')
+@click.option('--profile-json', type=click.Path(dir_okay=False), default=None,
+              help='Also write the rule profile to this JSON file (implies --profile)')
+@click.option('--incremental', is_flag=True, default=False,
+              help='Save the rule matched by each row next to OUTPUT, and if saved by a '
+                   'previous run on the same DATA, only test rows that may match rules '
+                   'that have changed since then')
+@click.option('--checkpoint', 'checkpoint_rows', type=click.IntRange(min=1), default=None,
+              help='Every this many rows, write OUTPUT to disk and save a checkpoint next '
+                   'to it, from which the run can be resumed using --resume if it is '
+                   'interrupted.  Requires csv or tsv output.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Resume an interrupted run from its last checkpoint, rather than '
+                   'classifying all rows again (implies --checkpoint {0})'.format(CHECKPOINT_ROWS))
+@click.option('--progress', is_flag=True, default=False,
+              help='Show the number of passes classified, passes per second, and the '
+                   'estimated time remaining while classifying, followed by the time '
+                   'spent in each phase of the run and peak memory use')
+@click.option('--report-json', type=click.Path(dir_okay=False), default=None,
+              help='Write the time spent in each phase of the run and peak memory use '
+                   'to this JSON file')
+@click.option('--pipeline/--no-pipeline', default=None,
+              help='Read DATA and write OUTPUT in separate processes while rows are '
+                   'classified.  Defaults to --pipeline if more than one CPU is available.')
+@click.option('--explain-row', 'explain_rows', type=click.IntRange(min=1), multiple=True,
+              help='Explain how the pass in this row (1 is the first row after the header) '
+                   'was classified, rule by rule, in the trace file (can be repeated)')
+@click.option('--explain-file', default=None,
+              help='Explain passes whose filename matches this pattern (e.g., "*_2019060122*")')
+@click.option('--explain-sample', type=click.FloatRange(0, 1), default=0,
+              help='Explain this fraction of passes, selected at random')
+@click.option('--trace-file', type=click.Path(dir_okay=False), default=None,
+              help='File for explanations.  Defaults to OUTPUT with _trace.txt in '
+                   'place of its extension.')
+def apply(rules, data, output, verbose, engine, format, jobs, use_cache, filename_format,
+          night_cutoff, optimize, memo_size, profile, profile_json, incremental, checkpoint_rows,
+          resume, progress, report_json, pipeline, explain_rows, explain_file, explain_sample,
+          trace_file):
     """Apply the rules to the input data."""
 
+    timer = PhaseTimer()
     configure_logging(verbose)
+    _check_engine(engine)
+
+    profile = profile or profile_json is not None
+    if profile and engine == 'vectorized':
+        raise click.UsageError('--profile is not supported by the vectorized engine')
+
+    cache = RulesCache() if use_cache else None
 
     try:
-        data_ext = os.path.splitext(data)[1]
-        if data_ext == '.xlsx':
-            data_reader = XLSX_DictReader.from_file(data, prompt=True)
-        elif data_ext in ('.txt', '.csv'):
-            data_file = open(data)
-            if data_ext == '.csv':
-                delim = ','
-            else:  # may be tab or comma delimited
-                delim = '\t' if '\t' in data_file.read(1000) else ','
-                data_file.seek(0)
-            data_reader = CSV_DictReader(data_file, delimiter=delim)
-
-        else:
-            raise click.BadParameter('data file must be an XLSX, TXT, or CSV file',
-                                     param='data', param_hint='data')
-
-        rules_ext = os.path.splitext(rules)[1]
-        if rules_ext == '.xlsx':
-            rule_reader = XLSX_DictReader.from_file(rules, prompt=True)
-        elif rules_ext in ('.txt', '.csv'):
-            rules_file = open(rules)
-            if rules_ext == '.csv':
-                delim = ','
-            else:  # may be tab or comma delimited
-                delim = '\t' if '\t' in rules_file.read(1000) else ','
-                rules_file.seek(0)
-            rule_reader = CSV_DictReader(rules_file, delimiter=delim)
-
-        else:
-            raise click.BadParameter('rules file must be an XLSX, TXT, or CSV file',
-                                     param='rules', param_hint='rules')
+        with timer.phase('open data'):
+            data_reader = _open_reader(data, 'data', read_only=True)
+        with timer.phase('read rules'):
+            rules = _read_rules(rules, cache=cache)
 
     except ValueError as e:
-        print(e.message)
+        print(e)
         raise click.Abort()
 
-    if not output:
-        output = '{0}_out.xlsx'.format(os.path.splitext(data)[0])
+    output, format = output_filename(output, data, format)
+    if format in ARROW_FORMATS:
+        _check_pyarrow()
 
-    elif not '.xlsx' in output:
-        output += '.xlsx'
+    if resume and checkpoint_rows is None:
+        checkpoint_rows = CHECKPOINT_ROWS
+    if checkpoint_rows is not None:
+        if format not in RESUMABLE_FORMATS:
+            raise click.UsageError('--checkpoint and --resume require csv or tsv output')
+        if incremental:
+            raise click.UsageError('--checkpoint and --resume cannot be used with --incremental')
 
     # Extract out columns into criteria or new
-    criteria_cols = []
-    result_cols = []  # Any column in rule that doesn't exist in input is used for output when that rule is met
-    for c in rule_reader.fieldnames:
-        if c in data_reader.fieldnames:
-            criteria_cols.append(c)
-        else:
-            result_cols.append(c)
-
-    has_pass_filename = 'Filename' in data_reader.fieldnames
+    criteria_cols, result_cols = rules.split_columns(data_reader.fieldnames)
 
     print('Criteria columns: {}'.format(','.join(criteria_cols)))
     print('New columns added for results: {}'.format(','.join(result_cols)))
 
     # Parse rules
     start = time.time()
-    rules = [rule for rule in rule_reader]
-    ruleset = Ruleset(rules, result_cols)
-    logger.debug('Parsed {} rules in {:.2f} seconds'.format(len(rules),
+    with timer.phase('compile rules'):
+        ruleset = _get_ruleset(rules, result_cols, engine, cache=cache)
+    logger.debug('Parsed {} rules in {:.2f} seconds'.format(len(ruleset.rules),
                                                             time.time() - start))
     logger.debug('Ruleset:\n{0}\n'.format(ruleset))
 
-    # Setup output worksheet
+    # the sheet of an XLSX data file
+    sheet_index = getattr(data_reader, 'sheet_index', None)
+
+    previous = matches = None
+    if incremental:
+        with timer.phase('hash data'):
+            data_hash = file_hash(data)
+        previous = RunState.load(state_filename(output))
+        if previous is not None:
+            # rows of XLSX sheets may include trailing blank rows, so are only
+            # checked while classifying
+            num_rows = getattr(data_reader, 'num_rows', None) if sheet_index is None else None
+            if previous.is_compatible(data_hash, data_reader.fieldnames, result_cols,
+                                      sheet_index, num_rows):
+                first_changed = previous.first_changed(ruleset.fingerprints)
+                count = sum(1 for match in previous.matches if match < 0 or match >= first_changed)
+                print('\n{0} of {1} passes may match changed rules and will be tested again'.format(
+                    count, len(previous.matches)))
+            else:
+                print('\nData, sheet, or result columns changed since the previous run; '
+                      'testing all passes')
+                previous = None
+        matches = array('l')
+
+    nights = NightParser.for_fieldnames(data_reader.fieldnames, filename_format, night_cutoff)
+
+    checkpoint = None
+    if checkpoint_rows is not None:
+        nights_key = None
+        if nights is not None:
+            nights_key = (nights.format, nights.cutoff_hour)
+        with timer.phase('hash data'):
+            data_hash = file_hash(data)
+        checkpoint = Checkpoint(checkpoint_filename(output), data_hash, data_reader.fieldnames,
+                                ruleset.fingerprints,
+                                (format, result_cols, nights_key, sheet_index),
+                                every=checkpoint_rows)
+        if resume:
+            saved = Checkpoint.load(checkpoint.filename)
+            if saved is None or not os.path.exists(output):
+                print('\nNo checkpoint found; classifying all passes')
+            elif not checkpoint.is_compatible(saved):
+                print('\nData, rules, or options changed since the checkpoint; '
+                      'classifying all passes')
+            else:
+                checkpoint.resume(saved)
+                print('\nResuming after {0} passes'.format(checkpoint.rows))
+
+    resume_at = checkpoint.position if checkpoint is not None else None
+    resume_rows = checkpoint.rows if resume_at is not None else 0
+
     start = time.time()
-    output_wb = Workbook(write_only=True)
-    output_ws = output_wb.create_sheet(index=0, title='Classify Results')
+    print('\nClassifying passes')
 
-    output_cols = list(result_cols)
-    if has_pass_filename:
-        output_cols += ['night']
+    tracer = None
+    if explain_rows or explain_file or explain_sample:
+        filename_col = nights.column if nights is not None else None
+        if explain_file and filename_col is None:
+            raise click.UsageError('--explain-file requires a {0} column in DATA'.format(
+                ' or '.join(column for column, _ in FILENAME_FORMATS.values())))
+        selector = RowSelector(explain_rows, explain_file, filename_col, explain_sample)
+        trace_file = trace_file or '{0}_trace.txt'.format(os.path.splitext(output)[0])
+        tracer = Tracer(trace_file, ruleset, data_reader.fieldnames, selector,
+                        resume_at=checkpoint.trace_position if resume_at is not None else None)
+
+    rule_col, index_columns = _sqlite_columns(format, result_cols)
+    run_info = _run_info(rules, data)
+
+    row_progress = None
+    if progress:
+        row_progress = Progress(estimate_rows(data, data_reader), start_rows=resume_rows)
+
+    if pipeline is None:
+        # Parquet or Arrow data written to Parquet or Arrow output is mostly
+        # copied as read (see _classify), so is not worth a pipeline
+        columnar = (os.path.splitext(data)[1].lower() in ARROW_EXTENSIONS and
+                    format in ARROW_FORMATS and tracer is None)
+        pipeline = _cpu_count() > 1 and not columnar
+
+    if pipeline:
+        # reopened in the reader process, using the sheet already chosen
+        if hasattr(data_reader, 'close'):
+            data_reader.close()
+        data_reader = PipelineReader(partial(_open_reader, data, 'data', prompt=False,
+                                             index=sheet_index, read_only=True))
+        writer = PipelineWriter(partial(get_writer, output, format, resume_at=resume_at,
+                                        index_columns=index_columns, run_info=run_info))
+    else:
+        writer = get_writer(output, format, resume_at=resume_at, index_columns=index_columns,
+                            run_info=run_info)
 
-    output_ws.append(output_cols + data_reader.fieldnames)
+    try:
+        summary = _classify(ruleset, data_reader, writer, engine=engine, jobs=jobs,
+                            nights=nights, profile=profile, optimize=optimize, previous=previous,
+                            matches=matches, memo_size=memo_size, tracer=tracer,
+                            checkpoint=checkpoint, rule_col=rule_col, timer=timer,
+                            progress=row_progress)
+    except (PipelineError, StateMismatch) as e:
+        raise click.ClickException(str(e))
+    finally:
+        if pipeline:
+            data_reader.close()
+            writer.terminate()
+        if tracer is not None:
+            tracer.close()
+
+    if incremental:
+        RunState(data_hash, data_reader.fieldnames, result_cols, ruleset.fingerprints,
+                 matches, sheet_index).save(state_filename(output))
+
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    print('\nEvaluated {} passes in {:.2f} seconds'.format(summary.total, time.time() - start))
+    for result in (True, False):
+        print('{1} {0}'.format('matched a rule' if result else 'did not match any rules',
+                               summary.classified[result]))
 
-    empty_row = [''] * len(result_cols)
+    memo_total = summary.memo_hits + summary.memo_misses
+    if memo_total:
+        print('Memo hit rate: {0:.1%} ({1} hits, {2} misses)'.format(
+            summary.memo_hits / memo_total, summary.memo_hits, summary.memo_misses))
 
-    inspect_idx = result_cols.index('Inspect')
-    if inspect_idx >= 0:
-        empty_row[inspect_idx] = 'Yes'
+    if tracer is not None:
+        print('Explained {0} passes in {1}'.format(tracer.count, tracer.filename))
 
-    print('\nClassifying passes')
-    counter = 0
-    counts = {k: dict() for k in result_cols}
-    nights = {}
-    classified = Counter()
-
-    for i, row in enumerate(data_reader):
-        logger.info('classifying row #{0}'.format(i))
-
-        # Classify row
-        result = ruleset.test(row)
-        if result:
-            output_row = result
-            for index, key in enumerate(result_cols):
-                value = result[index]
-                if value not in counts[key]:
-                    counts[key][value] = 0
-                counts[key][value] += 1
-        else:
-            output_row = list(empty_row)
-
-        classified.update([bool(result)])
-
-        if has_pass_filename:
-            filename = os.path.split(row['Filename'])[1]
-            night = _extract_sonobat_night(filename) or ''
-            if night:
-                if night not in nights:
-                    nights[night] = Counter()
-                nights[night].update([bool(result)])
-
-            output_row.append(night)
-
-        # row.values() does not preserve order when using csv
-        orig_values = [row[k] for k in data_reader.fieldnames]
-        output_row.extend(orig_values)
-        output_ws.append(output_row)
-
-        counter += 1
-        # if counter > 2:  # FIXME
-        #     break
-
-
-
-    # Report overall hits and misses
-    output_ws = output_wb.create_sheet(index=1, title='Classification Summary')
-    output_ws.append(['Classified', 'Count'])
-    for result in (True, False):
-        output_ws.append(['Yes' if result else 'No', classified[result]])
-    output_ws.append(['Total', sum(classified.values())])
-
-    if has_pass_filename and len(nights):
-        # Report hits and misses for each night
-        output_ws = output_wb.create_sheet(index=2, title='Night Classification Summary')
-        output_ws.append(
-            ['Night', 'Rows Classified', 'Rows Not Classified', 'Total Rows'])
-        nights_keys = list(nights.keys())
-        nights_keys.sort()
-        for night in nights_keys:
-            output_ws.append(
-                [night] + [nights[night][value] for value in (True, False)] + [
-                    sum(nights[night].values())])
-
-    # Create a summary sheet for all values in classified output
-    for i, key in enumerate(result_cols):
-        if len(counts[key].keys()) > 1:
-            output_ws = output_wb.create_sheet(index=i + 3, title='{0} Summary'.format(key))
-            output_ws.append(['Value', 'Rows Classified'])
-            values = [x for x in counts[key].keys() if x]
-            if len(set(type(x) for x in values)) == 1:
-                # cannot sort if values is mixed types
-                values.sort()
-            if None in counts[key].keys():
-                values = [None] + values
-            for value in values:
-                output_ws.append([value, counts[key][value]])
-
-    output_wb.save(filename=output)
-
-
-    print('\nEvaluated {} passes in {:.2f} seconds'.format(counter, time.time() - start))
+    if profile_json is not None:
+        summary.profile.to_json(profile_json)
+        print('Rule profile written to {0}'.format(profile_json))
+
+    if progress or report_json is not None:
+        report = timer.report(summary.total)
+        if progress:
+            print('\n' + '\n'.join(format_report(report)))
+        if report_json is not None:
+            write_report(report_json, report)
+            print('Run report written to {0}'.format(report_json))
+
+
+# Rules used by each batch worker process, set once when the worker starts
+_batch_rules = None
+
+
+def _init_batch_worker(rules):
+    global _batch_rules
+    _batch_rules = rules
+
+
+def _classify_file(rules, data, output, format, engine='linear', filename_format=None,
+                   night_cutoff=12, optimize=False):
+    """Classify a single data file using ParsedRules without prompting, and
+    write the results to output.  Returns the Summary."""
+
+    data_reader = _open_reader(data, 'data', prompt=False, read_only=True)
+    result_cols = rules.split_columns(data_reader.fieldnames)[1]
+    ruleset = rules.ruleset(result_cols, indexed=engine == 'indexed')
+    nights = NightParser.for_fieldnames(data_reader.fieldnames, filename_format, night_cutoff)
+    rule_col, index_columns = _sqlite_columns(format, result_cols)
+    writer = get_writer(output, format, index_columns=index_columns,
+                        run_info=_run_info(rules, data))
+    summary = _classify(ruleset, data_reader, writer, engine=engine, nights=nights,
+                        optimize=optimize, rule_col=rule_col)
+    if hasattr(data_reader, 'close'):
+        data_reader.close()
+    return summary
+
+
+def _batch_file(data, output, format, engine, filename_format, night_cutoff, optimize=False):
+    """Classify a single data file in a batch.  Returns (data, Summary or None,
+    error message or None)."""
+
+    try:
+        summary = _classify_file(_batch_rules, data, output, format, engine, filename_format,
+                                 night_cutoff, optimize=optimize)
+        return data, summary, None
+
+    except Exception as e:
+        logger.exception('Error classifying {0}'.format(data))
+        return data, None, str(e)
+
+
+@cli.command(short_help='Apply the rules to many data files.')
+@click.argument('rules', type=click.Path(exists=True))
+@click.argument('data', nargs=-1, required=True)
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False), default=None,
+              help='Directory for output files.  Defaults to the directory of each data file.')
+@click.option('-s', '--summary', 'summary_filename', type=click.Path(dir_okay=False), default=None,
+              help='Filename for the summary of all files.  Defaults to '
+                   'batch_summary.<format> in the output directory, or the common '
+                   'directory of the data files.')
+@click.option('-v', '--verbose', count=True, help='Verbose output')
+@ENGINE_OPTION
+@FORMAT_OPTION
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of data files to classify at the same time')
+@CACHE_OPTION
+@FILENAME_FORMAT_OPTION
+@NIGHT_CUTOFF_OPTION
+@OPTIMIZE_OPTION
+def batch(rules, data, output_dir, summary_filename, verbose, engine, format, jobs, use_cache,
+          filename_format, night_cutoff, optimize):
+    """Apply the rules to each DATA file or glob pattern, e.g., "site*/*.csv".
+
+    The rules are read once, and each data file gets its own output file named
+    after the data file (<data>_out.<format>).  With --output-dir, outputs are
+    placed in the same subdirectories of it as the data files are of their
+    common directory.  A summary of matched and unmatched rows per file and per
+    night is written for all files, next to the outputs.
+
+    Files matched by a glob pattern that were written by batch (outputs, their
+    summary tables, and the batch summary) are skipped.
+    """
+
+    configure_logging(verbose)
+    _check_engine(engine)
+    if format in ARROW_FORMATS:
+        _check_pyarrow()
+
+    summary_name = BATCH_SUMMARY
+    if summary_filename:
+        summary_name = os.path.splitext(os.path.basename(summary_filename))[0]
+
+    def is_output(filename):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        return (BATCH_OUTPUT_RE.search(name) is not None or name == summary_name or
+                name.startswith(summary_name + '_'))
+
+    filenames = []
+    skipped = 0
+    for pattern in data:
+        matches = [pattern]
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            skipped += sum(1 for filename in matches if is_output(filename))
+            matches = [filename for filename in matches if not is_output(filename)]
+        for filename in matches:
+            if not os.path.isfile(filename):
+                raise click.BadParameter('{0} does not exist'.format(filename),
+                                         param_hint='data')
+            if filename not in filenames:
+                filenames.append(filename)
+
+    if skipped:
+        print('Skipping {0} files written by a previous batch'.format(skipped))
+    if not filenames:
+        raise click.BadParameter('no data files found', param_hint='data')
+
+    cache = RulesCache() if use_cache else None
+
+    start = time.time()
+    try:
+        rules = _read_rules(rules, cache=cache)
+    except ValueError as e:
+        print(e)
+        raise click.Abort()
+
+    logger.debug('Read {} rules in {:.2f} seconds'.format(len(rules.rows), time.time() - start))
+
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # outputs keep the directories of the data files below their common
+    # directory, so that data files with the same name do not share an output
+    common_dir = os.path.commonpath([os.path.dirname(os.path.abspath(filename))
+                                     for filename in filenames])
+
+    tasks = []
+    outputs = {}
+    for filename in filenames:
+        output = None
+        if output_dir:
+            relative = os.path.relpath(os.path.abspath(filename), common_dir)
+            output = os.path.join(output_dir, '{0}_out'.format(os.path.splitext(relative)[0]))
+        output, file_format = output_filename(output, filename, format)
+
+        key = os.path.normcase(os.path.abspath(output))
+        if key in outputs:
+            raise click.BadParameter('{0} and {1} would both be written to {2}'.format(
+                outputs[key], filename, output), param_hint='data')
+        outputs[key] = filename
+
+        tasks.append((filename, output, file_format, engine, filename_format, night_cutoff,
+                      optimize))
+
+    for output in set(os.path.dirname(task[1]) for task in tasks):
+        if output and not os.path.exists(output):
+            os.makedirs(output)
+
+    print('Classifying {0} files'.format(len(tasks)))
+    start = time.time()
+
+    if jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(jobs, len(tasks)), initializer=_init_batch_worker, initargs=(rules, ))
+        results = pool.starmap(_batch_file, tasks, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        _init_batch_worker(rules)
+        results = [_batch_file(*task) for task in tasks]
+
+    file_rows = []
+    night_rows = []
+    total = Summary([])
+    failed = []
+    for filename, summary, error in results:
+        if summary is None:
+            print('{0}: FAILED ({1})'.format(filename, error))
+            failed.append(filename)
+            continue
+
+        total.merge(summary)
+        file_rows.append([filename, summary.classified[True], summary.classified[False],
+                          summary.total])
+        for night in sorted(summary.nights.keys()):
+            counts = summary.nights[night]
+            night_rows.append([filename, night, counts[True], counts[False],
+                               sum(counts.values())])
+
+    if not summary_filename:
+        summary_filename = os.path.join(output_dir or common_dir, BATCH_SUMMARY)
+    summary_filename, summary_format = output_filename(summary_filename, BATCH_SUMMARY, format)
+
+    writer = get_writer(summary_filename, summary_format, title='File Summary')
+    writer.write_header(['File', 'Rows Classified', 'Rows Not Classified', 'Total Rows'])
+    for row in file_rows:
+        writer.write_row(row)
+    writer.write_row(['Total', total.classified[True], total.classified[False], total.total])
+    if night_rows:
+        writer.write_table('Night Summary',
+                           ['File', 'Night', 'Rows Classified', 'Rows Not Classified', 'Total Rows'],
+                           night_rows)
+    writer.close()
+
+    print('\nEvaluated {} passes in {} files in {:.2f} seconds'.format(
+        total.total, len(file_rows), time.time() - start))
     for result in (True, False):
-        print('{1} {0}'.format('matched a rule' if result else 'did not match any rules', classified[result]))
\ No newline at end of file
+        print('{1} {0}'.format('matched a rule' if result else 'did not match any rules',
+                               total.classified[result]))
+    print('Summary written to {0}'.format(summary_filename))
+
+    if failed:
+        raise click.ClickException('{0} files could not be classified'.format(len(failed)))
+
+
+@cli.command(short_help='Run a local service that classifies data files on request.')
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='Address to listen on.  Jobs can read and write any file that echoclean '
+                   'can, so only listen on addresses that trusted users can reach.')
+@click.option('--port', type=click.IntRange(0, 65535), default=8642, show_default=True)
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of worker processes used to classify data files')
+@click.option('--queue-size', type=click.IntRange(min=0), default=100, show_default=True,
+              help='Maximum number of jobs waiting for a worker; more are rejected')
+@CACHE_OPTION
+@click.option('-v', '--verbose', count=True, help='Verbose output')
+def serve(host, port, jobs, queue_size, use_cache, verbose):
+    """Run a local HTTP service that applies rules to data files on request,
+    keeping the rules read by each worker in memory between requests.
+
+    \b
+    Submit a job (only rules and data are required):
+        curl -d '{"rules": "rules.xlsx", "data": "night1.csv", "wait": true}' \\
+            http://127.0.0.1:8642/jobs
+    \b
+    Other requests:
+        GET /jobs/<id>   status and results of a job
+        GET /stats       throughput and queue depth
+    """
+
+    from echoclean.service import ClassifyService, make_server
+
+    configure_logging(verbose)
+
+    service = ClassifyService(jobs=jobs, queue_size=queue_size, use_cache=use_cache)
+    server = make_server(service, host, port)
+    print('Listening on http://{0}:{1} (press Ctrl+C to stop)'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('Waiting for queued jobs to finish')
+        service.close()
+
+
+@cli.command('clear-cache', short_help='Remove all cached rules.')
+def clear_cache():
+    """Remove all cached rules."""
+
+    cache = RulesCache()
+    count = cache.clear()
+    print('Removed {0} cached entries from {1}'.format(count, cache.directory))
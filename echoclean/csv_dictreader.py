@@ -0,0 +1,21 @@
+import csv
+
+
+class DictReader(csv.DictReader):
+    """csv.DictReader that can also generate rows as lists of values."""
+
+    def iter_values(self):
+        """Generate remaining rows as lists of values in the order of
+        fieldnames, without creating a dict for each row.  Rows are padded or
+        truncated to the number of fieldnames, and blank rows are skipped, the
+        same as for dicts."""
+
+        num_fields = len(self.fieldnames)  # reads the header, if not yet read
+        padding = [self.restval] * num_fields
+        for row in self.reader:
+            self.line_num = self.reader.line_num
+            if not row:
+                continue
+            if len(row) != num_fields:
+                row = (row + padding)[:num_fields]
+            yield row
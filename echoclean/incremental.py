@@ -0,0 +1,82 @@
+"""State of a previous classification run, used to re-classify only the rows
+that could be affected by changes to the rules.
+
+Rules are applied first-match, so a row that matched a rule before the first
+changed rule must still match that same rule; only rows that matched a later
+rule (or no rule) need to be tested again, and only against the changed rules
+and those that follow them.
+
+The state is saved to a sidecar file next to the output, <output>.echoclean.
+"""
+
+from array import array
+from itertools import islice
+
+from echoclean.storage import load_pickle, save_pickle
+
+
+# Increment when the structure of saved state changes
+STATE_VERSION = 2
+
+
+class StateMismatch(Exception):
+    """The rows of a data file do not match the saved state of a previous run."""
+    pass
+
+
+def state_filename(output):
+    return output + '.echoclean'
+
+
+class RunState(object):
+    """Rule index matched by each row of a data file (-1 if no rules matched),
+    along with what is needed to check that the data file has not changed and
+    to find which rules have.  sheet_index is the sheet read from an XLSX
+    data file (None for other files)."""
+
+    def __init__(self, data_hash, fieldnames, result_cols, fingerprints, matches=None,
+                 sheet_index=None):
+        self.data_hash = data_hash
+        self.fieldnames = list(fieldnames)
+        self.result_cols = list(result_cols)
+        self.sheet_index = sheet_index
+        self.fingerprints = list(fingerprints)
+        self.matches = matches if matches is not None else array('l')
+
+    def is_compatible(self, data_hash, fieldnames, result_cols, sheet_index=None,
+                      num_rows=None):
+        """Return True if state was saved for the same data (and sheet) and
+        result columns, and has a match for each of num_rows rows, if known."""
+
+        return (self.data_hash == data_hash and self.sheet_index == sheet_index and
+                self.fieldnames == list(fieldnames) and self.result_cols == list(result_cols) and
+                (num_rows is None or len(self.matches) == num_rows))
+
+    def first_changed(self, fingerprints):
+        """Return index of the first rule in fingerprints that differs from the
+        rules of the previous run, or len(fingerprints) if none differ."""
+
+        for i, (previous, current) in enumerate(zip(self.fingerprints, fingerprints)):
+            if previous != current:
+                return i
+        return min(len(self.fingerprints), len(fingerprints))
+
+    def chunks(self, chunk_size):
+        """Generate lists of up to chunk_size matched rule indexes, in the same
+        chunks as echoclean.classify.iter_chunks."""
+
+        matches = iter(self.matches)
+        while True:
+            chunk = list(islice(matches, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def save(self, filename):
+        save_pickle(self, filename, STATE_VERSION)
+
+    @classmethod
+    def load(cls, filename):
+        """Return RunState saved in filename, or None if not found or unreadable."""
+
+        return load_pickle(filename, STATE_VERSION, 'previous run')
@@ -0,0 +1,83 @@
+import os
+import re
+import datetime
+
+
+# Patterns for extracting the recording date and hour from a .wav filename,
+# and the data column that contains the filename, for each output format
+FORMATS = {
+    # e.g., SITE_20190601_221530_123.wav
+    'sonobat': (
+        'Filename',
+        re.compile(r'(?P<date>\d{8})_(?P<hour>\d{2})\d{4}_\d{3}')
+    ),
+    # e.g., S4U01234_20190601_221530.wav
+    'kaleidoscope': (
+        'IN FILE',
+        re.compile(r'(?P<date>\d{8})_(?P<hour>\d{2})\d{4}')
+    ),
+}
+
+
+class NightParser(object):
+    """Extract the night on which a pass was recorded from its filename.
+
+    Anything recorded before cutoff_hour (noon by default) is considered part
+    of the previous night.  Nights are memoized on the recording date and hour,
+    since many passes share the same date and hour.
+    """
+
+    def __init__(self, format='sonobat', cutoff_hour=12, column=None):
+        if format not in FORMATS:
+            raise ValueError('Unsupported filename format: {0}'.format(format))
+        if not 0 <= cutoff_hour <= 23:
+            raise ValueError('cutoff_hour must be between 0 and 23')
+
+        default_column, self.pattern = FORMATS[format]
+        self.format = format
+        self.column = column or default_column
+        self.cutoff_hour = cutoff_hour
+        self._nights = {}
+
+    @classmethod
+    def for_fieldnames(cls, fieldnames, format=None, cutoff_hour=12):
+        """Return NightParser for the first format (or only format, if provided)
+        whose filename column is present in fieldnames, or None."""
+
+        for name in ([format] if format else FORMATS):
+            if FORMATS[name][0] in fieldnames:
+                return cls(name, cutoff_hour=cutoff_hour)
+        return None
+
+    def _night(self, date, hour):
+        key = (date, hour)
+        try:
+            return self._nights[key]
+        except KeyError:
+            pass
+
+        d = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:8]), int(hour))
+        if d.hour < self.cutoff_hour:
+            d = d - datetime.timedelta(days=1)
+        night = self._nights[key] = d.strftime('%m/%d/%Y')
+        return night
+
+    def __call__(self, filename):
+        """Return night as MM/DD/YYYY, or None if filename does not match."""
+
+        match = self.pattern.search(os.path.split(filename)[1])
+        if match:
+            return self._night(*match.groups())
+        return None
+
+    def parse_many(self, filenames):
+        """Return list of nights for filenames (None where they do not match)."""
+
+        search = self.pattern.search
+        split = os.path.split
+        night = self._night
+        nights = []
+        for filename in filenames:
+            match = search(split(filename)[1])
+            nights.append(night(*match.groups()) if match else None)
+        return nights
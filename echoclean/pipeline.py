@@ -0,0 +1,191 @@
+"""Reading and writing rows in separate processes, so that parsing the data
+file and generating the output file overlap with classifying rows.
+
+The stages are connected by bounded queues of chunks of rows, so memory use is
+limited by the queue depth regardless of the size of the data file, and rows are
+written in the same order as they are read.
+
+PipelineReader and PipelineWriter can be used in place of a data reader and
+a writer (see echoclean.writers) respectively.
+"""
+
+import traceback
+from queue import Empty, Full
+
+from echoclean.classify import CHUNK_SIZE, iter_chunks
+
+
+# Maximum number of chunks waiting in each queue
+QUEUE_DEPTH = 4
+
+# Seconds to wait on a queue before checking that the other stage is still running
+POLL_INTERVAL = 0.5
+
+
+class PipelineError(Exception):
+    pass
+
+
+def _put(queue, message, process):
+    while True:
+        try:
+            queue.put(message, timeout=POLL_INTERVAL)
+            return
+        except Full:
+            if not process.is_alive():
+                raise PipelineError('{0} stopped unexpectedly'.format(process.name))
+
+
+def _get(queue, process):
+    while True:
+        try:
+            kind, value = queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            if not process.is_alive():
+                raise PipelineError('{0} stopped unexpectedly'.format(process.name))
+            continue
+
+        if kind == 'error':
+            raise PipelineError('{0} failed:\n{1}'.format(process.name, value))
+        return kind, value
+
+
+def _read_stage(open_reader, chunk_size, queue):
+    try:
+        reader = open_reader()
+        queue.put(('fieldnames', reader.fieldnames))
+        for chunk in iter_chunks(reader, reader.fieldnames, chunk_size):
+            queue.put(('chunk', chunk))
+        if hasattr(reader, 'close'):
+            reader.close()
+        queue.put(('done', None))
+
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def _write_stage(open_writer, queue, results):
+    try:
+        writer = open_writer()
+        while True:
+            kind, value = queue.get()
+            if kind == 'header':
+                writer.write_header(value)
+            elif kind == 'rows':
+                for row in value:
+                    writer.write_row(row)
+            elif kind == 'checkpoint':
+                results.put(('checkpoint', writer.checkpoint()))
+            elif kind == 'table':
+                writer.write_table(*value)
+            elif kind == 'close':
+                writer.close()
+                results.put(('done', None))
+                return
+
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
+
+class PipelineReader(object):
+    """Read rows using open_reader() (which returns a data reader) in a separate
+    process.
+
+    Rows are available as chunks of chunk_size lists of values in the order of
+    fieldnames, the same as echoclean.classify.iter_chunks.
+    """
+
+    def __init__(self, open_reader, chunk_size=CHUNK_SIZE, depth=QUEUE_DEPTH):
+        import multiprocessing  # slow to import, so only imported if used
+
+        self.chunk_size = chunk_size
+        self._queue = multiprocessing.Queue(depth)
+        self._process = multiprocessing.Process(
+            target=_read_stage, args=(open_reader, chunk_size, self._queue),
+            name='reader', daemon=True)
+        self._process.start()
+
+        self.fieldnames = _get(self._queue, self._process)[1]
+
+    def chunks(self):
+        while True:
+            kind, value = _get(self._queue, self._process)
+            if kind == 'done':
+                self._process.join()
+                return
+            yield value
+
+    def close(self):
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+
+
+class PipelineWriter(object):
+    """Write rows using open_writer() (which returns a writer) in a separate
+    process.  Rows are sent to the writer process in batches of batch_size."""
+
+    def __init__(self, open_writer, batch_size=CHUNK_SIZE, depth=QUEUE_DEPTH):
+        import multiprocessing  # slow to import, so only imported if used
+
+        self.batch_size = batch_size
+        self._rows = []
+        self._queue = multiprocessing.Queue(depth)
+        self._results = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_write_stage, args=(open_writer, self._queue, self._results),
+            name='writer', daemon=True)
+        self._process.start()
+
+    def _send(self, kind, value):
+        try:
+            # report an error from the writer rather than waiting on a full queue
+            _, message = self._results.get_nowait()
+            raise PipelineError('writer failed:\n{0}'.format(message))
+        except Empty:
+            pass
+
+        _put(self._queue, (kind, value), self._process)
+
+    def _flush(self):
+        if self._rows:
+            self._send('rows', self._rows)
+            self._rows = []
+
+    def write_header(self, columns):
+        self._send('header', columns)
+
+    def write_row(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def checkpoint(self):
+        """Wait for all rows to be written to disk, and return the position in
+        the output file after them (see DelimitedWriter.checkpoint)."""
+
+        self._flush()
+        self._send('checkpoint', None)
+        return _get(self._results, self._process)[1]
+
+    def write_table(self, title, header, rows):
+        self._flush()
+        self._send('table', (title, header, list(rows)))
+
+    def close(self):
+        """Wait for all rows to be written; raises PipelineError if the writer
+        failed."""
+
+        self._flush()
+        self._send('close', None)
+        try:
+            _get(self._results, self._process)
+        finally:
+            self._process.join()
+
+    def terminate(self):
+        """Stop the writer process without waiting for rows to be written."""
+
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
@@ -0,0 +1,73 @@
+import json
+from collections import Counter
+
+
+class RuleProfile(object):
+    """Counts of rows tested, matched, and rejected by each rule of a Ruleset,
+    the criterion (column) that caused each rejection, and the cumulative time
+    spent evaluating each rule."""
+
+    def __init__(self, num_rules):
+        self.tested = [0] * num_rules
+        self.matched = [0] * num_rules
+        self.rejected_by = [Counter() for _ in range(num_rules)]
+        self.time = [0.0] * num_rules
+
+    @property
+    def rejected(self):
+        return [sum(counts.values()) for counts in self.rejected_by]
+
+    def add(self, index, failed, elapsed):
+        """Record result of testing rule at index: failed is the column of the
+        criterion that rejected the row, or None if the rule matched."""
+
+        self.tested[index] += 1
+        self.time[index] += elapsed
+        if failed is None:
+            self.matched[index] += 1
+        else:
+            self.rejected_by[index][failed] += 1
+
+    def merge(self, other):
+        for i in range(len(self.tested)):
+            self.tested[i] += other.tested[i]
+            self.matched[i] += other.matched[i]
+            self.rejected_by[i].update(other.rejected_by[i])
+            self.time[i] += other.time[i]
+
+    def table(self):
+        """Return profile as a summary table (title, header, rows)."""
+
+        header = ['Rule', 'Tested', 'Matched', 'Rejected', 'Match Rate', 'Time (ms)',
+                  'Time per Row (us)', 'Rejected By']
+        rows = []
+        rejected = self.rejected
+        for i, tested in enumerate(self.tested):
+            rows.append([
+                i + 1,
+                tested,
+                self.matched[i],
+                rejected[i],
+                round(self.matched[i] / tested, 4) if tested else None,
+                round(self.time[i] * 1e3, 3),
+                round(self.time[i] * 1e6 / tested, 3) if tested else None,
+                ', '.join('{0}: {1}'.format(k, v) for k, v in self.rejected_by[i].most_common())
+            ])
+
+        return 'Rule Profile', header, rows
+
+    def to_json(self, filename):
+        rejected = self.rejected
+        rules = []
+        for i, tested in enumerate(self.tested):
+            rules.append({
+                'rule': i + 1,
+                'tested': tested,
+                'matched': self.matched[i],
+                'rejected': rejected[i],
+                'rejected_by': dict(self.rejected_by[i].most_common()),
+                'time': self.time[i],
+            })
+
+        with open(filename, 'w') as f:
+            json.dump({'rules': rules}, f, indent=2)
@@ -0,0 +1,194 @@
+"""Live progress of a classification run, and a report of the time spent in
+each phase of the run and its peak memory use."""
+
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Bytes read from the start of a delimited file to estimate its number of rows
+SAMPLE_SIZE = 1 << 20
+
+# Minimum seconds between progress updates on a terminal, and when written to
+# a file or pipe (one line per update)
+UPDATE_INTERVAL = 0.5
+LOG_INTERVAL = 10
+
+
+def estimate_rows(filename, reader):
+    """Return the number of rows of data in filename, if known by reader
+    (e.g., XLSX or Parquet files), otherwise estimated from the size of the
+    file and the length of the rows at its start, or None if unknown."""
+
+    num_rows = getattr(reader, 'num_rows', None)
+    if num_rows is not None:
+        return num_rows
+
+    if os.path.splitext(filename)[1].lower() not in ('.csv', '.txt'):
+        return None
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+
+    lines = sample.count(b'\n')
+    if len(sample) < size:
+        lines = int(lines * size / len(sample))
+    elif not sample.endswith(b'\n'):
+        lines += 1
+    return max(lines - 1, 0)  # not including the header
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+class Progress(object):
+    """Write the number of rows classified, rows per second, and (if the total
+    number of rows is known or estimated) percent complete and estimated time
+    remaining to stream as rows are classified.
+
+    start_rows is the number of rows already classified (e.g., by a resumed
+    run), which are not counted toward rows per second.
+    """
+
+    def __init__(self, total=None, start_rows=0, stream=None, interval=UPDATE_INTERVAL):
+        self.total = total
+        self.start_rows = start_rows
+        self.stream = stream or sys.stderr
+        self._tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.interval = interval if self._tty else max(interval, LOG_INTERVAL)
+        self._started = self._updated = time.perf_counter()
+        self._rows = None  # rows at the last update
+
+    def update(self, rows, force=False):
+        now = time.perf_counter()
+        if not force and now - self._updated < self.interval:
+            return
+        self._updated = now
+        self._rows = rows
+
+        elapsed = now - self._started
+        rate = (rows - self.start_rows) / elapsed if elapsed else 0
+        message = '{0:,} passes, {1:,.0f} passes/s'.format(rows, rate)
+
+        if self.total:
+            message += ', {0:.0%}'.format(min(rows / self.total, 1))
+            if rate and rows < self.total:
+                message += ', {0} remaining'.format(
+                    _format_duration((self.total - rows) / rate))
+
+        # overwrite the line on a terminal, otherwise write one line per update
+        if self._tty:
+            self.stream.write('\r{0:<79}'.format(message))
+        else:
+            self.stream.write(message + '\n')
+        self.stream.flush()
+
+    def finish(self, rows):
+        if rows != self._rows:
+            self.update(rows, force=True)
+        if self._tty:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+def peak_memory():
+    """Return peak memory (resident set size, in MB) used by this process, and
+    by the largest of its child processes that have finished (e.g., pipeline
+    and worker processes), or (None, None) if not available (on Windows)."""
+
+    try:
+        import resource
+    except ImportError:
+        return None, None
+
+    # ru_maxrss is in bytes on MacOS, and KB elsewhere
+    scale = 1 << 20 if sys.platform == 'darwin' else 1 << 10
+    return tuple(round(resource.getrusage(who).ru_maxrss / scale, 1)
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+class PhaseTimer(object):
+    """Total time spent in each phase of a run (e.g., reading rules, matching
+    rules, writing output), in the order in which phases were first timed.
+
+    Phases that run in other processes (--jobs, or a pipeline) overlap with
+    those of the main process, so phases may add up to more than the total.
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase name."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def iter(self, name, iterable):
+        """Generate items of iterable, timing the time taken to get each as
+        phase name."""
+
+        items = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def report(self, rows):
+        """Return report of rows classified, total and per-phase seconds, and
+        peak memory (MB) as a dict."""
+
+        seconds = time.perf_counter() - self.started
+        main, children = peak_memory()
+        return OrderedDict([
+            ('rows', rows),
+            ('seconds', round(seconds, 3)),
+            ('rows_per_sec', round(rows / seconds, 1) if seconds else None),
+            ('phases', OrderedDict((name, round(value, 3)) for name, value in self.phases.items())),
+            ('peak_memory_mb', OrderedDict([('main', main), ('children', children)])),
+        ])
+
+
+def format_report(report):
+    """Return report (from PhaseTimer.report()) as lines of text."""
+
+    lines = ['Time by phase:']
+    width = max([len(name) for name in report['phases']] + [len('total')])
+    for name, seconds in report['phases'].items():
+        lines.append('  {0:<{1}}  {2:>9.2f}s  {3:>6.1%}'.format(
+            name, width, seconds, seconds / report['seconds'] if report['seconds'] else 0))
+    lines.append('  {0:<{1}}  {2:>9.2f}s'.format('total', width, report['seconds']))
+
+    memory = report['peak_memory_mb']
+    if memory['main'] is not None:
+        line = 'Peak memory: {0:.1f} MB'.format(memory['main'])
+        if memory['children']:
+            line += ' (child processes: {0:.1f} MB)'.format(memory['children'])
+        lines.append(line)
+
+    return lines
+
+
+def write_report(filename, report):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
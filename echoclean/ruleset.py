@@ -1,7 +1,14 @@
 import re
-import copy
+import math
+import time
+import hashlib
 import logging
-from six import string_types
+import operator
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from echoclean.bitset import RuleIndex, Unindexable
 
 
 logger = logging.getLogger('echoclean')
@@ -10,74 +17,602 @@ logger = logging.getLogger('echoclean')
 NUMBER_RE = re.compile('\d+\.*\d*')
 COMPARATOR_RE = re.compile('[<>]=*')
 EMPTY_VALUES = (None, '', 'blank')
+# Default maximum number of combinations of criteria values in a MatchMemo
+MEMO_SIZE = 100000
+
+# A MatchMemo stops being used if fewer than MEMO_MIN_HIT_RATE of its lookups
+# are hits after at least MEMO_WARMUP lookups, since building keys is then
+# wasted effort
+MEMO_WARMUP = 10000
+MEMO_MIN_HIT_RATE = 0.2
+
+COMPARATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def normalize(value):
+    """Standardize a data value to match criteria: strings are lowercased and
+    stripped, and blank values are converted to None."""
+    if isinstance(value, str):
+        value = value.lower().strip()
+    if value in EMPTY_VALUES:
+        return None
+    return value
+
+
+def normalize_number(value):
+    """Standardize a data value for numeric criteria: blank values are converted
+    to None and all others to float.
+
+    Values that cannot be converted are returned as an InvalidNumber, so that
+    an error is only raised if a numeric criterion is tested against it.
+    """
+    value = normalize(value)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return InvalidNumber(value)
+
+
+class InvalidNumber(object):
+    """A value in a numeric column that could not be converted to a number.
+    Raises ValueError if converted to or compared against a number."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __float__(self):
+        raise ValueError('could not convert string to float: {0!r}'.format(self.value))
+
+    def _compare(self, other):
+        if isinstance(other, (int, float)):
+            float(self)
+        return NotImplemented
+
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _compare
+    __hash__ = object.__hash__
+
+
+class NormalizationPlan(object):
+    """Standardizes only the values of a row that are tested by criteria.
+
+    Columns tested only by numeric criteria (and any / blank) are converted to
+    float once, rather than on each comparison; all other criteria columns are
+    normalized as strings.  Other columns in the row are not touched.
+
+    Normalized rows are lists of values in the order of columns; positions
+    gives the index of each column in them.
+    """
+
+    def __init__(self, rules, columns):
+        self.columns = list(columns)
+        self.positions = {key: i for i, key in enumerate(self.columns)}
+        self.numeric_cols = []
+        self.text_cols = []
+        self._converters = []
+        for key in columns:
+            criteria = [rule.criteria[key] for rule in rules if key in rule.criteria]
+            criteria = [c for c in criteria if not (c.is_any or c.is_blank)]
+            if criteria and all(c.is_number for c in criteria):
+                self.numeric_cols.append(key)
+                self._converters.append(normalize_number)
+            else:
+                self.text_cols.append(key)
+                self._converters.append(normalize)
+
+    def keys(self, fieldnames):
+        """Return keys used to get the values of columns from rows that are
+        sequences of values in the order of fieldnames."""
+
+        fieldnames = list(fieldnames)
+        return [fieldnames.index(key) for key in self.columns]
+
+    def __call__(self, row, keys=None):
+        """Return a new list of normalized criteria values from row.
+
+        row is a dict, or a sequence of values if keys are provided (see keys()).
+        """
+
+        if keys is None:
+            keys = self.columns
+        return [convert(row[key]) for convert, key in zip(self._converters, keys)]
+
+
+class ParsedRules(object):
+    """Rules read from a rules file, and the Rulesets compiled from them.
+
+    The same rules may be applied to data with different columns, which
+    determine which rule columns are criteria and which are results, so a
+    Ruleset is compiled for each distinct set of result columns.
+    """
+
+    def __init__(self, fieldnames, rows):
+        self.fieldnames = list(fieldnames)
+        self.rows = [dict(row) for row in rows]
+        self.rulesets = {}
+
+        # absolute path of the file the rules were read from, and hash of its
+        # contents, if read from a file
+        self.filename = None
+        self.digest = None
+
+    def split_columns(self, data_fieldnames):
+        """Split rule columns into criteria columns (present in data) and
+        result columns (not present in data)."""
+
+        criteria_cols = []
+        result_cols = []  # Any column in rule that doesn't exist in input is used for output when that rule is met
+        for c in self.fieldnames:
+            if c in data_fieldnames:
+                criteria_cols.append(c)
+            else:
+                result_cols.append(c)
+
+        return criteria_cols, result_cols
+
+    def ruleset(self, result_cols, indexed=False):
+        """Return Ruleset for result_cols, compiling it if needed."""
+
+        key = (tuple(result_cols), indexed)
+        if key not in self.rulesets:
+            # Rule() consumes result values from its rule dict, so pass copies
+            self.rulesets[key] = Ruleset([dict(row) for row in self.rows], result_cols,
+                                         indexed=indexed)
+        return self.rulesets[key]
 
 
 class Ruleset(object):
-    def __init__(self, rules, result_cols):
-        self.rules = [Rule(rule, result_cols) for rule in rules]
+    def __init__(self, rules, result_cols, indexed=False):
+        """Create a ruleset from a list of rule dicts.
+
+        If indexed is True, rules are compiled into a bitset index (see
+        echoclean.bitset) which is used to find the first matching rule instead
+        of testing each rule in turn.  Results are identical either way.
+        """
+        self.result_cols = list(result_cols)
+
+        # rules share Criterion instances for identical criteria (e.g., any)
+        criteria = {}
+        self.rules = [Rule(rule, result_cols, criteria) for rule in rules]
+
+        # union of columns tested by any rule, in order of first appearance
+        self.criteria_cols = []
+        for rule in self.rules:
+            for key in rule.criteria:
+                if key not in self.criteria_cols:
+                    self.criteria_cols.append(key)
+
+        self.plan = NormalizationPlan(self.rules, self.criteria_cols)
+
+        for rule in self.rules:
+            rule.compile(self.plan.numeric_cols, positions=self.plan.positions)
+
+        self.index = None
+        if indexed:
+            self.index = RuleIndex(self.rules, self.criteria_cols)
+
+        # Set to a RuleProfile to record how each rule is evaluated
+        self.profile = None
+
+        # Set to a MatchMemo to reuse the matches of repeated criteria values
+        self.memo = None
 
     def __repr__(self):
         return '---------------------------\n'.join([str(rule) for rule in self.rules])
 
+    def optimize(self, rows=None):
+        """Reorder the criteria of each rule so that those most likely to reject
+        a row, relative to the cost of testing them, are tested first.
+
+        Reject rates are measured on rows (e.g., a sample of the data), counting
+        only the rows that reach each rule.  Without rows, cheaper criteria are
+        tested before more expensive ones.  Criteria within a rule must all
+        pass, so the rule that matches each row is unchanged.
+
+        Numeric criteria raise ValueError for values that are not numbers, so
+        they keep their original order and are tested after all others; a row
+        that raises with the original order may then fail an earlier criterion
+        instead, but no row raises that did not before.  Rows that raise are not
+        counted.
+        """
+
+        reached = [0] * len(self.rules)
+        rejected = [dict.fromkeys(rule.criteria, 0) for rule in self.rules]
+
+        positions = self.plan.positions
+        for row in rows or ():
+            test_row = self.plan(row)
+            try:
+                outcomes = []
+                for i, rule in enumerate(self.rules):
+                    failed = [key for key, criterion in rule.criteria.items()
+                              if not criterion.test(test_row[positions[key]])]
+                    outcomes.append(failed)
+                    if not failed:
+                        break
+            except ValueError:  # invalid number
+                continue
+
+            for i, failed in enumerate(outcomes):
+                reached[i] += 1
+                for key in failed:
+                    rejected[i][key] += 1
+
+        for i, rule in enumerate(self.rules):
+            def rank(key):
+                rate = rejected[i][key] / reached[i] if reached[i] else 0
+                return -rate / rule.cost(key), rule.cost(key)
+
+            numeric = [key for key in rule.criteria if rule.criteria[key].is_number]
+            others = [key for key in rule.criteria if not rule.criteria[key].is_number]
+            rule.compile(rule._numeric_cols, order=sorted(others, key=rank) + numeric)
+
     def test(self, row):
+        """Return a copy of the result values of the first rule that matches row,
+        or None if no rules match."""
+
+        index = self.match(row)
+        if index is None:
+            return None
+        return self.rules[index].result or None
+
+    def match_many(self, rows, start=0, fieldnames=None):
+        """Return array of the index of the first rule that matches each row, or
+        -1 if no rules match.  Rules before start are skipped (see match()).
+
+        Rows are dicts, or if fieldnames are provided, sequences of values in the
+        order of fieldnames, which avoids creating a dict for each row.
+        """
+
+        keys = self.plan.keys(fieldnames) if fieldnames is not None else None
+        match = self.match
+        matches = array('l')
+        for row in rows:
+            index = match(row, start, keys)
+            matches.append(-1 if index is None else index)
+        return matches
+
+    def test_many(self, rows, fieldnames=None):
+        """Return (matches, results) for an iterable of rows (see match_many()),
+        where matches is an array of the index of the first rule that matches
+        each row (-1 if none) and results is a list of the result values of that
+        rule for each row, as a tuple, or None if no rules match.
+
+        Rows that match the same rule share the same result tuple.
+        """
+
+        matches = self.match_many(rows, fieldnames=fieldnames)
+        rule_results = [tuple(rule._result) or None for rule in self.rules]
+        return matches, [rule_results[index] if index >= 0 else None for index in matches]
+
+    def test_columns(self, columns, num_rows=None):
+        """Same as test_many(), for rows stored as a dict of column name to a
+        sequence of values.  Only the criteria columns are required.
+
+        If num_rows is not provided, it is the length of the columns; ValueError
+        is raised if no columns are provided.
+        """
+
+        keys = self.criteria_cols
+        values = [columns[key] for key in keys]
+        if num_rows is None:
+            if not columns:
+                raise ValueError('num_rows is required if no columns are provided')
+            num_rows = len(values[0] if values else next(iter(columns.values())))
+
+        if not keys:  # every row matches the first rule, if any
+            return self.test_many({} for _ in range(num_rows))
+
+        return self.test_many(islice(zip(*values), num_rows), fieldnames=keys)
+
+    @property
+    def fingerprints(self):
+        return [rule.fingerprint for rule in self.rules]
+
+    def match(self, row, start=0, keys=None):
+        """Return the index of the first rule that matches row, or None.
+
+        Rules before start are skipped; use this only if row is known not to
+        match any of them.  row is a dict, or a sequence of values if keys are
+        provided (see NormalizationPlan.keys).
+        """
+
         # Standardize row values to match criteria
-        test_row = copy.deepcopy(row)  # need to copy so we don't alter original row
-        for key, value in test_row.items():
-            if isinstance(value, string_types):
-                test_row[key] = value.lower().strip()
-            if test_row[key] in EMPTY_VALUES:
-                test_row[key] = None
+        test_row = self.plan(row, keys)
 
-        logger.debug(f'ROW: {test_row}')
+        if self.profile is not None:
+            return self._match_profiled(test_row, start)
 
-        for i, rule in enumerate(self.rules):
-            logger.debug('testing against rule #{0}'.format(i))
-            result = rule.test(test_row)
-            if result:
-                logger.info('PASSED rule #{0}\n-----------------------------------'.format(i))
-                return result
+        if self.memo is not None and not start:
+            return self.memo(test_row, self._match)
+
+        return self._match(test_row, start)
 
-            logger.info('FAILED rule #{0}\n-----------------------------------'.format(i))
+    def _match(self, test_row, start=0):
+        """Return the index of the first rule that matches a normalized row."""
+
+        if self.index is not None:
+            try:
+                return self.index.match(test_row, start)
+            except Unindexable:
+                # values the index can't handle are tested rule by rule
+                pass
+
+        rules = self.rules
+        for i in range(start, len(rules)):
+            if rules[i].predicate(test_row):
+                return i
 
-        # No matches
-        logger.debug('FAILED ALL RULES')
         return None
 
+    def _match_profiled(self, test_row, start=0):
+        """Same as match() for a normalized row, but tests each rule in turn
+        (without the index) and records the outcome in self.profile."""
+
+        profile = self.profile
+        for i in range(start, len(self.rules)):
+            rule = self.rules[i]
+            start_time = time.perf_counter()
+            passed = rule.predicate(test_row)
+            elapsed = time.perf_counter() - start_time
+
+            if passed:
+                profile.add(i, None, elapsed)
+                return i
+
+            profile.add(i, rule.first_failure(test_row), elapsed)
+
+        return None
+
+    def explain(self, row):
+        """Return (index, steps) where index is the first rule that matches row
+        (or None) and steps lists (rule index, outcomes) for each rule tested, in
+        order.  outcomes are (column, criterion, normalized value, passed) for
+        every criterion of the rule (see Rule.explain).
+
+        This is much slower than match() and is intended for tracing a few rows.
+        """
+
+        test_row = self.plan(row)
+        steps = []
+        for i, rule in enumerate(self.rules):
+            outcomes = rule.explain(test_row)
+            steps.append((i, outcomes))
+            if all(passed for _, _, _, passed in outcomes):
+                return i, steps
+
+        return None, steps
+
+
+class MatchMemo(object):
+    """Least recently used cache of the rule matched by each combination of
+    normalized criteria values, holding at most maxsize combinations.
+
+    Numeric criteria only change outcome at the values they compare against,
+    so numbers are replaced in the key by the region of the number line they
+    fall in (see echoclean.bitset.ColumnIndex); e.g., all rows with the same
+    text values and numbers between the same breakpoints share an entry.
+
+    If values rarely repeat, the memo turns itself off (self.active is False)
+    and rules are always tested.
+    """
+
+    def __init__(self, ruleset, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.active = True
+        self._matches = {}
+
+        positions = ruleset.plan.positions
+        self._text_cols = [positions[key] for key in ruleset.plan.text_cols]
+        self._numeric_cols = []
+        for key in ruleset.plan.numeric_cols:
+            points = set()
+            for rule in ruleset.rules:
+                criterion = rule.criteria.get(key)
+                if criterion is not None and criterion.is_number:
+                    points.update(criterion.values)
+            self._numeric_cols.append((positions[key], sorted(points)))
+
+    def key(self, test_row):
+        key = [test_row[col] for col in self._text_cols]
+        for col, points in self._numeric_cols:
+            value = test_row[col]
+            # blank, invalid numbers, and NaN are used as is
+            if value.__class__ is float and value == value:
+                i = bisect_left(points, value)
+                if i < len(points) and points[i] == value:
+                    value = 2 * i + 1
+                else:
+                    value = 2 * i
+            key.append(value)
+        return tuple(key)
+
+    def __call__(self, test_row, match):
+        """Return the rule matched by normalized test_row, calling match to
+        find it if equivalent values have not been seen recently."""
+
+        if not self.active:
+            return match(test_row)
+
+        key = self.key(test_row)
+        matches = self._matches
+        try:
+            # removed and added back below to mark as most recently used
+            index = matches.pop(key)
+            self.hits += 1
+
+        except KeyError:
+            index = match(test_row)
+            self.misses += 1
+            if len(matches) >= self.maxsize:
+                del matches[next(iter(matches))]
+
+            lookups = self.hits + self.misses
+            if lookups >= MEMO_WARMUP and self.hits < lookups * MEMO_MIN_HIT_RATE:
+                self.active = False
+                self._matches = {}
+                return index
+
+        matches[key] = index
+        return index
+
 
 class Rule(object):
-    def __init__(self, rule, result_cols):
+    __slots__ = ('fingerprint', '_result', 'criteria', 'order', 'positions', '_numeric_cols',
+                 'source', 'predicate')
+
+    def __init__(self, rule, result_cols, criteria=None):
+        """Create a rule from a dict of column to criterion or result value.
+
+        If criteria is provided, it is a dict used to share Criterion instances
+        between rules that have the same criterion values.
+        """
+
+        # identifies the criteria and results of the rule across runs
+        self.fingerprint = hashlib.sha1(repr(sorted(
+            (k, str(v).strip()) for k, v in rule.items())).encode('utf-8')).hexdigest()
+
         self._result = []
         for col in result_cols:
             value = rule.pop(col)
-            if isinstance(value, string_types):
+            if isinstance(value, str):
                 value = value.strip()
             self._result.append(value)
 
         # TODO: try / except block
-        self.criteria = {k: Criterion(v) for k, v in rule.items()}
+        if criteria is None:
+            criteria = {}
+        self.criteria = {}
+        for k, v in rule.items():
+            # keyed on type as well, since e.g. True == 1 but they are different criteria
+            key = (type(v), v)
+            if key not in criteria:
+                criteria[key] = Criterion(v)
+            self.criteria[k] = criteria[key]
+
+        # columns in the order their criteria are tested by the compiled predicate
+        self.order = list(self.criteria)
+
+        # key of each column in normalized rows; by default these are dicts
+        self.positions = {key: key for key in self.criteria}
 
     def __repr__(self):
         return '\n'.join(['{0}: {1}'.format(k, v) for k,v in self.criteria.items()])
 
+    def compile(self, numeric_cols=(), order=None, positions=None):
+        """Compile criteria into a single predicate function, self.predicate,
+        that takes a row normalized by NormalizationPlan and returns True if all
+        criteria pass.
+
+        numeric_cols are the columns that are already converted to float.  If
+        order is provided, criteria are tested in that order of their columns
+        (see Ruleset.optimize).  If positions are provided, they are the index of
+        each column in normalized rows (see NormalizationPlan.positions).
+        Otherwise the previous order and positions are kept.
+        """
+
+        if order is not None:
+            self.order = list(order)
+        if positions is not None:
+            self.positions = {key: positions[key] for key in self.criteria}
+
+        namespace = {}
+        lines = ['def predicate(row):']
+        for i, key in enumerate(self.order):
+            expression = self.criteria[key].expression('value', 'values{0}'.format(i),
+                                                       key in numeric_cols, namespace)
+            if expression is None:  # any value passes
+                continue
+
+            lines.append('    value = row[{0!r}]'.format(self.positions[key]))
+            lines.append('    if not ({0}):'.format(expression))
+            lines.append('        return False')
+        lines.append('    return True')
+
+        self.source = '\n'.join(lines)
+        exec(compile(self.source, '<rule>', 'exec'), namespace)
+        self.predicate = namespace['predicate']
+        self._numeric_cols = tuple(numeric_cols)
+
+    def cost(self, key):
+        """Return relative cost of testing the criterion for key in the
+        compiled predicate."""
+
+        criterion = self.criteria[key]
+        if criterion.is_number and key not in self._numeric_cols:
+            return 4  # value is converted to float on every test
+        if criterion.allows_blank or (criterion.is_number and len(criterion.values) == 2):
+            return 2
+        return 1
+
+    def __getstate__(self):
+        # compiled predicate cannot be pickled; it is recompiled on unpickling
+        return {key: getattr(self, key) for key in self.__slots__
+                if key not in ('predicate', 'source') and hasattr(self, key)}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+        if '_numeric_cols' in state:
+            self.compile(self._numeric_cols)
+
     def test(self, row):
-        for key, criterion in self.criteria.items():
-            value = row[key]
-            passed = criterion.test(row[key])
-            is_blank = value in EMPTY_VALUES
+        """Return a copy of the result values if row passes all criteria,
+        otherwise None."""
+        if self.passes(row):
+            return self.result
+        return None
 
-            if passed:
-                logger.debug('({0}: {1}) with {2} ==> PASSED'.format(
-                    key, criterion, 'blank' if is_blank else value))
-            else:
-                logger.info('({0}: {1}) with {2} ==> FAILED'.format(
-                    key, criterion, 'blank' if is_blank else value))
-                return None
+    def first_failure(self, row):
+        """Return the column of the first criterion that row fails, or None
+        if it passes all criteria.  Criteria are tested in the same order as
+        the compiled predicate."""
 
-        # If it didn't fail, it must have passed
+        positions = self.positions
+        for key in self.order:
+            if not self.criteria[key].test(row[positions[key]]):
+                return key
+        return None
+
+    def passes(self, row):
+        positions = self.positions
+        return all(criterion.test(row[positions[key]]) for key, criterion in self.criteria.items())
+
+    def explain(self, row):
+        """Return (column, criterion, value, passed) for every criterion, in the
+        order they are tested by the compiled predicate.  A value that cannot be
+        compared against a numeric criterion fails it."""
+
+        outcomes = []
+        for key in self.order:
+            criterion = self.criteria[key]
+            value = row[self.positions[key]]
+            try:
+                passed = criterion.test(value)
+            except ValueError:  # invalid number
+                passed = False
+            outcomes.append((key, criterion, value, passed))
+        return outcomes
+
+    @property
+    def result(self):
         return list(self._result)  # return a copy
 
 
 class Criterion(object):
+    __slots__ = ('is_blank', 'allows_blank', 'is_any', 'is_number', 'values', 'comparator')
+
     def __init__(self, criterion):
         # Mutually exclusive options
         self.is_blank = False
@@ -151,6 +686,51 @@ class Criterion(object):
                 ' (allows blank)' if self.allows_blank else ''
             )
 
+    def expression(self, var, name, numeric, namespace):
+        """Return a Python expression that tests the normalized value in var
+        against this criterion, or None if any value passes.
+
+        If numeric is True, var is already a float (or None if blank).  Any
+        values needed by the expression are added to namespace under name.
+        """
+
+        if self.is_any:
+            return None
+
+        if self.is_blank:
+            return '{0} is None'.format(var)
+
+        if self.is_number:
+            number = var if numeric else 'float({0})'.format(var)
+            literals = []
+            for i, value in enumerate(self.values):
+                if math.isfinite(value):
+                    literals.append(repr(value))
+                else:
+                    literals.append('{0}_{1}'.format(name, i))
+                    namespace[literals[-1]] = value
+
+            if len(self.values) == 1:
+                comparator = self.comparator or '=='
+                if comparator != '==' and comparator not in COMPARATORS:
+                    raise ValueError('Invalid comparison: {0}'.format(comparator))
+                return '{0} is not None and {1} {2} {3}'.format(
+                    var, number, comparator, literals[0])
+
+            return '{0} is not None and {1} <= {2} <= {3}'.format(
+                var, literals[0], number, literals[1])
+
+        namespace[name] = frozenset(self.values)
+        if self.comparator == 'not':
+            expression = '{0} not in {1}'.format(var, name)
+        else:
+            expression = '{0} in {1}'.format(var, name)
+
+        if self.allows_blank:
+            expression = '{0} is None or {1}'.format(var, expression)
+
+        return expression
+
     def test(self, value):
         value_is_blank = value in EMPTY_VALUES
         if self.is_blank:
@@ -167,12 +747,13 @@ class Criterion(object):
                 return False
 
             num_values = len(self.values)
-            value = float(value)
+            if not isinstance(value, float):
+                value = float(value)
             if num_values == 1:
                 if self.comparator is None:
                     return value == self.values[0]
                 else:
-                    return eval('{0} {1} {2}'.format(value, self.comparator, self.values[0]))
+                    return COMPARATORS[self.comparator](value, self.values[0])
             else:
                 return value >= self.values[0] and value <= self.values[1]
 
@@ -185,5 +766,4 @@ class Criterion(object):
 
             if value_is_blank:
                 value = 'blank'
-            logger.debug('value is {0} testing {1}'.format(value, self.values))
             return value in self.values
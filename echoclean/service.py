@@ -0,0 +1,314 @@
+"""Long-running classification service (echoclean serve).
+
+A local HTTP server accepts classification jobs (a rules file and a data file)
+and runs them on a pool of worker processes.  Each worker keeps the rules it
+has read, and the rulesets compiled from them, in memory keyed by the path and
+modification time of the rules file, so later jobs with the same rules neither
+read nor compile them again, and no job pays for starting Python.
+
+Requests and responses are JSON:
+
+    POST /jobs       {"rules": <path>, "data": <path>, "output": <path>,
+                      "format": "xlsx", "engine": "linear", "wait": false}
+    GET  /jobs/<id>  status and results of a job
+    GET  /jobs       recent jobs
+    GET  /stats      throughput and queue depth
+
+Only rules and data are required in a job; other values default to those of
+echoclean apply.  Relative paths are relative to the directory the server was
+started in.  If wait is true, the response is sent when the job finishes.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from echoclean.cache import RulesCache
+from echoclean.night import FORMATS as FILENAME_FORMATS
+from echoclean.writers import FORMATS, output_filename
+
+
+logger = logging.getLogger('echoclean')
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+
+# Maximum number of jobs waiting for a worker; more are rejected
+QUEUE_SIZE = 100
+
+# Number of finished jobs whose status is kept
+JOB_HISTORY = 1000
+
+ENGINES = ('linear', 'indexed', 'vectorized')
+
+# Number of rules files whose rules each worker keeps in memory
+WORKER_RULES = 20
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobError(Exception):
+    pass
+
+
+# Rules read by this worker process, least recently used first:
+# path -> ((mtime, size), ParsedRules)
+_worker_rules = OrderedDict()
+
+
+def _run_job(rules, data, output, format, engine, filename_format, night_cutoff, use_cache):
+    """Classify data using rules in a worker process.  Returns dict of results."""
+
+    from echoclean.cli import _classify_file, _read_rules
+
+    start = time.perf_counter()
+
+    try:
+        stat = os.stat(rules)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = _worker_rules.get(rules)
+        rules_cached = cached is not None and cached[0] == version
+        if rules_cached:
+            parsed = cached[1]
+            _worker_rules.move_to_end(rules)
+        else:
+            parsed = _read_rules(rules, cache=RulesCache() if use_cache else None, prompt=False)
+            _worker_rules.pop(rules, None)
+            while len(_worker_rules) >= WORKER_RULES:
+                _worker_rules.popitem(last=False)
+            _worker_rules[rules] = (version, parsed)
+
+        summary = _classify_file(parsed, data, output, format, engine, filename_format,
+                                 night_cutoff)
+    except Exception as e:
+        # not all exceptions can be sent back from the worker
+        logger.exception('Error classifying {0}'.format(data))
+        raise JobError(str(e))
+
+    return {
+        'rows': summary.total,
+        'classified': summary.classified[True],
+        'seconds': round(time.perf_counter() - start, 4),
+        'rules_cached': rules_cached,
+    }
+
+
+class ClassifyService(object):
+    """Run classification jobs on jobs worker processes.  At most queue_size
+    jobs wait for a worker; submit() raises QueueFull beyond that."""
+
+    def __init__(self, jobs=1, queue_size=QUEUE_SIZE, use_cache=True):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.use_cache = use_cache
+        self._executor = ProcessPoolExecutor(jobs)
+        self._lock = threading.Lock()
+        self._records = OrderedDict()  # job id -> status and results
+        self._futures = {}  # job id -> Future, while not finished
+        self._events = {}  # job id -> Event set once results are recorded
+        self._next_id = 1
+
+        self.started = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.rows = 0
+        self.busy_seconds = 0
+
+    def submit(self, rules, data, output=None, format=None, engine='linear',
+               filename_format=None, night_cutoff=12):
+        """Queue a job and return its id.  Raises ValueError if the job is
+        invalid, or QueueFull if too many jobs are waiting."""
+
+        for name, filename in (('rules', rules), ('data', data)):
+            if not filename or not os.path.isfile(filename):
+                raise ValueError('{0} file not found: {1}'.format(name, filename))
+        if engine not in ENGINES:
+            raise ValueError('engine must be one of: {0}'.format(', '.join(ENGINES)))
+        if format is not None and format not in FORMATS:
+            raise ValueError('format must be one of: {0}'.format(', '.join(sorted(FORMATS))))
+        if filename_format is not None and filename_format not in FILENAME_FORMATS:
+            raise ValueError('filename_format must be one of: {0}'.format(
+                ', '.join(sorted(FILENAME_FORMATS))))
+        if (not isinstance(night_cutoff, int) or isinstance(night_cutoff, bool) or
+                not 0 <= night_cutoff <= 23):
+            raise ValueError('night_cutoff must be an hour from 0 to 23')
+
+        output, format = output_filename(output, data, format)
+        rules, data, output = (os.path.abspath(path) for path in (rules, data, output))
+
+        with self._lock:
+            if len(self._futures) >= self.jobs + self.queue_size:
+                self.rejected += 1
+                raise QueueFull('{0} jobs are already waiting'.format(self.queue_size))
+
+            job_id = self._next_id
+            self._next_id += 1
+            self.submitted += 1
+            record = self._records[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'rules': rules,
+                'data': data,
+                'output': output,
+                'submitted': time.time(),
+            }
+
+            self._events[job_id] = threading.Event()
+            future = self._futures[job_id] = self._executor.submit(
+                _run_job, rules, data, output, format, engine,
+                filename_format, night_cutoff, self.use_cache)
+
+        future.add_done_callback(partial(self._finished, record))
+        return job_id
+
+    def _finished(self, record, future):
+        with self._lock:
+            self._futures.pop(record['id'], None)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error('Job {0} failed: {1}'.format(record['id'], e))
+                record.update(status='failed', error=str(e))
+                self.failed += 1
+            else:
+                record.update(result, status='done')
+                self.completed += 1
+                self.rows += result['rows']
+                self.busy_seconds += result['seconds']
+
+            self._events.pop(record['id']).set()
+
+            # forget the oldest finished jobs
+            while len(self._records) > JOB_HISTORY:
+                oldest = next(iter(self._records))
+                if oldest in self._futures:
+                    break
+                del self._records[oldest]
+
+    def get(self, job_id):
+        """Return status and results of a job, or None if not known."""
+
+        with self._lock:
+            record = self._records.get(job_id)
+            if record is None:
+                return None
+            record = dict(record)
+            future = self._futures.get(job_id)
+
+        if future is not None and future.running():
+            record['status'] = 'running'
+        return record
+
+    def wait(self, job_id, timeout=None):
+        """Wait for a job to finish and return its status and results."""
+
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.get(job_id)
+
+    def recent(self):
+        with self._lock:
+            job_ids = list(self._records)
+        return [self.get(job_id) for job_id in job_ids]
+
+    def stats(self):
+        with self._lock:
+            futures = list(self._futures.values())
+            stats = {
+                'uptime': round(time.time() - self.started, 1),
+                'workers': self.jobs,
+                'queue_size': self.queue_size,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'rows': self.rows,
+                'rows_per_sec': round(self.rows / self.busy_seconds, 1) if self.busy_seconds else None,
+            }
+
+        running = sum(1 for future in futures if future.running())
+        stats['running'] = running
+        stats['queue_depth'] = len(futures) - running
+        return stats
+
+    def close(self):
+        """Wait for queued jobs to finish, and stop the workers."""
+        self._executor.shutdown(wait=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'echoclean'
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.rstrip('/')
+
+        if path == '/stats':
+            return self._send(200, service.stats())
+
+        if path == '/jobs':
+            return self._send(200, {'jobs': service.recent()})
+
+        if path.startswith('/jobs/'):
+            try:
+                record = service.get(int(path[len('/jobs/'):]))
+            except ValueError:
+                record = None
+            if record is not None:
+                return self._send(200, record)
+
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'not found'})
+
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(job, dict):
+                raise ValueError('job must be a JSON object')
+            wait = job.pop('wait', False)
+            job_id = service.submit(**job)
+        except QueueFull as e:
+            return self._send(503, {'error': str(e)})
+        except (TypeError, ValueError) as e:
+            return self._send(400, {'error': str(e)})
+
+        if wait:
+            return self._send(200, service.wait(job_id))
+        self._send(202, service.get(job_id))
+
+    def log_message(self, format, *args):
+        logger.info('{0} {1}'.format(self.address_string(), format % args))
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Return HTTP server for service; call serve_forever() to run it."""
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
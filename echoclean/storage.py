@@ -0,0 +1,54 @@
+"""Saving objects to pickle files that other processes (or a later run) read,
+such as cached rules, the state of a previous run, and checkpoints."""
+
+import os
+import pickle
+import logging
+import tempfile
+
+
+logger = logging.getLogger('echoclean')
+
+
+def save_pickle(value, filename, version=None):
+    """Pickle value to filename.  value is written to a temporary file in the
+    same directory first, which then replaces filename, so that readers never
+    see a partially written file.  If version is provided, (version, value) is
+    saved, to be checked by load_pickle."""
+
+    if version is not None:
+        value = (version, value)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_pickle(filename, version=None, description='data'):
+    """Return value saved in filename by save_pickle, or None if not found,
+    unreadable (logged as a warning about description, e.g., 'checkpoint'), or
+    saved with a version other than version."""
+
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        with open(filename, 'rb') as f:
+            value = pickle.load(f)
+        if version is None:
+            return value
+
+        saved_version, value = value
+        if saved_version == version:
+            return value
+
+    except Exception as e:
+        logger.warning('Could not read {0} from {1}: {2}'.format(description, filename, e))
+
+    return None
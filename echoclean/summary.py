@@ -0,0 +1,108 @@
+from collections import Counter
+
+from echoclean.profiling import RuleProfile
+
+
+class Summary(object):
+    """Counts of classified rows, overall, by night, and by each result value."""
+
+    def __init__(self, result_cols):
+        self.result_cols = list(result_cols)
+        self.counts = {k: dict() for k in self.result_cols}
+        self.nights = {}
+        self.classified = Counter()
+        self.profile = None  # RuleProfile, if rules were profiled
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.seconds = Counter()  # time spent in each phase of classifying rows
+
+    def add(self, result, night=None):
+        """Add the result of classifying a row (None if no rules matched), and
+        the night on which the pass was recorded, if known."""
+
+        if result:
+            for index, key in enumerate(self.result_cols):
+                value = result[index]
+                if value not in self.counts[key]:
+                    self.counts[key][value] = 0
+                self.counts[key][value] += 1
+
+        self.classified.update([bool(result)])
+
+        if night:
+            if night not in self.nights:
+                self.nights[night] = Counter()
+            self.nights[night].update([bool(result)])
+
+    def add_many(self, results, nights=None):
+        """Add the results of classifying many rows (e.g., from
+        Ruleset.test_many), and the night of each, if known."""
+
+        if nights is None:
+            for result in results:
+                self.add(result)
+        else:
+            for result, night in zip(results, nights):
+                self.add(result, night)
+
+    def merge(self, other):
+        """Add the counts from another Summary, e.g., of a later chunk of rows."""
+
+        for key in self.result_cols:
+            counts = self.counts[key]
+            for value, count in other.counts[key].items():
+                counts[value] = counts.get(value, 0) + count
+
+        self.classified.update(other.classified)
+
+        for night, counts in other.nights.items():
+            if night not in self.nights:
+                self.nights[night] = Counter()
+            self.nights[night].update(counts)
+
+        self.memo_hits += other.memo_hits
+        self.memo_misses += other.memo_misses
+        self.seconds.update(other.seconds)
+
+        if other.profile is not None:
+            if self.profile is None:
+                self.profile = RuleProfile(len(other.profile.tested))
+            self.profile.merge(other.profile)
+
+    @property
+    def total(self):
+        return sum(self.classified.values())
+
+    def tables(self):
+        """Generate summary tables as (title, header, rows)."""
+
+        # Report overall hits and misses
+        rows = [['Yes' if result else 'No', self.classified[result]] for result in (True, False)]
+        rows.append(['Total', self.total])
+        yield 'Classification Summary', ['Classified', 'Count'], rows
+
+        if len(self.nights):
+            # Report hits and misses for each night
+            rows = []
+            for night in sorted(self.nights.keys()):
+                counts = self.nights[night]
+                rows.append([night] + [counts[value] for value in (True, False)] + [
+                    sum(counts.values())])
+
+            yield ('Night Classification Summary',
+                   ['Night', 'Rows Classified', 'Rows Not Classified', 'Total Rows'],
+                   rows)
+
+        # Create a summary for all values in classified output
+        for key in self.result_cols:
+            counts = self.counts[key]
+            if len(counts.keys()) > 1:
+                values = [x for x in counts.keys() if x]
+                if len(set(type(x) for x in values)) == 1:
+                    # cannot sort if values is mixed types
+                    values.sort()
+                if None in counts.keys():
+                    values = [None] + values
+
+                rows = [[value, counts[value]] for value in values]
+                yield '{0} Summary'.format(key), ['Value', 'Rows Classified'], rows
@@ -0,0 +1,123 @@
+"""Rule-by-rule explanations of how selected rows were classified.
+
+Rows are selected by row number, by matching their filename against a pattern,
+and / or at random, and each is explained to a separate trace file.  Rows that
+are not selected are not traced at all, so tracing costs nothing unless it is
+requested.
+"""
+
+import os
+import random
+from fnmatch import fnmatch
+
+
+class RowSelector(object):
+    """Selects rows of a data file to explain.
+
+    rows are row numbers (1 is the first row after the header).  pattern is a
+    case-insensitive wildcard pattern (e.g., '*_2219*') matched against the
+    value of filename_col.  sample is the fraction of rows selected at random;
+    the same seed selects the same rows.  A row is selected if it meets any of
+    these.
+    """
+
+    def __init__(self, rows=(), pattern=None, filename_col=None, sample=0, seed=0):
+        if pattern is not None and filename_col is None:
+            raise ValueError('A filename column is required to select rows by filename')
+
+        self.rows = set(rows)
+        self.pattern = pattern.lower() if pattern is not None else None
+        self.filename_col = filename_col
+        self.sample = sample
+        self._random = random.Random(seed)
+
+    def select(self, offset, values, fieldnames):
+        """Return the indexes of the selected rows of a chunk of rows (lists of
+        values in the order of fieldnames) that starts at row offset + 1."""
+
+        selected = set(i - offset - 1 for i in self.rows if offset < i <= offset + len(values))
+
+        if self.pattern is not None:
+            column = fieldnames.index(self.filename_col)
+            for i, row in enumerate(values):
+                if fnmatch(str(row[column]).lower(), self.pattern):
+                    selected.add(i)
+
+        if self.sample:
+            rand = self._random.random
+            sample = self.sample
+            # drawn for every row so that the sample does not depend on other options
+            selected.update(i for i in range(len(values)) if rand() < sample)
+
+        return sorted(selected)
+
+
+def _format_value(value):
+    return 'blank' if value is None else repr(value)
+
+
+class Tracer(object):
+    """Write explanations of the rows selected by selector to a trace file.
+
+    If resume_at is provided, it is a position returned by checkpoint() during
+    an earlier run; the existing trace file is truncated to that position and
+    explanations are written after it.
+    """
+
+    def __init__(self, filename, ruleset, fieldnames, selector, resume_at=None):
+        self.filename = filename
+        self.ruleset = ruleset
+        self.fieldnames = list(fieldnames)
+        self.selector = selector
+        self.count = 0
+        if resume_at is None or not os.path.exists(filename):
+            self._file = open(filename, 'w')
+        else:
+            self._file = open(filename, 'r+')
+            self._file.seek(resume_at)
+            self._file.truncate()
+
+    def trace(self, offset, values):
+        """Explain selected rows of a chunk of rows that starts at row
+        offset + 1."""
+
+        for i in self.selector.select(offset, values, self.fieldnames):
+            self.explain(offset + i + 1, dict(zip(self.fieldnames, values[i])))
+
+    def explain(self, number, row):
+        index, steps = self.ruleset.explain(row)
+
+        lines = ['Row {0}'.format(number)]
+        if self.selector.filename_col is not None:
+            lines[0] += ' ({0}: {1})'.format(self.selector.filename_col,
+                                              row[self.selector.filename_col])
+
+        for i, outcomes in steps:
+            lines.append('  Rule {0}: {1}'.format(i + 1, 'PASSED' if i == index else 'FAILED'))
+            for key, criterion, value, passed in outcomes:
+                if criterion.is_any:
+                    continue
+                lines.append('    {0}: {1} with {2} ==> {3}'.format(
+                    key, criterion, _format_value(value), 'PASSED' if passed else 'FAILED'))
+
+        if index is None:
+            lines.append('  No rules matched')
+        else:
+            result = self.ruleset.rules[index].result
+            lines.append('  Result: {0}'.format(', '.join(
+                '{0}={1}'.format(col, '' if value is None else value)
+                for col, value in zip(self.ruleset.result_cols, result))))
+
+        self._file.write('\n'.join(lines) + '\n\n')
+        self.count += 1
+
+    def checkpoint(self):
+        """Write explanations to disk, and return the position in the file
+        after them."""
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
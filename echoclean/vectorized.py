@@ -0,0 +1,177 @@
+"""Columnar classification of many rows at once using numpy.
+
+Each criteria column is loaded into arrays once, each criterion is evaluated as
+a boolean mask over those arrays, and the first matching rule for each row is
+resolved by testing rules in order against only the rows that are still
+unclassified.
+"""
+
+import numpy as np
+
+from echoclean.ruleset import COMPARATORS, normalize
+
+
+class Column(object):
+    """Normalized values of a single column.
+
+    Values are factorized into unique values (`uniques`) and an integer code
+    per row (`codes`) so that set criteria are evaluated once per unique value.
+    Numeric values are available as a float array with NaN for values that are
+    blank or cannot be parsed as a number.
+    """
+
+    def __init__(self, values):
+        lookup = {}
+        uniques = []
+        codes = np.empty(len(values), dtype=np.intp)
+        for i, value in enumerate(values):
+            value = normalize(value)
+            try:
+                code = lookup[value]
+            except KeyError:
+                code = lookup[value] = len(uniques)
+                uniques.append(value)
+            codes[i] = code
+
+        self.uniques = uniques
+        self.codes = codes
+        self._numbers = None
+
+    def _parse_numbers(self):
+        numbers = np.empty(len(self.uniques), dtype=np.float64)
+        invalid = np.zeros(len(self.uniques), dtype=bool)
+        for i, value in enumerate(self.uniques):
+            if value is None:
+                numbers[i] = np.nan
+                continue
+            try:
+                numbers[i] = float(value)
+            except (TypeError, ValueError):
+                numbers[i] = np.nan
+                invalid[i] = True
+
+        self._numbers = (numbers, invalid)
+
+    def numbers(self, rows):
+        """Return float values for rows, or raise ValueError if any non-blank
+        value cannot be parsed as a number."""
+
+        if self._numbers is None:
+            self._parse_numbers()
+
+        numbers, invalid = self._numbers
+        codes = self.codes[rows]
+        if invalid.any():
+            bad = invalid[codes]
+            if bad.any():
+                value = self.uniques[codes[bad.argmax()]]
+                raise ValueError('could not convert string to float: {0!r}'.format(value))
+
+        return numbers[codes]
+
+    def lookup(self, rows, func):
+        """Evaluate func once per unique value, and return mask for rows."""
+        table = np.fromiter((func(value) for value in self.uniques), dtype=bool,
+                            count=len(self.uniques))
+        return table[self.codes[rows]]
+
+
+def criterion_mask(criterion, column, rows):
+    """Return boolean mask of rows in column that satisfy criterion."""
+
+    if criterion.is_any:
+        return np.ones(len(rows), dtype=bool)
+
+    if criterion.is_number:
+        values = column.numbers(rows)
+        # NaN (blank) values fail all comparisons
+        if len(criterion.values) == 1:
+            if criterion.comparator is None:
+                return values == criterion.values[0]
+            return COMPARATORS[criterion.comparator](values, criterion.values[0])
+
+        return (values >= criterion.values[0]) & (values <= criterion.values[1])
+
+    # blank, set membership, and 'not' criteria only depend on the unique values
+    return column.lookup(rows, criterion.test)
+
+
+def classify_columns(ruleset, columns, num_rows=None):
+    """Return array of the index of the first rule in ruleset that matches each
+    row, or -1 if no rules match.
+
+    columns is a dict of column name to a sequence of values for that column.
+    """
+
+    if num_rows is None:
+        num_rows = len(next(iter(columns.values()))) if columns else 0
+
+    columns = {key: Column(values) for key, values in columns.items()}
+
+    indexes = np.full(num_rows, -1, dtype=np.intp)
+    unclassified = np.ones(num_rows, dtype=bool)
+    remaining = np.arange(num_rows)
+
+    for i, rule in enumerate(ruleset.rules):
+        if not len(remaining):
+            break
+
+        candidates = remaining
+        for key, criterion in rule.criteria.items():
+            candidates = candidates[criterion_mask(criterion, columns[key], candidates)]
+            if not len(candidates):
+                break
+
+        if len(candidates):
+            indexes[candidates] = i
+            unclassified[candidates] = False
+            remaining = remaining[unclassified[remaining]]
+
+    return indexes
+
+
+def result_columns(ruleset, indexes):
+    """Return dict of result column name to array of result values for each
+    row, None where no rule matched."""
+
+    results = {}
+    for col_idx, key in enumerate(ruleset.result_cols):
+        # last entry is used for rows that do not match (index -1)
+        values = np.empty(len(ruleset.rules) + 1, dtype=object)
+        values[:-1] = [rule._result[col_idx] for rule in ruleset.rules]
+        values[-1] = None
+        results[key] = values[indexes]
+
+    return results
+
+
+def classify_rows(ruleset, rows, chunk_size=100000):
+    """Classify an iterable of row dicts in chunks.
+
+    Yields (row, result) for each row, where result is the same as returned by
+    Ruleset.test().
+    """
+
+    keys = ruleset.criteria_cols
+
+    rows = iter(rows)
+    while True:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                break
+
+        if not chunk:
+            return
+
+        columns = {key: [row[key] for row in chunk] for key in keys}
+        indexes = classify_columns(ruleset, columns, num_rows=len(chunk))
+        for row, index in zip(chunk, indexes):
+            if index < 0:
+                yield row, None
+            else:
+                yield row, ruleset.rules[index].result or None
+
+        if len(chunk) < chunk_size:
+            return
@@ -0,0 +1,311 @@
+"""Output backends for classification results.
+
+Each writer receives the header and rows of the classification results as they
+are classified, followed by any number of summary tables.
+"""
+
+import os
+import re
+import csv
+import time
+
+
+FORMATS = {
+    'xlsx': '.xlsx',
+    'csv': '.csv',
+    'tsv': '.tsv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'sqlite': '.sqlite',
+}
+
+# Output extensions that imply a format
+EXTENSIONS = {
+    '.xlsx': 'xlsx',
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.txt': 'tsv',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.sqlite': 'sqlite',
+    '.db': 'sqlite',
+}
+
+# Formats written using pyarrow, which is optional
+ARROW_FORMATS = ('parquet', 'arrow')
+
+# Formats that can be written in segments and resumed (see DelimitedWriter)
+RESUMABLE_FORMATS = ('csv', 'tsv')
+
+# Column added to SQLite output with the number of the rule matched by each row
+RULE_COLUMN = 'matched_rule'
+
+# Number of rows inserted into SQLite output per transaction
+SQLITE_BATCH_SIZE = 10000
+
+# Night columns, whose MM/DD/YYYY dates are stored as YYYY-MM-DD in SQLite
+# output so that they sort and compare in order of date
+NIGHT_COLUMNS = ('night', )
+
+NIGHT_RE = re.compile(r'^(\d\d)/(\d\d)/(\d{4})$')
+
+
+def _table_name(title):
+    return re.sub('[^a-z0-9]+', '_', title.lower()).strip('_')
+
+
+def table_filename(filename, title):
+    """Return filename of the sidecar file for a summary table, named after
+    the output filename and title."""
+
+    base, ext = os.path.splitext(filename)
+    return '{0}_{1}{2}'.format(base, _table_name(title), ext)
+
+
+class XLSXWriter(object):
+    """Write results to the first sheet of an XLSX workbook, and each summary
+    table to an additional sheet."""
+
+    def __init__(self, filename, title='Classify Results'):
+        from openpyxl import Workbook  # slow to import, so only imported if used
+
+        self.filename = filename
+        self._workbook = Workbook(write_only=True)
+        self._worksheet = self._workbook.create_sheet(title=title)
+
+    def write_header(self, columns):
+        self._worksheet.append(columns)
+
+    def write_row(self, row):
+        self._worksheet.append(row)
+
+    def write_table(self, title, header, rows):
+        worksheet = self._workbook.create_sheet(title=title)
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+
+    def close(self):
+        self._workbook.save(filename=self.filename)
+
+
+class DelimitedWriter(object):
+    """Write results to a CSV or tab-delimited file as they are classified,
+    and each summary table to a sidecar file named after the table, e.g.,
+    <output>_classification_summary.csv.
+
+    If resume_at is provided, it is a position returned by checkpoint() during
+    an earlier run; the existing file is truncated to that position and rows
+    are written after it.
+    """
+
+    def __init__(self, filename, delimiter=',', resume_at=None):
+        self.filename = filename
+        self.delimiter = delimiter
+        if resume_at is None:
+            self._file = open(filename, 'w', newline='', encoding='utf-8')
+        else:
+            self._file = open(filename, 'r+', newline='', encoding='utf-8')
+            self._file.seek(resume_at)
+            self._file.truncate()
+        self._writer = csv.writer(self._file, delimiter=delimiter)
+
+    def write_header(self, columns):
+        self._writer.writerow(columns)
+
+    def write_row(self, row):
+        self._writer.writerow(row)
+
+    def checkpoint(self):
+        """Write rows to disk, and return the position in the file after them."""
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def write_table(self, title, header, rows):
+        with open(table_filename(self.filename, title), 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out, delimiter=self.delimiter)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+def _quote(name):
+    return '"{0}"'.format(str(name).replace('"', '""'))
+
+
+def _iso_night(value):
+    """Return MM/DD/YYYY night as YYYY-MM-DD; other values are unchanged."""
+
+    match = NIGHT_RE.match(value) if isinstance(value, str) else None
+    if match is None:
+        return value
+    month, day, year = match.groups()
+    return '{0}-{1}-{2}'.format(year, month, day)
+
+
+def _night_positions(columns):
+    return [i for i, column in enumerate(columns) if str(column).lower() in NIGHT_COLUMNS]
+
+
+class SQLiteWriter(object):
+    """Insert results into a table of a SQLite database named after title
+    (e.g., classify_results), and each summary table into a table named after
+    its title, e.g., classification_summary.
+
+    Each run is added to the runs table, with the values of run_info (e.g., the
+    data and rules files), and its rows are added to any rows already in these
+    tables with its run_id, so that results of many runs can be queried
+    together.  Columns missing from existing tables are added.  Rows are
+    inserted in transactions of batch_size rows, and index_columns of the
+    results (e.g., night and result columns) are indexed once all rows have
+    been inserted.  Nights are stored as YYYY-MM-DD.
+    """
+
+    def __init__(self, filename, title='Classify Results', index_columns=None,
+                 batch_size=SQLITE_BATCH_SIZE, run_info=None):
+        import sqlite3
+
+        self.filename = filename
+        self.table = _table_name(title)
+        self.index_columns = list(index_columns or [])
+        self.batch_size = batch_size
+        self._columns = None
+        self._rows = []
+        self._insert = None
+        self._nights = []
+
+        run = [('results', self.table), ('started', time.strftime('%Y-%m-%d %H:%M:%S')),
+               ('rows', 0)] + list((run_info or {}).items())
+
+        self._db = sqlite3.connect(filename)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, '
+                             'results TEXT, started TEXT, rows INTEGER)')
+            existing = set(row[1].lower() for row in self._db.execute('PRAGMA table_info(runs)'))
+            for column, _ in run:
+                if column.lower() not in existing:
+                    self._db.execute('ALTER TABLE runs ADD COLUMN {0}'.format(_quote(column)))
+            self.run_id = self._db.execute('INSERT INTO runs ({0}) VALUES ({1})'.format(
+                ', '.join(_quote(column) for column, _ in run), ', '.join('?' * len(run))),
+                [value for _, value in run]).lastrowid
+        self.rows = 0
+
+    def _create_table(self, table, columns):
+        """Create table with columns, or add those missing from an existing
+        table.  Returns the insert statement for a row of run_id and columns."""
+
+        columns = ['run_id'] + list(columns)
+        existing = set(row[1].lower() for row in self._db.execute(
+            'PRAGMA table_info({0})'.format(_quote(table))))
+        if not existing:
+            self._db.execute('CREATE TABLE {0} ({1})'.format(
+                _quote(table), ', '.join(_quote(column) for column in columns)))
+        else:
+            for column in columns:
+                if column.lower() not in existing:
+                    self._db.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                        _quote(table), _quote(column)))
+
+        return 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            _quote(table), ', '.join(_quote(column) for column in columns),
+            ', '.join('?' * len(columns)))
+
+    def _flush(self):
+        if not self._rows:
+            return
+        with self._db:
+            self._db.executemany(self._insert, self._rows)
+        self.rows += len(self._rows)
+        self._rows = []
+
+    def write_header(self, columns):
+        self._columns = list(columns)
+        self._nights = _night_positions(self._columns)
+        with self._db:
+            self._insert = self._create_table(self.table, self._columns)
+
+    def write_row(self, row):
+        row = [self.run_id] + list(row)
+        for i in self._nights:
+            row[i + 1] = _iso_night(row[i + 1])
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def write_table(self, title, header, rows):
+        nights = _night_positions(header)
+        rows = [[self.run_id] + list(row) for row in rows]
+        for row in rows:
+            for i in nights:
+                row[i + 1] = _iso_night(row[i + 1])
+        with self._db:
+            insert = self._create_table(_table_name(title), header)
+            self._db.executemany(insert, rows)
+
+    def close(self):
+        self._flush()
+        with self._db:
+            for column in self.index_columns:
+                if column in self._columns:
+                    self._db.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format(
+                        _quote('{0}_{1}'.format(self.table, _table_name(column))),
+                        _quote(self.table), _quote(column)))
+            self._db.execute('UPDATE runs SET rows = ? WHERE run_id = ?',
+                             (self.rows, self.run_id))
+        self._db.close()
+
+
+def output_filename(output, data, format=None):
+    """Return output filename and format.
+
+    If output is not provided, it is derived from the data filename.  If format
+    is not provided, it is determined from the output extension, defaulting to
+    xlsx.
+    """
+
+    if not output:
+        output = '{0}_out{1}'.format(os.path.splitext(data)[0], FORMATS[format or 'xlsx'])
+
+    ext = os.path.splitext(output)[1].lower()
+    if format is None:
+        format = EXTENSIONS.get(ext, 'xlsx')
+
+    if EXTENSIONS.get(ext) != format:
+        output += FORMATS[format]
+
+    return output, format
+
+
+def get_writer(filename, format, title='Classify Results', resume_at=None, index_columns=None,
+               run_info=None):
+    """Return writer for format.  title is used for the name of the results
+    sheet in XLSX output or table in SQLite output, and ignored by other
+    formats.  resume_at is the position at which to resume writing an existing
+    file, and is only supported by RESUMABLE_FORMATS.  index_columns are the
+    columns indexed in SQLite output, and run_info a dict of values recorded
+    in its runs table; both are ignored by other formats."""
+
+    if resume_at is not None and format not in RESUMABLE_FORMATS:
+        raise ValueError('Cannot resume writing {0} output'.format(format))
+
+    if format == 'xlsx':
+        return XLSXWriter(filename, title=title)
+    if format == 'csv':
+        return DelimitedWriter(filename, delimiter=',', resume_at=resume_at)
+    if format == 'tsv':
+        return DelimitedWriter(filename, delimiter='\t', resume_at=resume_at)
+    if format in ARROW_FORMATS:
+        from echoclean.arrow import ArrowWriter  # pyarrow is optional
+        return ArrowWriter(filename, format=format)
+    if format == 'sqlite':
+        return SQLiteWriter(filename, title=title, index_columns=index_columns,
+                            run_info=run_info)
+
+    raise ValueError('Unsupported output format: {0}'.format(format))
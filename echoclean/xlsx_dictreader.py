@@ -1,14 +1,34 @@
 import os
+import re
 from collections import OrderedDict
+from datetime import datetime
 from openpyxl import load_workbook
 from openpyxl.utils import range_boundaries
-from six.moves import input
 
 
 class DictReader(object):
     def __init__(self, worksheet):
         self.fieldnames = []
         column_idx = []
+
+        # Worksheets from workbooks opened in read_only mode are parsed as they
+        # are read, so only the current row is held in memory
+        self.read_only = getattr(worksheet.parent, 'read_only', False)
+        self._workbook = worksheet.parent
+
+        # Rows after the header (may include trailing blank rows, or be None if
+        # the size of a read_only worksheet is not recorded in the file)
+        self.num_rows = worksheet.max_row - 1 if worksheet.max_row else None
+
+        if self.read_only:
+            for cell in next(worksheet.iter_rows(min_row=1, max_row=1)):
+                if not cell.value:  # Any blank column is beyond range of data
+                    break
+                self.fieldnames.append(cell.value)
+
+            self._iter_rows = worksheet.iter_rows(min_row=2, max_col=len(self.fieldnames))
+            return
+
         row_iter = worksheet.iter_rows()
 
         for cell in next(row_iter):
@@ -34,40 +54,140 @@ class DictReader(object):
 
     def __next__(self):
         row = next(self._iter_rows)
+        if self.read_only:
+            return dict(zip(self.fieldnames, [guess_type(r.value) for r in row]))
         return OrderedDict([(k, v) for k, v in zip(self.fieldnames, [r.value for r in row])])
 
+    def iter_values(self):
+        """Generate remaining rows as lists of values in the order of
+        fieldnames, without creating a dict for each row."""
+
+        num_fields = len(self.fieldnames)
+        for row in self._iter_rows:
+            if self.read_only:
+                values = [guess_type(r.value) for r in row]
+            else:
+                values = [r.value for r in row]
+            if len(values) < num_fields:
+                values.extend([None] * (num_fields - len(values)))
+            yield values
+
+    def close(self):
+        """Close the underlying file of a read_only workbook."""
+        self._workbook.close()
+
     @classmethod
-    def from_file(cls, filename, index=None, prompt=False):
+    def from_file(cls, filename, index=None, prompt=False, read_only=False):
         """Read sheet from filename
         If index is not specified, the active sheet will be used.
         If multiple sheets are present and prompt is true, the user will be
         prompted to enter the index.
+        If read_only is true, rows are read from the file as they are iterated
+        instead of loading the entire workbook into memory.
         """
 
-        workbook = load_workbook(filename, data_only=True, guess_types=True)
-        worksheet = workbook.active
-        if index is not None:
-            worksheet = workbook.worksheets[index]
-
-        elif prompt and len(workbook.worksheets) > 1:
-            print('\n-------------------------------------------------------------\nMultiple sheets found:')
-            valid_idx = []
-            for i, ws in enumerate(workbook.worksheets):
-                if ws.max_row:
-                    print('{0})  {1}{2}'.format(i, ws.title,
-                        ' (default)' if i == workbook._active_sheet_index else ''))
-                    valid_idx.append(i)
-            print('Choose sheet number and press ENTER or leave blank for default:')
-            index = input('\n>  ')
-            print('')
-
-            if index != '':
-                index = int(index)
-                if not index in valid_idx:
-                    raise ValueError('Invalid Sheet Number')
-
-                worksheet = workbook.worksheets[index]
+        if read_only:
+            workbook = load_workbook(filename, read_only=True, data_only=True)
+        else:
+            workbook = load_workbook(filename, data_only=True, guess_types=True)
+        if index is None:
+            index = workbook._active_sheet_index
+            if prompt and len(workbook.worksheets) > 1:
+                index = choose_sheet(list_sheets(workbook), index)
+
+        worksheet = workbook.worksheets[index]
 
         if len(workbook.worksheets) > 1:
             print('{0}: using worksheet {1}'.format(os.path.split(filename)[1], worksheet.title))
-        return cls(worksheet)
\ No newline at end of file
+
+        reader = cls(worksheet)
+        # Record sheets so that the choice of sheet can be repeated without
+        # reopening the workbook
+        reader.sheet_index = index
+        reader.sheets = list_sheets(workbook)
+        reader.num_sheets = len(workbook.worksheets)
+        reader.active_index = workbook._active_sheet_index
+        return reader
+
+
+def list_sheets(workbook):
+    """Return list of (index, title) of sheets in workbook that contain data.
+    Sheets of read_only workbooks may not record their size, and are always
+    included."""
+    return [(i, ws.title) for i, ws in enumerate(workbook.worksheets)
+            if ws.max_row or ws.max_row is None]
+
+
+# Patterns of numeric, percentage, and time strings converted by workbooks
+# opened with guess_types=True (as in openpyxl 2.5, pinned in setup.py)
+NUMBER_REGEX = re.compile(r'^-?([\d]|[\d]+\.[\d]*|\.[\d]+|[1-9][\d]+\.?[\d]*)((E|e)[-+]?[\d]+)?$')
+PERCENT_REGEX = re.compile(r'^(?P<number>\-?[0-9]*\.?[0-9]*\s?)\%$')
+TIME_REGEX = re.compile(r"""
+^(?: # HH:MM and HH:MM:SS
+(?P<hour>[0-1]{0,1}[0-9]{2}):
+(?P<minute>[0-5][0-9]):?
+(?P<second>[0-5][0-9])?$)
+|
+^(?: # MM:SS.
+([0-5][0-9]):
+([0-5][0-9])?\.
+(?P<microsecond>\d{1,6}))
+""", re.VERBOSE)
+
+ERROR_CODES = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+
+
+def guess_type(value):
+    """Convert numeric, percentage, and time strings to numbers or times.
+
+    Workbooks opened in read_only mode do not support guess_types, so this is
+    used to produce the same values as workbooks opened normally.  Formulas and
+    error codes are left as strings.
+    """
+
+    if not isinstance(value, str) or not value or value in ERROR_CODES or (
+            len(value) > 1 and value.startswith('=')):
+        return value
+
+    if NUMBER_REGEX.match(value):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    match = PERCENT_REGEX.match(value)
+    if match and match.group('number').strip(' -.'):
+        return float(match.group('number')) / 100
+
+    match = TIME_REGEX.match(value)
+    if match:
+        if match.group('microsecond') is not None:
+            return datetime.strptime(value[:12], '%M:%S.%f').time()
+        if match.group('second') is None:
+            return datetime.strptime(value, '%H:%M').time()
+        return datetime.strptime(value, '%H:%M:%S').time()
+
+    return value
+
+
+def choose_sheet(sheets, default):
+    """Prompt the user to choose from sheets, a list of (index, title).
+    Returns the chosen index or default if none was entered."""
+
+    print('\n-------------------------------------------------------------\nMultiple sheets found:')
+    valid_idx = []
+    for i, title in sheets:
+        print('{0})  {1}{2}'.format(i, title, ' (default)' if i == default else ''))
+        valid_idx.append(i)
+    print('Choose sheet number and press ENTER or leave blank for default:')
+    index = input('\n>  ')
+    print('')
+
+    if index == '':
+        return default
+
+    index = int(index)
+    if not index in valid_idx:
+        raise ValueError('Invalid Sheet Number')
+
+    return index
@@ -18,10 +18,11 @@ setup(
     install_requires=[
       'click',
       'openpyxl==2.5.14',
-      'six'
     ],
     extras_require={
       'test': ['pytest'],
+      'vectorized': ['numpy'],
+      'arrow': ['pyarrow'],
     },
     entry_points={
       'console_scripts': 'echoclean=echoclean.cli:cli'
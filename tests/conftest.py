@@ -0,0 +1,35 @@
+import csv
+
+import pytest
+
+
+RULES = [
+    ['Consensus', 'HiF', 'Species', 'Inspect'],
+    ['mylu', '>40', 'MYLU', ''],
+    ['epfu', '', 'EPFU', 'Yes'],
+]
+
+DATA = [
+    ['Filename', 'Consensus', 'HiF'],
+    ['x/20190601_220000_123.wav', 'MYLU', '45'],
+    ['x/20190602_030000_000.wav', 'epfu', '10'],
+    ['x/20190602_230000_000.wav', '', '10'],
+]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Cache rules and sheets in a temporary directory rather than the user's."""
+
+    monkeypatch.setenv('ECHOCLEAN_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+def write_csv(filename, rows):
+    with open(str(filename), 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def read_csv(filename):
+    with open(str(filename), newline='') as f:
+        return list(csv.reader(f))
@@ -0,0 +1,133 @@
+import pytest
+from click.testing import CliRunner
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from echoclean.arrow import ArrowReader, ArrowWriter
+from echoclean.cli import cli
+
+from .conftest import RULES, write_csv
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_arrow_writer_reader(tmp_path, format):
+    filename = str(tmp_path / 'out.{0}'.format(format))
+    writer = ArrowWriter(filename, format=format, batch_size=2)
+    writer.write_header(['Species', 'Rule', 'HiF'])
+    writer.write_row(['MYLU', 1, 45.5])
+    writer.write_row(['', '', None])
+    writer.write_row(['EPFU', 2, 10])
+    writer.write_table('Species Summary', ['Value', 'Rows Classified'], [['MYLU', 1], ['', 2]])
+    writer.close()
+
+    reader = ArrowReader(filename)
+    assert reader.fieldnames == ['Species', 'Rule', 'HiF']
+    assert reader.schema.field('Rule').type == pa.int64()
+    # blank results are nulls in columns that are not strings
+    assert list(reader.iter_values()) == [
+        ['MYLU', 1, 45.5],
+        ['', None, None],
+        ['EPFU', 2, 10.0],
+    ]
+    reader.close()
+
+    reader = ArrowReader(str(tmp_path / 'out_species_summary.{0}'.format(format)))
+    assert list(reader) == [
+        {'Value': 'MYLU', 'Rows Classified': 1},
+        {'Value': '', 'Rows Classified': 2},
+    ]
+    reader.close()
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_arrow_writer_widens_types(tmp_path, format):
+    filename = str(tmp_path / 'out.{0}'.format(format))
+    writer = ArrowWriter(filename, format=format, batch_size=2)
+    writer.write_header(['Mixed', 'Number', 'Species'])
+    for row in ([1, 1, 'a'], ['', 2, 'b'], [1.5, 2.5, 'c'], ['n/a', 3, 'd']):
+        writer.write_row(row)
+    writer.close()
+
+    reader = ArrowReader(filename)
+    assert reader.schema.field('Mixed').type == pa.string()
+    assert reader.schema.field('Number').type == pa.float64()
+    assert list(reader.iter_values()) == [
+        ['1', 1.0, 'a'],
+        [None, 2.0, 'b'],
+        ['1.5', 2.5, 'c'],
+        ['n/a', 3.0, 'd'],
+    ]
+    reader.close()
+    assert not (tmp_path / 'out.{0}.tmp'.format(format)).exists()
+
+
+def test_arrow_reader_iter_chunks(tmp_path):
+    filename = str(tmp_path / 'data.arrow')
+    table = pa.table({'a': list(range(7)), 'b': list('abcdefg')})
+    with pa.ipc.new_file(filename, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=3):
+            writer.write_batch(batch)
+
+    reader = ArrowReader(filename)
+    chunks = list(reader.iter_chunks(['b'], 4))
+    assert [t.num_rows for t, _ in chunks] == [4, 3]
+    assert pa.concat_tables([t for t, _ in chunks]).equals(table)
+    assert [chunk for _, chunk in chunks] == [
+        [('a', ), ('b', ), ('c', ), ('d', )],
+        [('e', ), ('f', ), ('g', )],
+    ]
+    reader.close()
+
+    # rows are counted without any columns
+    reader = ArrowReader(filename)
+    assert [chunk for _, chunk in reader.iter_chunks([], 5)] == [[()] * 5, [()] * 2]
+    reader.close()
+
+
+def test_apply_parquet(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    pq.write_table(pa.table({
+        'Filename': ['x/20190601_220000_123.wav', 'x/20190602_030000_000.wav'],
+        'Consensus': ['MYLU', 'epfu'],
+        'HiF': [45, 10],
+    }), str(tmp_path / 'data.parquet'))
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.parquet'),
+        '-f', 'parquet'])
+    assert result.exit_code == 0, result.output
+
+    table = pq.read_table(str(tmp_path / 'data_out.parquet'))
+    assert table.column_names == ['Species', 'Inspect', 'night', 'Filename', 'Consensus', 'HiF']
+    assert table.schema.field('HiF').type == pa.int64()
+    assert table.column('Species').to_pylist() == ['MYLU', 'EPFU']
+
+
+def test_apply_parquet_keeps_columns(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    pq.write_table(pa.table({
+        'Filename': ['x/20190601_220000_123.wav', 'x/20190602_030000_000.wav'],
+        'Consensus': ['MYLU', 'epfu'],
+        'HiF': [45, 10],
+        'Pulses': pa.array([[1, 2], []], type=pa.list_(pa.int16())),
+        'Notes': pa.array(['a', None]).dictionary_encode(),
+    }), str(tmp_path / 'data.parquet'))
+
+    # columns not tested by rules are written as read, unless rows are read
+    # as Python values (e.g., to explain them)
+    for args, types in (
+            (['--no-pipeline'], [pa.list_(pa.int16()), pa.dictionary(pa.int32(), pa.string())]),
+            (['--pipeline', '--explain-row', '1'], [pa.list_(pa.int64()), pa.string()])):
+        result = CliRunner().invoke(cli, [
+            'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.parquet'),
+            str(tmp_path / 'out.arrow'), '-f', 'arrow'] + args)
+        assert result.exit_code == 0, result.output
+
+        reader = ArrowReader(str(tmp_path / 'out.arrow'))
+        assert [reader.schema.field(key).type for key in ('Pulses', 'Notes')] == types
+        rows = list(reader)
+        reader.close()
+        assert [row['Species'] for row in rows] == ['MYLU', 'EPFU']
+        assert [row['Pulses'] for row in rows] == [[1, 2], []]
+        assert [row['Notes'] for row in rows] == ['a', None]
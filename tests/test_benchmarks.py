@@ -0,0 +1,37 @@
+import csv
+
+from benchmarks.generate import LAYOUTS, generate_rows, generate_rules, write_data
+from echoclean.ruleset import ParsedRules
+
+
+def test_generated_rules_classify_generated_rows():
+    for layout in LAYOUTS:
+        fieldnames = [name for name, _, _ in LAYOUTS[layout]]
+        rows = [dict(zip(fieldnames, values)) for values in generate_rows(500, layout=layout)]
+
+        header, rules = generate_rules(50, layout=layout)
+        parsed = ParsedRules(header, [dict(zip(header, rule)) for rule in rules])
+        criteria_cols, result_cols = parsed.split_columns(fieldnames)
+        assert result_cols == ['Rule', 'Species', 'Inspect']
+
+        ruleset = parsed.ruleset(result_cols)
+        matches = [ruleset.match(row) for row in rows]
+        assert 0 < matches.count(None) < len(rows)
+
+        kinds = {str(criterion) for rule in ruleset.rules for criterion in rule.criteria.values()}
+        assert 'blank' in kinds
+        assert any(kind.startswith('NOT IN') for kind in kinds)
+        assert any(kind.startswith('IN') for kind in kinds)
+        assert any(kind.startswith('>=') for kind in kinds)
+
+
+def test_write_data(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    write_data(filename, 10, seed=1)
+
+    with open(filename, newline='') as f:
+        rows = list(csv.reader(f))
+
+    assert rows[0] == [name for name, _, _ in LAYOUTS['sonobat']]
+    assert len(rows) == 11
+    assert rows[1] == [str(v) for v in next(generate_rows(1, seed=1))]
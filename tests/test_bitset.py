@@ -0,0 +1,103 @@
+import random
+from collections import OrderedDict
+
+import pytest
+
+from echoclean.bitset import ColumnIndex
+from echoclean.ruleset import Rule, Ruleset
+
+
+CRITERIA = ['', 'blank', 'any', 'one', 'one, two', 'two, or blank', 'not one',
+            'not blank', '3-6', '<1', '<=1', '2', '>10', '>=10']
+
+VALUES = ['', None, 'one', 'two', 'three', ' ONE ', 'blank', 0, 1, 2, 2.5, 3,
+          '4', 6, 10, 11, '12.5']
+
+
+def make_rules(count, seed):
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(count):
+        criteria = [('foo', rnd.choice(CRITERIA)), ('bar', rnd.choice(CRITERIA))]
+        # criteria are tested in the order of their columns in each rule
+        rnd.shuffle(criteria)
+        rules.append(OrderedDict(criteria + [('ret', 'rule {}'.format(i))]))
+    return rules
+
+
+def test_indexed_matches_linear():
+    for seed in range(20):
+        linear = Ruleset(make_rules(30, seed), result_cols=('ret', ))
+        indexed = Ruleset(make_rules(30, seed), result_cols=('ret', ), indexed=True)
+
+        for foo in VALUES:
+            for bar in VALUES:
+                row = OrderedDict([('foo', foo), ('bar', bar)])
+                try:
+                    expected = linear.test(row)
+                except ValueError:
+                    # non-numeric value reached a numeric criterion
+                    with pytest.raises(ValueError):
+                        indexed.test(row)
+                    continue
+
+                assert indexed.test(row) == expected
+
+
+def test_indexed_first_match():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'one and >2'}),
+            OrderedDict({'foo': 'any', 'bar': '1-5', 'ret': '1-5'}),
+            OrderedDict({'foo': 'not two', 'bar': '', 'ret': 'not two'}),
+        ],
+        result_cols=('ret', ),
+        indexed=True
+    )
+
+    assert ruleset.match(OrderedDict({'foo': 'one', 'bar': 3})) == 0
+    assert ruleset.match(OrderedDict({'foo': 'two', 'bar': 3})) == 1
+    assert ruleset.match(OrderedDict({'foo': 'one', 'bar': 1})) == 1
+    assert ruleset.match(OrderedDict({'foo': 'three', 'bar': 0})) == 2
+    assert ruleset.match(OrderedDict({'foo': 'two', 'bar': 0})) is None
+
+
+def test_indexed_non_numeric_fallback():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '', 'ret': 'one'}),
+            OrderedDict({'foo': '', 'bar': '>2', 'ret': '>2'}),
+        ],
+        result_cols=('ret', ),
+        indexed=True
+    )
+
+    # Matches first rule before reaching the numeric criterion
+    assert ruleset.test(OrderedDict({'foo': 'one', 'bar': 'abc'})) == ['one']
+
+
+def test_indexed_invalid_number():
+    ruleset = Ruleset(
+        [
+            OrderedDict([('foo', 'two'), ('bar', ''), ('ret', 'two')]),
+            OrderedDict([('bar', '>2'), ('foo', 'one'), ('ret', '>2 and one')]),
+        ],
+        result_cols=('ret', ),
+        indexed=True
+    )
+
+    # no rule matches foo, but a linear scan tests bar of the second rule first
+    with pytest.raises(ValueError):
+        ruleset.test(OrderedDict([('foo', 'three'), ('bar', 'abc')]))
+    assert ruleset.test(OrderedDict([('foo', 'two'), ('bar', 'abc')])) == ['two']
+
+
+def test_column_cache_size():
+    rules = [Rule(OrderedDict({'foo': 'one', 'ret': 'one'}), ('ret', ))]
+    column = ColumnIndex('foo', rules, 0, cache_size=3)
+
+    for value in ['one', 'two', 'three', 'four', 'one']:
+        column.mask(value)
+
+    assert list(column._cache) == ['three', 'four', 'one']
+    assert column.mask('one') == 1 and column.mask('four') == 0
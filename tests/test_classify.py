@@ -0,0 +1,167 @@
+from collections import OrderedDict
+
+import pytest
+
+from echoclean.classify import ChunkClassifier, classify_chunks, classify_iter, iter_chunks
+from echoclean.csv_dictreader import DictReader as CSV_DictReader
+from echoclean.incremental import RunState, StateMismatch
+from echoclean.night import NightParser
+from echoclean.ruleset import Ruleset
+from echoclean.summary import Summary
+
+
+def make_classifier():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'one and >2'}),
+            OrderedDict({'foo': 'two', 'bar': '', 'ret': 'two'}),
+        ],
+        result_cols=('ret', )
+    )
+    return ChunkClassifier(ruleset, ['foo', 'bar', 'other'], empty_row=[''])
+
+
+def test_chunk_classifier():
+    output_rows, summary, matches = make_classifier()([
+        ['one', 3, 'a'],
+        ['one', 1, 'b'],
+        ['two', '', 'c'],
+    ])
+
+    assert output_rows == [
+        ['one and >2', 'one', 3, 'a'],
+        ['', 'one', 1, 'b'],
+        ['two', 'two', '', 'c'],
+    ]
+    assert summary.classified == {True: 2, False: 1}
+    assert summary.counts == {'ret': {'one and >2': 1, 'two': 1}}
+    assert matches == [0, -1, 1]
+
+
+def test_iter_chunks_csv(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    with open(filename, 'w') as f:
+        f.write('foo,bar,other\none,3,a\n\ntwo\nthree,4,b,extra\n')
+
+    with open(filename) as f:
+        expected = [[row[k] for k in ('foo', 'bar', 'other')] for row in CSV_DictReader(f)]
+
+    with open(filename) as f:
+        reader = CSV_DictReader(f)
+        chunks = list(iter_chunks(reader, reader.fieldnames, chunk_size=2))
+
+    assert chunks == [expected[:2], expected[2:]]
+    assert expected[1] == ['two', None, None]
+
+
+def test_parallel_preserves_order():
+    classifier = make_classifier()
+    rows = [
+        OrderedDict([('foo', ['one', 'two', 'three'][i % 3]), ('bar', i % 5), ('other', i)])
+        for i in range(1000)
+    ]
+
+    results = []
+    for jobs in (1, 3):
+        output = []
+        summary = Summary(['ret'])
+        chunks = iter_chunks(rows, classifier.fieldnames, chunk_size=37)
+        for output_rows, chunk_summary, _ in classify_chunks(classifier, chunks, jobs=jobs):
+            output.extend(output_rows)
+            summary.merge(chunk_summary)
+
+        results.append((output, list(summary.tables())))
+
+    assert [row[-1] for row in results[1][0]] == list(range(1000))
+    assert results[0] == results[1]
+
+
+def test_profile():
+    classifier = make_classifier()
+    classifier.profile = True
+    summary = Summary(['ret'])
+    for chunk in (
+        [['one', 3, 'a'], ['one', 1, 'b']],
+        [['two', '', 'c'], ['three', 4, 'd']],
+    ):
+        summary.merge(classifier(chunk)[1])
+
+    profile = summary.profile
+    assert profile.tested == [4, 3]
+    assert profile.matched == [1, 1]
+    assert profile.rejected == [3, 2]
+    assert profile.rejected_by[0] == {'foo': 2, 'bar': 1}
+    assert profile.rejected_by[1] == {'foo': 2}
+    assert classifier.ruleset.profile is None
+
+
+def test_incremental():
+    rows = [[foo, bar, 'x'] for foo in ('one', 'two', 'three') for bar in ('', 1, 3)]
+    previous_classifier = make_classifier()
+    _, _, previous_matches = previous_classifier(rows)
+    assert previous_matches == [-1, -1, 0, 1, 1, 1, -1, -1, -1]
+
+    previous = RunState('hash', ['foo', 'bar', 'other'], ['ret'],
+                        previous_classifier.ruleset.fingerprints, previous_matches)
+
+    for indexed in (False, True):
+        # change the second rule and add a third
+        ruleset = Ruleset(
+            [
+                OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'one and >2'}),
+                OrderedDict({'foo': 'two', 'bar': '>2', 'ret': 'two'}),
+                OrderedDict({'foo': '', 'bar': '1', 'ret': '1'}),
+            ],
+            result_cols=('ret', ),
+            indexed=indexed
+        )
+        assert previous.first_changed(ruleset.fingerprints) == 1
+
+        classifier = ChunkClassifier(ruleset, ['foo', 'bar', 'other'], [''], first_changed=1)
+        chunks = iter_chunks([dict(zip(classifier.fieldnames, row)) for row in rows],
+                             classifier.fieldnames, chunk_size=4)
+        output = []
+        for output_rows, _, _ in classify_chunks(classifier, chunks,
+                                                       previous=previous.chunks(4)):
+            output.extend(output_rows)
+
+        full = ChunkClassifier(ruleset, classifier.fieldnames, [''])(rows)[0]
+        assert output == full
+
+
+def test_incremental_mismatch():
+    previous = RunState('hash', ['foo', 'bar', 'other'], ['ret'], [], [-1, 0, 1], sheet_index=1)
+    assert previous.is_compatible('hash', ['foo', 'bar', 'other'], ['ret'], 1)
+    assert previous.is_compatible('hash', ['foo', 'bar', 'other'], ['ret'], 1, num_rows=3)
+    assert not previous.is_compatible('hash', ['foo', 'bar', 'other'], ['ret'], 0)
+    assert not previous.is_compatible('hash', ['foo', 'bar', 'other'], ['ret'], 1, num_rows=4)
+
+    classifier = make_classifier()
+    classifier.first_changed = 0
+    rows = [['one', 3, 'x'], ['two', 1, 'x'], ['three', '', 'x'], ['one', '', 'x']]
+    for matches in (previous.matches, previous.matches + [-1, -1]):
+        state = RunState('hash', ['foo', 'bar', 'other'], ['ret'], [], matches)
+        chunks = iter_chunks([dict(zip(classifier.fieldnames, row)) for row in rows],
+                             classifier.fieldnames, chunk_size=2)
+        with pytest.raises(StateMismatch):
+            list(classify_chunks(classifier, chunks, previous=state.chunks(2)))
+
+
+def test_classify_iter():
+    ruleset = make_classifier().ruleset
+    rows = [
+        {'Filename': 'x/20190601_220000_123.wav', 'foo': 'one', 'bar': 3},
+        {'Filename': 'x/20190602_030000_000.wav', 'foo': 'two', 'bar': ''},
+        {'Filename': 'x/20190602_230000_000.wav', 'foo': 'one', 'bar': 1},
+    ]
+
+    summary = Summary(['ret'])
+    chunks = list(classify_iter(ruleset, rows, chunk_size=2, summary=summary,
+                                nights=NightParser()))
+    assert [chunk for chunk, _, _ in chunks] == [rows[:2], rows[2:]]
+    assert [list(matches) for _, matches, _ in chunks] == [[0, 1], [-1]]
+    assert [results for _, _, results in chunks] == [[('one and >2', ), ('two', )], [None]]
+
+    assert summary.classified == {True: 2, False: 1}
+    assert summary.counts == {'ret': {'one and >2': 1, 'two': 1}}
+    assert summary.nights == {'06/01/2019': {True: 2}, '06/02/2019': {False: 1}}
@@ -0,0 +1,296 @@
+import json
+import sqlite3
+
+from click.testing import CliRunner
+
+from echoclean.cache import file_hash
+from echoclean.cli import cli
+
+from .conftest import DATA, RULES, read_csv, write_csv
+
+
+def test_apply_csv(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'csv'])
+    assert result.exit_code == 0, result.output
+
+    assert read_csv(tmp_path / 'data_out.csv') == [
+        ['Species', 'Inspect', 'night', 'Filename', 'Consensus', 'HiF'],
+        ['MYLU', '', '06/01/2019', 'x/20190601_220000_123.wav', 'MYLU', '45'],
+        ['EPFU', 'Yes', '06/01/2019', 'x/20190602_030000_000.wav', 'epfu', '10'],
+        ['', 'Yes', '06/02/2019', 'x/20190602_230000_000.wav', '', '10'],
+    ]
+
+
+def test_apply_profile(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'csv',
+        '--profile-json', str(tmp_path / 'profile.json')])
+    assert result.exit_code == 0, result.output
+
+    table = read_csv(tmp_path / 'data_out_rule_profile.csv')
+    assert [row[:4] for row in table] == [
+        ['Rule', 'Tested', 'Matched', 'Rejected'],
+        ['1', '3', '1', '2'],
+        ['2', '2', '1', '1'],
+    ]
+    assert table[1][-1] == 'Consensus: 2'
+
+    with open(str(tmp_path / 'profile.json')) as f:
+        profile = json.load(f)
+    assert profile['rules'][1]['rejected_by'] == {'Consensus': 1}
+
+
+def test_apply_report(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'csv',
+        '--progress', '--report-json', str(tmp_path / 'report.json')])
+    assert result.exit_code == 0, result.output
+    assert '3 passes' in result.output
+    assert 'Time by phase:' in result.output
+
+    with open(str(tmp_path / 'report.json')) as f:
+        report = json.load(f)
+    assert report['rows'] == 3
+    for phase in ('read rules', 'read data', 'match rules', 'parse nights', 'write rows',
+                  'write summaries and save output'):
+        assert phase in report['phases']
+
+
+def test_apply_explain(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'csv',
+        '--explain-row', '1', '--explain-file', '*_2300*'])
+    assert result.exit_code == 0, result.output
+    assert 'Explained 2 passes' in result.output
+
+    with open(str(tmp_path / 'data_out_trace.txt')) as f:
+        trace = f.read()
+    assert trace.startswith('Row 1 (Filename: x/20190601_220000_123.wav)\n  Rule 1: PASSED\n')
+    assert 'Result: Species=MYLU, Inspect=\n' in trace
+    assert 'Row 3 ' in trace and 'No rules matched' in trace
+    assert 'Row 2 ' not in trace
+
+
+def test_apply_incremental(tmp_path):
+    write_csv(tmp_path / 'data.csv', DATA)
+    args = ['apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'),
+            str(tmp_path / 'out.csv')]
+
+    write_csv(tmp_path / 'rules.csv', RULES)
+    result = CliRunner().invoke(cli, args + ['--incremental'])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / 'out.csv.echoclean').exists()
+
+    write_csv(tmp_path / 'rules.csv', RULES[:2] + [['', '<20', 'OTHER', '']])
+    result = CliRunner().invoke(cli, args + ['--incremental'])
+    assert result.exit_code == 0, result.output
+    assert '2 of 3 passes may match changed rules' in result.output
+    incremental = read_csv(tmp_path / 'out.csv')
+
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert read_csv(tmp_path / 'out.csv') == incremental
+    assert [row[0] for row in incremental] == ['Species', 'MYLU', 'OTHER', 'OTHER']
+
+
+def test_apply_resume(tmp_path, monkeypatch):
+    from echoclean.checkpoint import Checkpoint
+
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+    args = ['apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'),
+            str(tmp_path / 'out.csv'), '--no-pipeline', '--explain-sample', '1']
+
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    expected = read_csv(tmp_path / 'out.csv')
+    expected_trace = (tmp_path / 'out_trace.txt').read_text()
+
+    # interrupt the run after the first checkpoint
+    save = Checkpoint.save
+
+    def interrupt(checkpoint, *args):
+        save(checkpoint, *args)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr('echoclean.cli.CHUNK_SIZE', 1)
+    monkeypatch.setattr(Checkpoint, 'save', interrupt)
+    result = CliRunner().invoke(cli, args + ['--checkpoint', '1'])
+    assert result.exit_code != 0
+    assert (tmp_path / 'out.csv.checkpoint').exists()
+    monkeypatch.setattr(Checkpoint, 'save', save)
+
+    # rows and explanations written after the checkpoint are discarded
+    with open(str(tmp_path / 'out.csv'), 'a') as f:
+        f.write('partial,row')
+    with open(str(tmp_path / 'out_trace.txt'), 'a') as f:
+        f.write('Row 2\n')
+
+    result = CliRunner().invoke(cli, args + ['--resume'])
+    assert result.exit_code == 0, result.output
+    assert 'Resuming after 1 passes' in result.output
+    assert read_csv(tmp_path / 'out.csv') == expected
+    assert (tmp_path / 'out_trace.txt').read_text() == expected_trace
+    assert not (tmp_path / 'out.csv.checkpoint').exists()
+
+
+def test_apply_resume_other_sheet(tmp_path, monkeypatch):
+    from openpyxl import Workbook
+    from echoclean.checkpoint import Checkpoint
+
+    write_csv(tmp_path / 'rules.csv', RULES)
+    wb = Workbook()
+    wb.active.title = 'First'
+    wb.create_sheet('Second')
+    for ws in wb.worksheets:
+        for row in DATA:
+            ws.append(row)
+    wb.save(str(tmp_path / 'data.xlsx'))
+    args = ['apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.xlsx'),
+            str(tmp_path / 'out.csv'), '--no-pipeline']
+
+    save = Checkpoint.save
+
+    def interrupt(checkpoint, *args):
+        save(checkpoint, *args)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr('echoclean.cli.CHUNK_SIZE', 1)
+    monkeypatch.setattr(Checkpoint, 'save', interrupt)
+    result = CliRunner().invoke(cli, args + ['--checkpoint', '1'], input='0\n')
+    assert result.exit_code != 0
+    monkeypatch.setattr(Checkpoint, 'save', save)
+
+    # a checkpoint of another sheet of the same file is not resumed
+    result = CliRunner().invoke(cli, args + ['--resume'], input='1\n')
+    assert result.exit_code == 0, result.output
+    assert 'options changed since the checkpoint' in result.output
+    assert len(read_csv(tmp_path / 'out.csv')) == len(DATA)
+
+
+def test_apply_sqlite(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    result = CliRunner().invoke(cli, [
+        'apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'sqlite'])
+    assert result.exit_code == 0, result.output
+
+    db = sqlite3.connect(str(tmp_path / 'data_out.sqlite'))
+    assert db.execute('SELECT Species, night, matched_rule, Consensus FROM classify_results'
+                      ).fetchall() == [
+        ('MYLU', '2019-06-01', 1, 'MYLU'),
+        ('EPFU', '2019-06-01', 2, 'epfu'),
+        ('', '2019-06-02', None, ''),
+    ]
+    assert db.execute('SELECT data, rules, rules_hash FROM runs').fetchall() == [
+        (str(tmp_path / 'data.csv'), str(tmp_path / 'rules.csv'),
+         file_hash(str(tmp_path / 'rules.csv')))]
+    db.close()
+
+
+def test_batch(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    (tmp_path / 'data').mkdir()
+    write_csv(tmp_path / 'data' / 'site1.csv', DATA)
+    write_csv(tmp_path / 'data' / 'site2.csv', DATA[:2])
+
+    result = CliRunner().invoke(cli, [
+        'batch', str(tmp_path / 'rules.csv'), str(tmp_path / 'data' / '*.csv'),
+        '-o', str(tmp_path / 'out'), '-f', 'csv'])
+    assert result.exit_code == 0, result.output
+
+    assert len(read_csv(tmp_path / 'out' / 'site1_out.csv')) == 4
+    assert len(read_csv(tmp_path / 'out' / 'site2_out.csv')) == 2
+
+    site1 = str(tmp_path / 'data' / 'site1.csv')
+    site2 = str(tmp_path / 'data' / 'site2.csv')
+    assert read_csv(tmp_path / 'out' / 'batch_summary.csv') == [
+        ['File', 'Rows Classified', 'Rows Not Classified', 'Total Rows'],
+        [site1, '2', '1', '3'],
+        [site2, '1', '0', '1'],
+        ['Total', '3', '1', '4'],
+    ]
+    assert read_csv(tmp_path / 'out' / 'batch_summary_night_summary.csv') == [
+        ['File', 'Night', 'Rows Classified', 'Rows Not Classified', 'Total Rows'],
+        [site1, '06/01/2019', '2', '0', '2'],
+        [site1, '06/02/2019', '0', '1', '1'],
+        [site2, '06/01/2019', '1', '0', '1'],
+    ]
+
+
+def test_batch_rerun(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    (tmp_path / 'data').mkdir()
+    write_csv(tmp_path / 'data' / 'site1.csv', DATA)
+    write_csv(tmp_path / 'data' / 'site2.csv', DATA[:2])
+
+    # outputs and the batch summary are written next to the data files, and
+    # are not classified as data when the same pattern is used again
+    args = ['batch', str(tmp_path / 'rules.csv'), str(tmp_path / 'data' / '*.csv'), '-f', 'csv']
+    for _ in range(2):
+        result = CliRunner().invoke(cli, args)
+        assert result.exit_code == 0, result.output
+        assert 'Classifying 2 files' in result.output
+        assert len(read_csv(tmp_path / 'data' / 'batch_summary.csv')) == 4
+
+    names = sorted(path.name for path in (tmp_path / 'data').iterdir())
+    assert names[:2] == ['batch_summary.csv', 'batch_summary_night_summary.csv']
+    # all but the two data files
+    assert 'Skipping {0} files'.format(len(names) - 2) in result.output
+
+
+def test_batch_same_names(tmp_path):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    for site, rows in (('site1', DATA), ('site2', DATA[:2])):
+        (tmp_path / site).mkdir()
+        write_csv(tmp_path / site / 'night.csv', rows)
+
+    args = ['batch', str(tmp_path / 'rules.csv'), str(tmp_path / 'site*' / 'night.csv'),
+            '-o', str(tmp_path / 'out'), '-f', 'csv']
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert len(read_csv(tmp_path / 'out' / 'site1' / 'night_out.csv')) == 4
+    assert len(read_csv(tmp_path / 'out' / 'site2' / 'night_out.csv')) == 2
+
+    # files that would still share an output are rejected before classifying
+    write_csv(tmp_path / 'site1' / 'night.txt', DATA)
+    result = CliRunner().invoke(cli, args + [str(tmp_path / 'site1' / 'night.txt')])
+    assert result.exit_code != 0
+    assert 'would both be written to' in result.output
+
+
+def test_apply_cached_rules(tmp_path, cache_dir):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    args = ['apply', str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), '-f', 'csv']
+    assert CliRunner().invoke(cli, args).exit_code == 0
+    expected = read_csv(tmp_path / 'data_out.csv')
+    assert len(list(cache_dir.iterdir())) == 1
+
+    assert CliRunner().invoke(cli, args).exit_code == 0
+    assert read_csv(tmp_path / 'data_out.csv') == expected
+
+    # changing the rules creates a new entry
+    write_csv(tmp_path / 'rules.csv', RULES[:2])
+    assert CliRunner().invoke(cli, args).exit_code == 0
+    assert len(list(cache_dir.iterdir())) == 2
+    assert read_csv(tmp_path / 'data_out.csv')[2][:2] == ['', 'Yes']
+
+    result = CliRunner().invoke(cli, ['clear-cache'])
+    assert result.exit_code == 0
+    assert list(cache_dir.iterdir()) == []
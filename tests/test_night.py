@@ -0,0 +1,45 @@
+import pytest
+
+from echoclean.night import NightParser
+
+
+def test_sonobat():
+    parser = NightParser()
+    assert parser('dir/SITE_20190601_221530_123.wav') == '06/01/2019'
+    assert parser('dir/SITE_20190602_115959_000.wav') == '06/01/2019'
+    assert parser('dir/SITE_20190602_120000_000.wav') == '06/02/2019'
+    assert parser('20190301_010000_000.wav') == '02/28/2019'
+    assert parser('no_date.wav') is None
+
+    # Kaleidoscope filenames do not include milliseconds
+    assert parser('S4U01234_20190601_221530.wav') is None
+
+
+def test_kaleidoscope():
+    parser = NightParser('kaleidoscope')
+    assert parser.column == 'IN FILE'
+    assert parser('S4U01234_20190601_221530.wav') == '06/01/2019'
+    assert parser('S4U01234_20190602_030000.wav') == '06/01/2019'
+
+
+def test_cutoff():
+    parser = NightParser(cutoff_hour=6)
+    assert parser('SITE_20190602_055959_000.wav') == '06/01/2019'
+    assert parser('SITE_20190602_060000_000.wav') == '06/02/2019'
+
+    with pytest.raises(ValueError):
+        NightParser(cutoff_hour=24)
+
+
+def test_parse_many():
+    parser = NightParser()
+    filenames = ['SITE_20190601_2{0}0000_000.wav'.format(i) for i in range(4)] + ['other.wav']
+    assert parser.parse_many(filenames) == ['06/01/2019'] * 4 + [None]
+    assert parser.parse_many(filenames) == [parser(f) for f in filenames]
+
+
+def test_for_fieldnames():
+    assert NightParser.for_fieldnames(['Filename', 'HiF']).format == 'sonobat'
+    assert NightParser.for_fieldnames(['IN FILE', 'AUTO ID*']).format == 'kaleidoscope'
+    assert NightParser.for_fieldnames(['HiF']) is None
+    assert NightParser.for_fieldnames(['Filename'], format='kaleidoscope') is None
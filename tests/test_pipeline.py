@@ -0,0 +1,46 @@
+import os
+import csv
+from functools import partial
+
+import pytest
+
+from echoclean.cli import _open_reader
+from echoclean.pipeline import PipelineError, PipelineReader, PipelineWriter
+from echoclean.writers import get_writer
+
+
+def test_pipeline_round_trip(tmp_path):
+    data = str(tmp_path / 'data.csv')
+    with open(data, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['foo', 'bar'])
+        for i in range(25):
+            writer.writerow(['row{0}'.format(i), i])
+
+    reader = PipelineReader(partial(_open_reader, data, 'data', prompt=False), chunk_size=10)
+    assert reader.fieldnames == ['foo', 'bar']
+
+    output = str(tmp_path / 'out.csv')
+    writer = PipelineWriter(partial(get_writer, output, 'csv'), batch_size=7)
+    writer.write_header(reader.fieldnames)
+    chunks = list(reader.chunks())
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    for chunk in chunks:
+        for row in chunk:
+            writer.write_row(row)
+    writer.close()
+    reader.close()
+
+    with open(output) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['foo', 'bar']
+    assert rows[1:] == [['row{0}'.format(i), str(i)] for i in range(25)]
+
+
+def test_pipeline_writer_error(tmp_path):
+    output = str(tmp_path / 'missing' / 'out.csv')
+    writer = PipelineWriter(partial(get_writer, output, 'csv'))
+    writer.write_header(['foo'])
+    with pytest.raises(PipelineError):
+        writer.close()
+    assert not os.path.exists(output)
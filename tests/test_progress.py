@@ -0,0 +1,44 @@
+import io
+
+from echoclean.progress import PhaseTimer, Progress, estimate_rows, format_report
+
+
+def test_estimate_rows(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    with open(filename, 'w') as f:
+        f.write('Filename,HiF\n')
+        for i in range(100):
+            f.write('x/20190601_220000_{0:03d}.wav,{1}\n'.format(i, i % 50))
+
+    assert estimate_rows(filename, None) == 100
+    assert estimate_rows(str(tmp_path / 'data.parquet'), None) is None
+
+
+def test_progress():
+    stream = io.StringIO()
+    progress = Progress(total=100, stream=stream)
+    progress.update(50, force=True)
+    progress.finish(100)
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('50 passes') and '50%' in lines[0] and 'remaining' in lines[0]
+    assert lines[1].startswith('100 passes') and lines[1].endswith('100%')
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    with timer.phase('read rules'):
+        pass
+    assert list(timer.iter('read data', [1, 2])) == [1, 2]
+    timer.add('match rules', 1.5)
+    timer.add('match rules', 0.5)
+
+    report = timer.report(10)
+    assert report['rows'] == 10
+    assert list(report['phases']) == ['read rules', 'read data', 'match rules']
+    assert report['phases']['match rules'] == 2
+
+    lines = format_report(report)
+    assert lines[0] == 'Time by phase:'
+    assert lines[3].split()[:2] == ['match', 'rules']
@@ -1,5 +1,9 @@
 from collections import OrderedDict
-from echoclean.ruleset import Ruleset
+
+import pytest
+
+from echoclean import ruleset as ruleset_module
+from echoclean.ruleset import MatchMemo, Ruleset
 
 
 def test_blank():
@@ -118,6 +122,210 @@ def test_compound_rules():
     assert ruleset.test(OrderedDict({'foo': 'one', 'bar': 3})) == ['one and >2']
 
 
+def test_normalization_plan():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'baz': '', 'ret': 'one and >2'}),
+            OrderedDict({'foo': 'blank', 'bar': 'blank', 'baz': 'any', 'ret': 'blank'}),
+        ],
+        result_cols=('ret', )
+    )
+
+    assert ruleset.plan.text_cols == ['foo', 'baz']
+    assert ruleset.plan.numeric_cols == ['bar']
+
+    row = OrderedDict({'foo': ' ONE ', 'bar': '3', 'baz': 'Blank', 'other': ' X '})
+    assert ruleset.plan.columns == ['foo', 'bar', 'baz']
+    assert ruleset.plan(row) == ['one', 3.0, None]
+
+    # positional rows
+    keys = ruleset.plan.keys(['other', 'baz', 'bar', 'foo'])
+    assert ruleset.plan([' X ', 'Blank', '3', ' ONE '], keys) == ['one', 3.0, None]
+    assert ruleset.test(row) == ['one and >2']
+
+    # original row is not modified
+    assert row == OrderedDict({'foo': ' ONE ', 'bar': '3', 'baz': 'Blank', 'other': ' X '})
+
+
+def test_compiled_rules():
+    criteria = ['', 'blank', 'one', 'one, two', 'two, or blank', 'not one',
+                'not blank', '3-6', '<1', '<=1', '2', '>10', '>=10']
+    values = ['', None, 'one', 'two', ' ONE ', 0, 1, 2, 2.5, 3, '4', 10, 11]
+
+    rules = [OrderedDict({'foo': c, 'ret': c}) for c in criteria]
+    # Mixed numeric and text criteria in one column
+    rules += [OrderedDict({'foo': 'any', 'bar': c, 'ret': c}) for c in criteria]
+    ruleset = Ruleset(rules, result_cols=('ret', ))
+
+    for foo in values:
+        for bar in values:
+            row = ruleset.plan(OrderedDict({'foo': foo, 'bar': bar}))
+            for rule in ruleset.rules:
+                try:
+                    expected = rule.passes(row)
+                except ValueError:
+                    with pytest.raises(ValueError):
+                        rule.predicate(row)
+                    continue
+
+                assert rule.predicate(row) == expected, rule.source
+
+
+def test_invalid_number():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '', 'ret': 'one'}),
+            OrderedDict({'foo': '', 'bar': '>2', 'ret': '>2'}),
+        ],
+        result_cols=('ret', )
+    )
+
+    # Error is only raised if a numeric criterion is tested
+    assert ruleset.test(OrderedDict({'foo': 'one', 'bar': 'abc'})) == ['one']
+    with pytest.raises(ValueError):
+        ruleset.test(OrderedDict({'foo': 'two', 'bar': 'abc'}))
+
+
+def test_explain():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'first'}),
+            OrderedDict({'foo': '', 'bar': '<2', 'ret': 'second'}),
+        ],
+        result_cols=('ret', )
+    )
+
+    index, steps = ruleset.explain(OrderedDict({'foo': 'One', 'bar': '1'}))
+    assert index == 1
+    assert [i for i, _ in steps] == [0, 1]
+    assert [(key, value, passed) for key, _, value, passed in steps[0][1]] == [
+        ('foo', 'one', True), ('bar', 1.0, False)]
+
+    index, steps = ruleset.explain(OrderedDict({'foo': 'two', 'bar': 'abc'}))
+    assert index is None
+    assert steps[1][1][1][3] is False
+
+
+def test_test_many():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'first'}),
+            OrderedDict({'foo': '', 'bar': '<2', 'ret': 'second'}),
+        ],
+        result_cols=('ret', )
+    )
+
+    columns = {'foo': ['one', 'two', 'one', 'two'], 'bar': [3, 1, 1, 3], 'other': [1, 2, 3, 4]}
+    matches, results = ruleset.test_columns(columns)
+    assert list(matches) == [0, 1, 1, -1]
+    assert results == [('first', ), ('second', ), ('second', ), None]
+    assert results[1] is results[2]
+
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    assert ruleset.test_many(rows) == (matches, results)
+    assert list(ruleset.match_many(rows, start=1)) == [-1, 1, 1, -1]
+
+
+def test_test_columns_without_criteria():
+    ruleset = Ruleset([OrderedDict({'ret': 'all'})], result_cols=('ret', ))
+
+    matches, results = ruleset.test_columns({'other': [1, 2, 3]})
+    assert list(matches) == [0, 0, 0]
+    assert results == [('all', )] * 3
+
+    assert ruleset.test_columns({}, num_rows=2)[1] == [('all', )] * 2
+    with pytest.raises(ValueError):
+        ruleset.test_columns({})
+
+
+def test_optimize():
+    rules = [
+        OrderedDict({'foo': '>2', 'bar': 'x, y', 'baz': 'a', 'ret': 'first'}),
+        # foo is also tested as text, so values are converted to float on each test
+        OrderedDict({'foo': 'z, or blank', 'bar': 'blank', 'baz': 'not a', 'ret': 'second'}),
+    ]
+    rows = [
+        OrderedDict({'foo': foo, 'bar': bar, 'baz': baz})
+        for foo in ('1', '3', '')
+        for bar in ('x', 'y', 'z', '')
+        for baz in ('a', 'b', '')
+    ]
+
+    ruleset = Ruleset([OrderedDict(rule) for rule in rules], result_cols=('ret', ))
+    expected = [ruleset.test(row) for row in rows]
+
+    # without a sample, set criteria are tested before numeric conversion
+    ruleset.optimize()
+    assert ruleset.rules[0].order == ['bar', 'baz', 'foo']
+
+    # baz rejects most rows reaching the first rule
+    ruleset.optimize(rows)
+    assert ruleset.rules[0].order[0] == 'baz'
+    assert ruleset.rules[1].order[0] == 'bar'
+
+    assert [ruleset.test(row) for row in rows] == expected
+
+
+def test_optimize_invalid_number():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'Consensus': 'mylu', 'HiF': '>40', 'Species': 'MYLU'}),
+            OrderedDict({'Consensus': 'epfu', 'HiF': '', 'Species': 'EPFU'}),
+        ],
+        result_cols=('Species', )
+    )
+    rows = ([OrderedDict({'Consensus': 'epfu', 'HiF': 'n/a'})] * 200 +
+            [OrderedDict({'Consensus': 'mylu', 'HiF': '30'})] * 200)
+    expected = [ruleset.test(row) for row in rows]
+
+    # HiF rejects every row that it does not fail to convert, but is still
+    # tested after Consensus, which does not raise for invalid numbers
+    ruleset.optimize(rows)
+    assert ruleset.rules[0].order == ['Consensus', 'HiF']
+    assert [ruleset.test(row) for row in rows] == expected == [['EPFU']] * 200 + [None] * 200
+
+
+def test_match_memo(monkeypatch):
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '>2', 'ret': 'one and >2'}),
+            OrderedDict({'foo': 'two', 'bar': '1-2', 'ret': 'two'}),
+        ],
+        result_cols=('ret', )
+    )
+    rows = [
+        OrderedDict({'foo': foo, 'bar': bar})
+        for foo in ('one', ' TWO ', 'three', '')
+        for bar in (0, 1, 1.5, 2, 2.5, 3, 10, '', 'blank')
+    ]
+    expected = [ruleset.match(row) for row in rows]
+
+    memo = ruleset.memo = MatchMemo(ruleset, maxsize=100)
+    assert [ruleset.match(row) for row in rows * 2] == expected * 2
+    # numbers in the same region between breakpoints share a key
+    assert memo.key(ruleset.plan({'foo': 'one', 'bar': 3})) == \
+        memo.key(ruleset.plan({'foo': 'one', 'bar': 10}))
+    assert memo.key(ruleset.plan({'foo': 'one', 'bar': 2})) != \
+        memo.key(ruleset.plan({'foo': 'one', 'bar': 2.5}))
+    # 5 regions for breakpoints 1 and 2, and blank
+    assert memo.misses == 4 * 6
+    assert memo.hits == len(rows) * 2 - memo.misses
+
+    # least recently used values are removed
+    memo = ruleset.memo = MatchMemo(ruleset, maxsize=2)
+    for foo in ('one', 'two', 'one', 'three', 'one', 'two'):
+        ruleset.match({'foo': foo, 'bar': 1})
+    assert (memo.hits, memo.misses) == (2, 4)
+
+    # memo is turned off if values rarely repeat
+    monkeypatch.setattr(ruleset_module, 'MEMO_WARMUP', 10)
+    memo = ruleset.memo = MatchMemo(ruleset)
+    for i in range(20):
+        assert ruleset.match({'foo': str(i), 'bar': 1}) is None
+    assert not memo.active
+    assert memo.misses == 10
+
+
 #TODO: test multiple return values
 
 # TODO: Validation tests
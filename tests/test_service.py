@@ -0,0 +1,111 @@
+import json
+import threading
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+from echoclean import service as service_module
+from echoclean.service import ClassifyService, QueueFull, _run_job, make_server
+
+from .conftest import DATA, RULES, write_csv
+
+
+@pytest.fixture
+def service():
+    service = ClassifyService(jobs=1, queue_size=0)
+    yield service
+    service.close()
+
+
+def request(server, path, body=None):
+    url = 'http://{0}:{1}{2}'.format(*(server.server_address + (path, )))
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urlopen(Request(url, data=data)) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_service(tmp_path, service):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        job = {'rules': str(tmp_path / 'rules.csv'), 'data': str(tmp_path / 'data.csv'),
+               'format': 'csv', 'wait': True}
+        for rules_cached in (False, True):
+            status, result = request(server, '/jobs', job)
+            assert status == 200
+            assert result['status'] == 'done'
+            assert (result['rows'], result['classified']) == (3, 2)
+            assert result['rules_cached'] == rules_cached
+
+        assert result['output'] == str(tmp_path / 'data_out.csv')
+        assert (tmp_path / 'data_out.csv').exists()
+        assert request(server, '/jobs/{0}'.format(result['id'])) == (200, result)
+
+        status, result = request(server, '/jobs', dict(job, data=str(tmp_path / 'missing.csv')))
+        assert status == 400
+        assert 'data file not found' in result['error']
+
+        status, result = request(server, '/jobs', dict(job, night_cutoff=24))
+        assert status == 400
+        assert 'night_cutoff' in result['error']
+
+        status, result = request(server, '/jobs', [job])
+        assert status == 400
+        assert result['error'] == 'job must be a JSON object'
+
+        status, stats = request(server, '/stats')
+        assert status == 200
+        assert (stats['completed'], stats['rows'], stats['queue_depth']) == (2, 6, 0)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_queue_full(tmp_path, service):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+
+    job_id = service.submit(str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'))
+    # the only worker is busy and no jobs may wait
+    with pytest.raises(QueueFull):
+        service.submit(str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'))
+
+    assert service.wait(job_id)['status'] == 'done'
+    assert service.stats()['rejected'] == 1
+
+
+def test_relative_paths(tmp_path, service, monkeypatch):
+    write_csv(tmp_path / 'rules.csv', RULES)
+    write_csv(tmp_path / 'data.csv', DATA)
+    monkeypatch.chdir(tmp_path)
+
+    job_id = service.submit('rules.csv', 'data.csv', output='out.csv')
+    record = service.wait(job_id)
+    assert record['status'] == 'done'
+    assert [record[key] for key in ('rules', 'data', 'output')] == [
+        str(tmp_path / 'rules.csv'), str(tmp_path / 'data.csv'), str(tmp_path / 'out.csv')]
+
+
+def test_worker_rules_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(service_module, 'WORKER_RULES', 2)
+    monkeypatch.setattr(service_module, '_worker_rules', service_module.OrderedDict())
+    write_csv(tmp_path / 'data.csv', DATA)
+    for name in ('a.csv', 'b.csv', 'c.csv'):
+        write_csv(tmp_path / name, RULES)
+
+    for name in ('a.csv', 'b.csv', 'a.csv', 'c.csv'):
+        _run_job(str(tmp_path / name), str(tmp_path / 'data.csv'), str(tmp_path / 'out.csv'),
+                 'csv', 'linear', None, 12, False)
+
+    # b.csv was used least recently
+    assert list(service_module._worker_rules) == [str(tmp_path / 'a.csv'), str(tmp_path / 'c.csv')]
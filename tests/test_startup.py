@@ -0,0 +1,31 @@
+import sys
+import time
+import subprocess
+
+
+# Maximum seconds to import the command line interface, beyond starting Python
+STARTUP_BUDGET = 0.25
+
+# Modules that are slow to import, and are only needed for some options
+DEFERRED_MODULES = ('openpyxl', 'numpy', 'pyarrow', 'multiprocessing', 'six')
+
+
+def run_python(code):
+    start = time.perf_counter()
+    subprocess.check_output([sys.executable, '-c', code])
+    return time.perf_counter() - start
+
+
+def test_deferred_imports():
+    output = subprocess.check_output([sys.executable, '-c', (
+        'import sys; import echoclean.cli; '
+        'print(" ".join(m for m in {0!r} if m in sys.modules))'.format(DEFERRED_MODULES))])
+    assert output.decode().strip() == ''
+
+
+def test_startup_time():
+    run_python('import echoclean.cli')  # compile modules, if needed
+
+    python = min(run_python('pass') for _ in range(3))
+    startup = min(run_python('import echoclean.cli') for _ in range(3))
+    assert startup - python < STARTUP_BUDGET
@@ -0,0 +1,17 @@
+from echoclean.storage import load_pickle, save_pickle
+
+
+def test_save_load_pickle(tmp_path):
+    filename = str(tmp_path / 'state.pickle')
+    assert load_pickle(filename) is None
+
+    save_pickle({'rows': 1}, filename, version=2)
+    assert load_pickle(filename, version=2) == {'rows': 1}
+    assert load_pickle(filename, version=3) is None
+    assert [path.name for path in tmp_path.iterdir()] == ['state.pickle']
+
+    save_pickle([1, 2], filename)
+    assert load_pickle(filename) == [1, 2]
+
+    (tmp_path / 'state.pickle').write_bytes(b'not a pickle')
+    assert load_pickle(filename, version=2) is None
@@ -0,0 +1,81 @@
+import random
+from collections import OrderedDict
+
+import pytest
+
+from echoclean.ruleset import Ruleset
+
+np = pytest.importorskip('numpy')
+
+from echoclean.vectorized import classify_columns, classify_rows, result_columns
+
+
+CRITERIA = ['', 'blank', 'any', 'one', 'one, two', 'two, or blank', 'not one',
+            'not blank', '3-6', '<1', '<=1', '2', '>10', '>=10']
+
+VALUES = ['', None, 'one', 'two', 'three', ' ONE ', 'blank', 0, 1, 2, 2.5, 3,
+          '4', 6, 10, 11, '12.5']
+
+
+def test_vectorized_matches_linear():
+    rnd = random.Random(0)
+    for _ in range(20):
+        rules = [
+            OrderedDict([('foo', rnd.choice(CRITERIA)), ('bar', rnd.choice(CRITERIA)),
+                         ('ret', 'rule {}'.format(i))])
+            for i in range(30)
+        ]
+        ruleset = Ruleset(rules, result_cols=('ret', ))
+
+        rows = []
+        for foo in VALUES:
+            for bar in VALUES:
+                row = OrderedDict([('foo', foo), ('bar', bar)])
+                try:
+                    ruleset.test(row)
+                except ValueError:
+                    # non-numeric value reached a numeric criterion
+                    continue
+                rows.append(row)
+
+        expected = [ruleset.match(row) for row in rows]
+        indexes = classify_columns(
+            ruleset, {key: [row[key] for row in rows] for key in ('foo', 'bar')})
+        assert [None if i < 0 else i for i in indexes] == expected
+
+        for row, result in classify_rows(ruleset, rows, chunk_size=7):
+            assert result == ruleset.test(row)
+
+
+def test_result_columns():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': '>2', 'ret': '>2', 'other': 'a'}),
+            OrderedDict({'foo': 'blank', 'ret': 'blank', 'other': 'b'}),
+        ],
+        result_cols=('ret', 'other')
+    )
+
+    indexes = classify_columns(ruleset, {'foo': [3, '', 1, '5']})
+    assert indexes.tolist() == [0, 1, -1, 0]
+
+    results = result_columns(ruleset, indexes)
+    assert results['ret'].tolist() == ['>2', 'blank', None, '>2']
+    assert results['other'].tolist() == ['a', 'b', None, 'a']
+
+
+def test_invalid_number():
+    ruleset = Ruleset(
+        [
+            OrderedDict({'foo': 'one', 'bar': '', 'ret': 'one'}),
+            OrderedDict({'foo': '', 'bar': '>2', 'ret': '>2'}),
+        ],
+        result_cols=('ret', )
+    )
+
+    # Only rows that reach the numeric criterion are converted
+    indexes = classify_columns(ruleset, {'foo': ['one'], 'bar': ['abc']})
+    assert indexes.tolist() == [0]
+
+    with pytest.raises(ValueError):
+        classify_columns(ruleset, {'foo': ['two'], 'bar': ['abc']})
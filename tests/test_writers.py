@@ -0,0 +1,84 @@
+import csv
+import sqlite3
+
+from echoclean.summary import Summary
+from echoclean.writers import DelimitedWriter, SQLiteWriter, output_filename
+
+
+def test_output_filename():
+    assert output_filename(None, 'data.csv') == ('data_out.xlsx', 'xlsx')
+    assert output_filename(None, 'data.csv', 'csv') == ('data_out.csv', 'csv')
+    assert output_filename('results', 'data.csv') == ('results.xlsx', 'xlsx')
+    assert output_filename('results.csv', 'data.csv') == ('results.csv', 'csv')
+    assert output_filename('results.txt', 'data.csv') == ('results.txt', 'tsv')
+    assert output_filename('results.csv', 'data.csv', 'xlsx') == ('results.csv.xlsx', 'xlsx')
+    assert output_filename('results.db', 'data.csv') == ('results.db', 'sqlite')
+
+
+def test_delimited_writer(tmp_path):
+    summary = Summary(['Species'])
+    summary.add(['MYLU'], '06/01/2019')
+    summary.add(['EPFU'], '06/01/2019')
+    summary.add(None, '06/02/2019')
+
+    filename = str(tmp_path / 'out.tsv')
+    writer = DelimitedWriter(filename, delimiter='\t')
+    writer.write_header(['Species', 'night'])
+    writer.write_row(['MYLU', '06/01/2019'])
+    writer.write_row([None, '06/02/2019'])
+    for title, header, rows in summary.tables():
+        writer.write_table(title, header, rows)
+    writer.close()
+
+    with open(filename) as f:
+        assert list(csv.reader(f, delimiter='\t')) == [
+            ['Species', 'night'], ['MYLU', '06/01/2019'], ['', '06/02/2019']]
+
+    with open(str(tmp_path / 'out_night_classification_summary.tsv')) as f:
+        assert list(csv.reader(f, delimiter='\t')) == [
+            ['Night', 'Rows Classified', 'Rows Not Classified', 'Total Rows'],
+            ['06/01/2019', '2', '0', '2'],
+            ['06/02/2019', '0', '1', '1']]
+
+    with open(str(tmp_path / 'out_species_summary.tsv')) as f:
+        assert list(csv.reader(f, delimiter='\t')) == [
+            ['Value', 'Rows Classified'], ['EPFU', '1'], ['MYLU', '1']]
+
+
+def test_sqlite_writer(tmp_path):
+    filename = str(tmp_path / 'out.sqlite')
+
+    writer = SQLiteWriter(filename, index_columns=['Species', 'night'], batch_size=1)
+    writer.write_header(['Species', 'night', 'HiF'])
+    writer.write_row(['MYLU', '06/01/2019', 45])
+    writer.write_row(['', '06/02/2019', 10])
+    writer.write_table('Classification Summary', ['Classified', 'Count'], [['Yes', 1], ['No', 1]])
+    writer.close()
+
+    # a later run adds its rows, and any new columns
+    writer = SQLiteWriter(filename, index_columns=['Species', 'night'],
+                          run_info={'data': '/site2/data.csv', 'rules': '/rules.csv'})
+    writer.write_header(['Species', 'Inspect', 'night', 'HiF'])
+    writer.write_row(['EPFU', 'Yes', '01/03/2019', 20])
+    writer.write_table('Classification Summary', ['Classified', 'Count'], [['Yes', 1], ['No', 0]])
+    writer.write_table('Night Summary', ['Night', 'Total Rows'], [['01/03/2019', 1]])
+    writer.close()
+
+    db = sqlite3.connect(filename)
+    assert db.execute('SELECT run_id, results, rows, data, rules FROM runs').fetchall() == [
+        (1, 'classify_results', 2, None, None),
+        (2, 'classify_results', 1, '/site2/data.csv', '/rules.csv')]
+    # nights are stored as YYYY-MM-DD, so they sort in order of date
+    assert db.execute('SELECT run_id, Species, Inspect, night, HiF FROM classify_results '
+                      'ORDER BY night').fetchall() == [
+        (2, 'EPFU', 'Yes', '2019-01-03', 20),
+        (1, 'MYLU', None, '2019-06-01', 45),
+        (1, '', None, '2019-06-02', 10)]
+    assert db.execute('SELECT * FROM classification_summary WHERE run_id = 2').fetchall() == [
+        (2, 'Yes', 1), (2, 'No', 0)]
+    assert db.execute('SELECT * FROM night_summary').fetchall() == [(2, '2019-01-03', 1)]
+
+    indexes = [row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name")]
+    assert indexes == ['classify_results_night', 'classify_results_species']
+    db.close()
@@ -0,0 +1,66 @@
+from datetime import time
+
+from openpyxl import Workbook
+
+from echoclean.xlsx_dictreader import DictReader, guess_type
+
+
+def test_read_only(tmp_path):
+    filename = str(tmp_path / 'data.xlsx')
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append(['Filename', 'Consensus', 'HiF', None, 'Ignored'])
+    worksheet.append(['a.wav', 'MYLU', '45', None, 'x'])
+    worksheet.append(['b.wav', None, 12.5])
+    worksheet.append([])
+    worksheet.append(['c.wav', '10%', '3'])
+    workbook.create_sheet('Other').append(['foo', 'bar'])
+    workbook.save(filename)
+
+    expected = DictReader.from_file(filename)
+    reader = DictReader.from_file(filename, read_only=True)
+
+    assert reader.fieldnames == expected.fieldnames == ['Filename', 'Consensus', 'HiF']
+
+    rows = [dict(row) for row in reader]
+    assert rows == [dict(row) for row in expected]
+    # strings are converted to numbers in the same way as guess_types
+    assert rows[0]['HiF'] == 45
+    assert rows[3]['Consensus'] == 0.1
+
+    reader.close()
+
+    reader = DictReader.from_file(filename, index=1, read_only=True)
+    assert reader.fieldnames == ['foo', 'bar']
+    assert list(reader) == []
+    reader.close()
+
+
+def test_iter_values(tmp_path):
+    filename = str(tmp_path / 'data.xlsx')
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append(['Filename', 'Consensus', 'HiF'])
+    worksheet.append(['a.wav', 'MYLU', '45'])
+    worksheet.append(['b.wav', None, 12.5])
+    workbook.save(filename)
+
+    for read_only in (False, True):
+        expected = [list(row.values()) for row in DictReader.from_file(filename, read_only=read_only)]
+        reader = DictReader.from_file(filename, read_only=read_only)
+        assert list(reader.iter_values()) == expected
+
+
+def test_guess_type():
+    values = ['45', '-1.5', '.5', '1e3', '012', '10%', '-2.5 %', '22:15', '22:15:30',
+              '01:02.345', 'MYLU', '=A1', '#N/A', '', '1,000', None, 3]
+    assert [guess_type(value) for value in values] == [
+        45, -1.5, 0.5, 1000.0, '012', 0.1, -0.025, time(22, 15), time(22, 15, 30),
+        time(0, 1, 2, 345000), 'MYLU', '=A1', '#N/A', '', '1,000', None, 3]
+
+    # the same values as workbooks opened with guess_types
+    worksheet = Workbook().active
+    worksheet.parent.guess_types = True
+    for value in values:
+        worksheet['A1'] = value
+        assert guess_type(value) == worksheet['A1'].value